@@ -3,9 +3,19 @@
 #
 from axeshome.api import app
 
-def start_server(debug=False, port=5002):
+def start_server(debug=False, port=5002, use_gevent=False):
+    """
+    Run the development server. With use_gevent, requests are served by a
+    gevent WSGI server; gevent must have patched the standard library before
+    axeshome was imported.
+    """
     if debug:
         import logging
         logging.getLogger('axeshome').setLevel(logging.DEBUG)
-    app.run(debug=debug, port=port)
+    if use_gevent:
+        from gevent.pywsgi import WSGIServer
+        app.debug = debug
+        WSGIServer(('', port), app).serve_forever()
+    else:
+        app.run(debug=debug, port=port)
     
\ No newline at end of file
@@ -10,8 +10,8 @@ import logging.config
 
 from flask import Flask, Response
 from flask.ext.restful import Api
-from flask.ext.pymongo import PyMongo
 from flask.ext.login import LoginManager
+from axeshome.metrics import MeteredPyMongo
 
 # Flask app
 app = Flask(__name__)
@@ -36,7 +36,55 @@ from axeshome.util import AxesURIConverter
 app.url_map.converters['axes'] = AxesURIConverter
 
 # Database
-mongo = PyMongo(app)
+mongo = MeteredPyMongo(app)
+
+# Create database indexes once per process
+if app.config['MONGO_ENSURE_INDEXES']:
+    @app.before_first_request
+    def create_indexes():
+        from axeshome.indexes import ensure_indexes
+        try:
+            ensure_indexes(mongo.db, app.config)
+        except Exception as e:
+            logging.getLogger('axeshome').error(
+                'Failed to create indexes: %s', e)
+
+# Compact history and bookmarks saved by older versions once, in the 
+# background
+if app.config['COMPACT_ASSET_ITEMS']:
+    @app.before_first_request
+    def compact_asset_items():
+        import axeshome.user as user
+        try:
+            user.start_compactor()
+        except Exception as e:
+            logging.getLogger('axeshome').error(
+                'Failed to start compacting history: %s', e)
+
+# Request metrics. The after request hook is registered first so that it 
+# runs last, after compression.
+from axeshome.metrics import start_request, finish_request
+app.before_request(start_request)
+app.after_request(finish_request)
+
+# Profiling of sampled and slow requests
+import axeshome.profiling as profiling
+app.before_request(profiling.start_request)
+app.after_request(profiling.finish_request)
+app.teardown_request(profiling.teardown_request)
+
+# Response compression
+if app.config['COMPRESS_ENABLED']:
+    from axeshome.compress import compress_response
+    app.after_request(compress_response)
+
+# Flag responses that used stale results because LIMAS was unavailable
+@app.after_request
+def add_stale_warning(response):
+    from axeshome.backend import is_stale
+    if is_stale():
+        response.headers.add('Warning', '110 - "Response is Stale"')
+    return response
 
 # Login manager subsystem
 login_manager = LoginManager(app)
@@ -46,6 +94,8 @@ login_manager.token_loader(user.find_for_token)
 
 # Api
 api = Api(app)
+from axeshome.representations import output_json
+api.representation('application/json')(output_json)
 import axeshome.resources as resources
 
 # Available services
@@ -55,9 +105,11 @@ api.add_resource(resources.AvailableServices, '/available-services')
 api.add_resource(resources.SimpleSearch, '/search')
 api.add_resource(resources.ImageSearch, '/image-search')
 api.add_resource(resources.AdvancedSearch, '/advanced-search')
+api.add_resource(resources.Suggest, '/suggest')
 
 # Assets
 api.add_resource(resources.Asset, '/assets/<axes:uri>')
+api.add_resource(resources.AssetBundle, '/asset-bundle/<axes:uri>')
 api.add_resource(resources.VideoStats, '/video-stats/<axes:uri>')
 api.add_resource(resources.RelatedVideos, '/related-videos/<axes:uri>')
 api.add_resource(resources.RelatedSegments, '/related-segments/<axes:uri>')
@@ -98,6 +150,12 @@ api.add_resource(resources.UserBookmark, '/user/bookmarks/<axes:uri>')
 api.add_resource(resources.ServiceInfo, '/service-info')
 api.add_resource(resources.VersionInfo, '/version-info')
 api.add_resource(resources.DatasetInfo, '/dataset-info')
+api.add_resource(resources.ConnectionPoolStats, '/service-pool-stats')
+api.add_resource(resources.UserLogStats, '/service-userlog-stats')
+api.add_resource(resources.Metrics, '/metrics')
+api.add_resource(resources.Profiles, '/profiles')
+api.add_resource(resources.Profile, '/profiles/<profile_id>')
+api.add_resource(resources.ProfileData, '/profiles/<profile_id>/data')
 
 # Override flask restful unauthorized handler so that the browser does 
 # not pop up a basic auth dialog
@@ -5,15 +5,31 @@
 Interface to the link management and search system (LIMAS)
 """
 import jsonrpclib
+import os
 import time
+import socket
+import httplib
+import xmlrpclib
 import json
 import warnings
 import logging
+import threading
 
 from functools import wraps
-from flask import current_app as app
+from flask import current_app as app, g, has_app_context
+from werkzeug.exceptions import ServiceUnavailable
 
 from axeshome.postprocess import RegexPostprocessor
+from axeshome.rpcpool import ConnectionPool, PoolTimeout
+from axeshome.circuit import CircuitBreaker, CircuitOpen
+from axeshome.concurrency import get_pool_size
+from axeshome.singleflight import SingleFlight
+from axeshome.cache import get_result_cache, MISSING
+from axeshome.serialize import get_marshaller
+from axeshome.metrics import timer, timed_stage, LIMAS_TIME, STAGE_TIME
+from axeshome.util import canonical_clauses, encode_clauses, query_key
+
+import axeshome.marshal as objects
 
 log = logging.getLogger('axeshome')
 
@@ -21,15 +37,7 @@ def encode_query(parsed_query):
     """
     Take a parsed query and encode it to a query string.
     """
-    def escape_parens(value):
-        return value.replace('(', '\\(').replace(')', '\\)')
-    encoded_clauses = []
-    for clause in parsed_query['clauses']:
-        type = clause['type']
-        text = escape_parens(clause['text'])
-        encoded_clause = '{}({})'.format(type, text)
-        encoded_clauses.append(encoded_clause)
-    return ' '.join(encoded_clauses)
+    return encode_clauses(canonical_clauses(parsed_query['clauses']))
 
 def create_limas_query_from_parsed_query(parsed_query):
     """
@@ -75,16 +83,34 @@ def get_evidence_for_item(search_results, item):
     item_evidence = []
     for i, score in enumerate(item['scores']):
         if score > 0:
-            evidence = search_results['evidence'][i]
+            evidence = dict(search_results['evidence'][i])
             evidence['score'] = score
             item_evidence.append(evidence)
     return item_evidence
+
+# Asset fields that come from the video rather than the result fragment
+VideoAssetFields = dict((key, objects.Asset[key]) for key in 
+    ('metadata', 'videoDuration', 'videoSources', 'videoKeyframe'))
     
+@timed_stage('collect')
 def collect_results(search_results):
     """
     Translate a limas SearchResult object into a flat unified ranked list
     of segments and videos with simplified and identical data interfaces.
+    
+    Results are postprocessed and marshalled to objects.SearchResult as 
+    they are collected. The video fields of the assets are cleaned, 
+    postprocessed and marshalled once per video and shared between the 
+    results from that video.
     """
+    marshal_result = get_marshaller(objects.SearchResult)
+    marshal_video = get_marshaller(VideoAssetFields)
+    postprocess = postprocess_limas_results
+    
+    if search_results.get('evidence', None) is not None:
+        postprocess(search_results['evidence'], 'evidence')
+    
+    video_fields = {}
     ranked_list = []
     
     for item in search_results['ranking']:
@@ -96,7 +122,6 @@ def collect_results(search_results):
             segment = search_results['segments'][uri]
             segment_uri = uri
             video_uri = segment['videoUri']
-            video = search_results['videos'][video_uri]
             fragment = segment
             
         elif item['type'] == 'Video':
@@ -105,8 +130,7 @@ def collect_results(search_results):
             segment = None
             segment_uri = None
             video_uri = uri
-            video = search_results['videos'][video_uri]
-            fragment = video
+            fragment = search_results['videos'][video_uri]
             
         else:
             
@@ -114,6 +138,18 @@ def collect_results(search_results):
             warnings.warn('result type is {}'.format(item['type']))
             continue
         
+        # Video fields, once per video
+        video_asset = video_fields.get(video_uri)
+        if video_asset is None:
+            video = search_results['videos'][video_uri]
+            video_asset = {}
+            video_asset['metadata'] = clean_metadata(video['metadata'])
+            video_asset['videoDuration'] = video['durationMillis']
+            video_asset['videoSources'] = video['sources']
+            video_asset['videoKeyframe'] = video['keyframe']
+            video_asset = marshal_video(postprocess(video_asset, 'asset'))
+            video_fields[video_uri] = video_asset
+        
         # Create asset
         asset = {}
         asset['uri'] = uri
@@ -125,11 +161,9 @@ def collect_results(search_results):
         asset['endTime'] = fragment['endTimeMillis']
         asset['segmentDuration'] = fragment['durationMillis']
         asset['speech'] = fragment['speech']
-        asset['metadata'] = clean_metadata(video['metadata'])
-        asset['videoDuration'] = video['durationMillis']
-        asset['videoSources'] = video['sources']
-        asset['videoKeyframe'] = video['keyframe']
         asset['visualTags'] = fragment.get('visualTags', [])
+        postprocess(asset, 'asset')
+        asset.update(video_asset)
         
         # Create result
         result = {}
@@ -142,7 +176,7 @@ def collect_results(search_results):
         # Attach asset
         result['asset'] = asset
         
-        ranked_list.append(result)
+        ranked_list.append(marshal_result(result))
         
     return ranked_list
     
@@ -188,12 +222,24 @@ def video_to_asset(uri, video):
     asset['visualTags'] = video.get('visualTags', [])
     return asset
     
-def postprocess_limas_results(results):
-    postprocessors = [
-        RegexPostprocessor(app.config['LIMAS_RESPONSE_POSTPROCESSING_RULES'])
-    ]
-    for postprocessor in postprocessors:
-        postprocessor.process(results)
+_postprocessors = None
+
+def get_postprocessors():
+    """
+    Returns the list of limas response postprocessors. These are compiled
+    from the app config on first use.
+    """
+    global _postprocessors
+    if _postprocessors is None:
+        _postprocessors = [
+            RegexPostprocessor(
+                app.config['LIMAS_RESPONSE_POSTPROCESSING_RULES'])
+        ]
+    return _postprocessors
+    
+def postprocess_limas_results(results, name=None):
+    for postprocessor in get_postprocessors():
+        postprocessor.process(results, name)
     return results
     
 def fix_uri(uri):
@@ -207,35 +253,242 @@ def fix_uri(uri):
     
 class LimasError(Exception):
     pass
+
+class LimasUnavailable(LimasError, ServiceUnavailable):
+    """
+    Raised without calling LIMAS while it is considered down. Unhandled,
+    it is reported to the client as 503 Service Unavailable.
+    """
+    description = 'The search service is temporarily unavailable'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    """
+    Returns the LIMAS connection pool for this process, creating it if 
+    necessary. Forked workers get a fresh pool rather than sharing the 
+    parent's sockets.
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(app.config['SERVICE_URL'],
+                size=get_pool_size('LIMAS_POOL_SIZE'),
+                timeout=app.config['LIMAS_POOL_TIMEOUT'],
+                idle_timeout=app.config['LIMAS_POOL_IDLE_TIMEOUT'],
+                health_check=app.config['LIMAS_POOL_HEALTH_CHECK'],
+                health_check_interval=
+                    app.config['LIMAS_POOL_HEALTH_CHECK_INTERVAL'])
+        return _pool
+
+_breaker = None
+_breaker_pid = None
+_breaker_lock = threading.Lock()
+
+def get_circuit_breaker():
+    """
+    Returns the LIMAS circuit breaker for this process.
+    """
+    global _breaker, _breaker_pid
+    with _breaker_lock:
+        if _breaker is None or _breaker_pid != os.getpid():
+            _breaker = CircuitBreaker(
+                failure_threshold=app.config['LIMAS_BREAKER_FAILURES'],
+                reset_timeout=app.config['LIMAS_BREAKER_RESET_TIMEOUT'],
+                slow_call_time=app.config['LIMAS_BREAKER_SLOW_CALL_TIME'],
+                name='LIMAS circuit')
+            _breaker_pid = os.getpid()
+        return _breaker
+
+def get_connection_pool_stats():
+    """
+    Returns usage statistics for this process's LIMAS connection pool,
+    circuit breaker and call coalescing.
+    """
+    stats = get_connection_pool().get_stats()
+    stats['pid'] = os.getpid()
+    stats['circuit'] = get_circuit_breaker().get_stats()
+    stats['singleFlight'] = get_single_flight().get_stats()
+    return stats
+
+def get_timeout(name):
+    """
+    Returns the timeout in seconds for calls made by the named function.
+    """
+    return app.config['LIMAS_TIMEOUTS'].get(name, app.config['LIMAS_TIMEOUT'])
     
 def with_limas(func):
     """
     Decorator to inject limas JSON RPC service instance as first argument to 
-    function, and pass results through a post-processing step.
+    function, and pass results through a post-processing step. The service
+    instance is a pooled keep-alive connection.
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        service = jsonrpclib.Server(app.config['SERVICE_URL'])
+        breaker = get_circuit_breaker()
+        try:
+            breaker.before_call()
+        except CircuitOpen as e:
+            raise LimasUnavailable('LIMAS unavailable ({}): {}'.format(
+                func.__name__, e))
         
+        start = time.time()
         try:
-            results = func(service, *args, **kwargs)
+            timeout = get_timeout(func.__name__)
+            with timer(LIMAS_TIME, (func.__name__,), 'limas'):
+                with get_connection_pool().connection(timeout) as service:
+                    results = func(service, *args, **kwargs)
+        
+        except PoolTimeout as e:
+            # LIMAS wasn't called, so this says nothing about its health
+            breaker.cancel_call()
+            error_msg = 'Pool timeout ({}): {}'.format(func.__name__, e)
+            log.error(error_msg)
+            raise LimasUnavailable(error_msg)
         
         except jsonrpclib.ProtocolError as e:
             error_msg = e.message
             
             # jsonrpclib sometimes passes a tuple to Protocol error :(
             if isinstance(error_msg, tuple) and len(error_msg) == 2:
+                # A fault returned by LIMAS: the service itself is up
+                breaker.record_success()
                 error_msg = '{} (code: {})'.format(error_msg[1], error_msg[0])
+            else:
+                breaker.record_failure()
             error_msg = 'Protocol error ({}): {}'.format(func.__name__, error_msg)
             
             # Log error and re-raise
             log.error(error_msg)
             raise LimasError(error_msg, e)
         
+        except xmlrpclib.ProtocolError as e:
+            # An HTTP error status from LIMAS or a proxy in front of it
+            breaker.record_failure()
+            error_msg = 'HTTP error ({}): {} {}'.format(func.__name__, 
+                e.errcode, e.errmsg)
+            log.error(error_msg)
+            raise LimasError(error_msg, e)
+        
+        except (socket.error, httplib.HTTPException) as e:
+            # Includes socket.timeout
+            breaker.record_failure()
+            error_msg = 'Connection error ({}): {!r}'.format(func.__name__, e)
+            log.error(error_msg)
+            raise LimasError(error_msg, e)
+        
+        except ValueError as e:
+            # Includes responses that aren't valid JSON-RPC
+            breaker.record_failure()
+            error_msg = 'Invalid response ({}): {}'.format(func.__name__, e)
+            log.error(error_msg)
+            raise LimasError(error_msg, e)
+        
+        except Exception:
+            # An error handling the results says nothing about LIMAS
+            breaker.cancel_call()
+            raise
+        
+        breaker.record_success(time.time() - start)
+        
         # Apply postprocessors
-        return postprocess_limas_results(results)
+        with timer(STAGE_TIME, ('postprocess',), 'postprocess'):
+            return postprocess_limas_results(results)
     
     return wrapper
+
+def cached_results(key_func):
+    """
+    Decorator to cache the results of a limas function in the result cache.
+    The key function is called with the function arguments and should 
+    return a JSON serializable value identifying the query. Cached results 
+    are shared between requests and must not be modified.
+    
+    Concurrent misses for the same key in a process share one call. With 
+    SINGLE_FLIGHT_SHARED set, workers also wait for a call in progress in 
+    another worker, using a lock in the shared cache.
+    
+    If LIMAS fails, the last results cached for the query are returned 
+    instead, if there are any, and the response is flagged as stale.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not app.config['RESULT_CACHE_ENABLED']:
+                return func(*args, **kwargs)
+            result_cache = get_result_cache()
+            parts = key_func(*args, **kwargs)
+            stale_key = result_cache.make_stale_key(func.__name__, parts)
+            try:
+                key = result_cache.make_key(func.__name__, parts)
+                results = result_cache.get(key)
+                if results is MISSING:
+                    results = get_single_flight().do(key, load_results, 
+                        result_cache, key, stale_key, func, args, kwargs)
+            except LimasError:
+                results = result_cache.get_stale(stale_key)
+                if results is MISSING:
+                    raise
+                log.warn('Serving stale results for %s', func.__name__)
+                flag_stale()
+            return results
+        return wrapper
+    return decorator
+
+def load_results(result_cache, key, stale_key, func, args, kwargs):
+    """
+    Call a cached function after a cache miss and cache its results.
+    """
+    # The results may have been stored since the miss
+    results = result_cache.get(key)
+    if results is not MISSING:
+        return results
+    locked = False
+    if app.config['SINGLE_FLIGHT_SHARED']:
+        timeout = app.config['SINGLE_FLIGHT_LOCK_TIMEOUT']
+        locked = result_cache.lock(key, timeout)
+        if not locked:
+            # Another worker is calling LIMAS: wait for its results
+            results = result_cache.wait(key, timeout)
+            if results is not MISSING:
+                return results
+    try:
+        results = func(*args, **kwargs)
+        result_cache.set(key, results, stale_key)
+    finally:
+        if locked:
+            result_cache.unlock(key)
+    return results
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+def get_single_flight():
+    """
+    Returns the single flight group for calls to cached functions.
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
+
+def flag_stale():
+    """
+    Flag the response to the current request as stale.
+    """
+    if has_app_context():
+        g.limas_stale = True
+
+def is_stale():
+    """
+    Returns true if stale results were used for the current request.
+    """
+    return getattr(g, 'limas_stale', False)
     
 #
 # Limas interface
@@ -245,12 +498,14 @@ def with_limas(func):
 def get_available_services(limas):
     return map(str, limas.getAvailableServices())
 
+@cached_results(lambda text: query_key(text))
 @with_limas
 def simple_search(limas, text):
     query = create_magic_search_query_from_string(text)
     results = limas.search(query)
     return collect_results(results)
 
+@cached_results(lambda text, clauses: query_key(text, clauses))
 @with_limas
 def advanced_search(limas, text, clauses):
     query = {'queryText': text, 'clauses': clauses}
@@ -284,6 +539,7 @@ def get_query_for_item(limas, uri):
     uri = fix_uri(uri)
     return limas.getQueryForItem(uri)
     
+@cached_results(lambda uri: fix_uri(uri))
 @with_limas
 def search_news_source(limas, uri):
     uri = fix_uri(uri)
@@ -291,6 +547,7 @@ def search_news_source(limas, uri):
     results = limas.searchWithParsedQuery(query)
     return collect_results(results)
 
+@cached_results(lambda uri: fix_uri(uri))
 @with_limas
 def search_news_item(limas, uri):
     uri = fix_uri(uri)
@@ -341,25 +598,61 @@ def get_face_tracks(limas, uri):
     uri = fix_uri(uri)
     return limas.getFaceTracks(uri)
     
+def index_by_uri(items):
+    """
+    Key the items returned by a LIMAS lookup by their URIs. LIMAS may leave
+    out items that it can't find, so results are not matched by position.
+    """
+    return dict((fix_uri(item['uri']), item) for item in items or [] 
+        if item is not None)
+
 @with_limas
-def lookup_asset(limas, uri):
-    uri = fix_uri(uri)
+def lookup_assets(limas, uris):
+    """
+    Look up a list of assets. Returns a list of the same length as uris
+    with None in place of assets that could not be found. Segments and their
+    videos are fetched in two batched lookups, regardless of how many URIs
+    are requested.
+    """
     options = dict(spokenWords=True, metadata=True, entityOccurrences=True)
-    result = limas.lookup([uri], options)
-    if len(result) == 0:
-        return None
-    result = result[0]
-    if result is None:
-        return None
-    video_uri = result['videoUri']
-    is_segment = video_uri != uri
-    if is_segment:
-        video = limas.lookup([video_uri], options)
-        if len(video) == 0:
-            return None
+    uris = [fix_uri(uri) for uri in uris]
+    
+    # Fetch each distinct URI once
+    unique_uris = list(set(uris))
+    if not unique_uris:
+        return []
+    items = index_by_uri(limas.lookup(unique_uris, options))
+    
+    # Fetch videos for segments not already fetched
+    video_uris = set()
+    for uri, item in items.iteritems():
+        if item['videoUri'] != uri:
+            video_uris.add(item['videoUri'])
+    video_uris = list(video_uris.difference(items))
+    if video_uris:
+        items.update(index_by_uri(limas.lookup(video_uris, options)))
+    
+    # Assemble assets
+    assets = []
+    for uri in uris:
+        item = items.get(uri)
+        if item is None:
+            assets.append(None)
+            continue
+        video_uri = item['videoUri']
+        if video_uri == uri:
+            assets.append(video_to_asset(uri, item))
+        elif items.get(video_uri) is not None:
+            assets.append(segment_to_asset(uri, item, items[video_uri]))
         else:
-            return segment_to_asset(uri, result, video[0])
-    return video_to_asset(uri, result)
+            assets.append(None)
+    return assets
+    
+def lookup_asset(uri):
+    """
+    Look up a single asset. Returns None if not found.
+    """
+    return lookup_assets([uri])[0]
 
 @with_limas
 def find_related_videos(limas, uri, **kwargs):
@@ -391,6 +684,13 @@ def get_transcript(limas, uri):
 def get_last_update_time(limas):
     return limas.getLastChange() / 1000.0
 
+def get_collection_version():
+    """
+    Returns the last change time of the collection. LIMAS is asked at most
+    every RESULT_CACHE_VERSION_CHECK_INTERVAL seconds.
+    """
+    return get_result_cache().get_version()
+
 @with_limas
 def get_service_info(limas):
     return limas.getServiceInfo()
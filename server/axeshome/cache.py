@@ -0,0 +1,390 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Caching of LIMAS results
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app as app
+
+log = logging.getLogger('axeshome')
+
+# Returned by cache lookups that miss, since None is a valid cached value
+MISSING = object()
+
+class LRUCache(object):
+    """
+    Thread safe in-process cache that evicts the least recently used entry
+    once it holds ``maxsize`` entries. Entries older than ``ttl`` seconds
+    are treated as missing. A ``ttl`` of None means entries never expire.
+    """
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                return default
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class MongoCache(object):
+    """
+    Cache shared between workers, stored in a MongoDB collection. Expired
+    documents are removed by a TTL index on the ``expires`` field.
+    """
+
+    def __init__(self, collection='resultcache', ttl=3600):
+        self.collection_name = collection
+        self.ttl = ttl
+
+    @property
+    def collection(self):
+        from axeshome.api import mongo
+        return mongo.db[self.collection_name]
+
+    def get(self, key, default=MISSING):
+        doc = self.collection.find_one({'_id': key})
+        if doc is None or doc['expires'] < datetime.utcnow():
+            return default
+        return doc['value']
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = datetime.utcnow() + timedelta(seconds=ttl)
+        self.collection.update({'_id': key},
+            {'$set': {'value': value, 'expires': expires}}, upsert=True)
+
+    def add(self, key, value, ttl=None):
+        """
+        Set a key only if it is missing or expired. Returns true if set.
+        """
+        from pymongo.errors import DuplicateKeyError
+        ttl = self.ttl if ttl is None else ttl
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=ttl)
+        try:
+            self.collection.insert({'_id': key, 'value': value, 
+                'expires': expires})
+            return True
+        except DuplicateKeyError:
+            # Expired documents linger until the TTL monitor removes them
+            result = self.collection.update(
+                {'_id': key, 'expires': {'$lt': now}},
+                {'$set': {'value': value, 'expires': expires}})
+            return result.get('n', 0) == 1
+
+    def delete(self, key):
+        self.collection.remove({'_id': key})
+
+class RedisCache(object):
+    """
+    Cache shared between workers, stored in Redis (or any server speaking
+    the Redis protocol). Values are stored as JSON. Requires the optional
+    redis package.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=3600,
+                 prefix='axeshome:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key, default=MISSING):
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return default
+        return json.loads(data)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.setex(self.prefix + key, int(ttl), json.dumps(value))
+
+    def add(self, key, value, ttl=None):
+        """
+        Set a key only if it is missing. Returns true if set.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        return bool(self.client.set(self.prefix + key, json.dumps(value),
+            nx=True, ex=int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+def create_shared_cache(backend, ttl):
+    """
+    Create the shared cache tier named by ``backend`` ('mongo' or 'redis').
+    Returns None if backend is None.
+    """
+    if backend is None:
+        return None
+    elif backend == 'mongo':
+        return MongoCache(app.config['RESULT_CACHE_MONGO_COLLECTION'], ttl)
+    elif backend == 'redis':
+        return RedisCache(app.config['RESULT_CACHE_REDIS_URL'], ttl)
+    raise ValueError('Unknown shared cache backend: {}'.format(backend))
+
+class ResultCache(object):
+    """
+    Two tier result cache: an in-process LRU cache backed by an optional
+    shared cache.
+
+    Keys are prefixed with the version of the LIMAS collection (its last
+    change time), which is re-read at most every ``version_check_interval``
+    seconds. When the collection changes the local tier is cleared and
+    entries in the shared tier are no longer reachable, so they are left to
+    expire. Values read from the shared tier are passed through ``decode``,
+    if given, before they are returned.
+
+    If a ``stale`` cache is given, the last value stored for each query is
+    also kept there regardless of version, to be served when LIMAS is
+    unavailable.
+    """
+
+    def __init__(self, local, shared=None, version_func=None,
+                 version_check_interval=30.0, decode=None, stale=None):
+        self.local = local
+        self.shared = shared
+        self.stale = stale
+        self.decode = decode
+        self.version_func = version_func
+        self.version_check_interval = version_check_interval
+        self.pid = os.getpid()
+        self._version = None
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+
+    def get_version(self):
+        """
+        Returns the current collection version.
+        """
+        if self.version_func is None:
+            return None
+        now = time.time()
+        if now - self._version_checked < self.version_check_interval:
+            return self._version
+        with self._lock:
+            if now - self._version_checked >= self.version_check_interval:
+                version = self.version_func()
+                if version != self._version:
+                    if self._version is not None:
+                        log.info('Collection changed: clearing result cache')
+                    self.local.clear()
+                    self._version = version
+                self._version_checked = now
+        return self._version
+
+    def make_key(self, namespace, *parts):
+        """
+        Make a cache key for the given namespace from a JSON serializable
+        list of parts.
+        """
+        return '{}:{}:{}'.format(namespace, self.get_version(),
+            self.digest(parts))
+
+    def make_stale_key(self, namespace, *parts):
+        """
+        Make a key for the last value stored for a query, whatever the
+        collection version. Does not need the current version.
+        """
+        return '{}:{}'.format(namespace, self.digest(parts))
+
+    def digest(self, parts):
+        data = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is MISSING and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                log.warn('Shared cache lookup failed: %s', e)
+                return MISSING
+            if value is not MISSING:
+                if self.decode is not None:
+                    value = self.decode(value)
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value, stale_key=None):
+        self.local.set(key, value)
+        if stale_key is not None and self.stale is not None:
+            self.stale.set(stale_key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                log.warn('Shared cache store failed: %s', e)
+
+    def lock(self, key, ttl):
+        """
+        Try to take a lock on a key in the shared tier, held for at most
+        ttl seconds. Returns true if taken, or if there is no shared tier.
+        """
+        if self.shared is None:
+            return True
+        try:
+            return self.shared.add('lock:' + key, os.getpid(), ttl)
+        except Exception as e:
+            log.warn('Shared cache lock failed: %s', e)
+            return True
+
+    def unlock(self, key):
+        if self.shared is None:
+            return
+        try:
+            self.shared.delete('lock:' + key)
+        except Exception as e:
+            log.warn('Shared cache unlock failed: %s', e)
+
+    def wait(self, key, timeout, interval=0.05):
+        """
+        Wait up to timeout seconds for another worker to store a value for
+        key in the shared tier. Returns MISSING if none arrives.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(interval)
+            value = self.get(key)
+            if value is not MISSING:
+                return value
+        return MISSING
+
+    def get_stale(self, stale_key):
+        if self.stale is None:
+            return MISSING
+        return self.stale.get(stale_key)
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """
+    Returns the result cache for this process, creating it if necessary.
+    """
+    global _result_cache
+    cache = _result_cache
+    if cache is not None and cache.pid == os.getpid():
+        return cache
+    with _result_cache_lock:
+        if _result_cache is None or _result_cache.pid != os.getpid():
+            import axeshome.backend as backend
+            from axeshome.serialize import premarshalled
+            ttl = app.config['RESULT_CACHE_TTL']
+            stale = None
+            if app.config['RESULT_CACHE_STALE_SIZE']:
+                stale = LRUCache(app.config['RESULT_CACHE_STALE_SIZE'],
+                    app.config['RESULT_CACHE_STALE_TTL'])
+            _result_cache = ResultCache(
+                LRUCache(app.config['RESULT_CACHE_SIZE'], ttl),
+                create_shared_cache(app.config['RESULT_CACHE_SHARED'], ttl),
+                backend.get_last_update_time,
+                app.config['RESULT_CACHE_VERSION_CHECK_INTERVAL'],
+                premarshalled, stale)
+        return _result_cache
+
+class RedisInvalidationChannel(object):
+    """
+    Broadcasts cache invalidations to other processes using Redis publish/
+    subscribe. A background thread in each process passes the keys
+    published by any process to ``callback``. Requires the optional redis
+    package.
+    """
+
+    def __init__(self, url, channel, callback):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.channel = channel
+        self.callback = callback
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._listen,
+            name='invalidate-' + channel)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publish(self, key):
+        try:
+            self.client.publish(self.channel, key)
+        except Exception as e:
+            log.warn('Failed to publish invalidation of %s: %s', key, e)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.callback(message['data'])
+            except Exception as e:
+                log.warn('Invalidation channel %s failed: %s', 
+                    self.channel, e)
+                time.sleep(1.0)
+
+class ProcessCache(object):
+    """
+    In-process LRU cache of values loaded from the database. Invalidations
+    are optionally broadcast to the other worker processes on a Redis
+    channel (see RedisInvalidationChannel).
+    """
+
+    def __init__(self, size, ttl, invalidation_url=None, channel=None):
+        self.cache = LRUCache(size, ttl)
+        self.pid = os.getpid()
+        self.channel = None
+        if invalidation_url is not None:
+            self.channel = RedisInvalidationChannel(invalidation_url,
+                channel, self.discard)
+
+    def get(self, key):
+        return self.cache.get(key, None)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def discard(self, key):
+        """Remove a key from this process's cache"""
+        self.cache.delete(key)
+
+    def invalidate(self, key):
+        """Remove a key from the cache of every process"""
+        self.discard(key)
+        if self.channel is not None:
+            self.channel.publish(key)
@@ -0,0 +1,113 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Circuit breaker for calls to an unreliable service
+"""
+import time
+import logging
+import threading
+
+log = logging.getLogger('axeshome')
+
+class CircuitOpen(Exception):
+    """Raised when a call is refused because the circuit is open"""
+    pass
+
+class CircuitBreaker(object):
+    """
+    Fails calls fast while a service is unhealthy.
+
+    The circuit opens after ``failure_threshold`` consecutive failures. A
+    call that succeeds but takes longer than ``slow_call_time`` seconds
+    counts as a failure too, so latency spikes also open the circuit. While
+    open, calls are refused with CircuitOpen. After ``reset_timeout``
+    seconds one trial call is let through (half open): the circuit closes
+    if it succeeds and opens again if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 slow_call_time=None, name='circuit'):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_time = slow_call_time
+        self.name = name
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def before_call(self):
+        """
+        Call before each call to the service. Raises CircuitOpen if the call
+        should not be made.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() - self._opened < self.reset_timeout:
+                    self._stats['rejected'] += 1
+                    raise CircuitOpen('{} is open'.format(self.name))
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.HALF_OPEN:
+                if self._trial:
+                    self._stats['rejected'] += 1
+                    raise CircuitOpen('{} is half open'.format(self.name))
+                self._trial = True
+            self._stats['calls'] += 1
+
+    def cancel_call(self):
+        """
+        Call instead of recording a result when a call allowed by
+        before_call was not made, so a half open circuit lets another
+        trial call through.
+        """
+        with self._lock:
+            self._stats['calls'] -= 1
+            if self.state == self.HALF_OPEN:
+                self._trial = False
+
+    def record_success(self, elapsed=None):
+        """
+        Call after a call to the service returned, with its duration.
+        """
+        if self.slow_call_time is not None and elapsed is not None and \
+           elapsed > self.slow_call_time:
+            log.warn('%s: slow call (%.2f seconds)', self.name, elapsed)
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info('%s closed', self.name)
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        """
+        Call after a call to the service failed.
+        """
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self.state == self.HALF_OPEN or \
+               self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    log.error('%s opened after %d failures', self.name,
+                        self._failures)
+                    self._stats['opened'] += 1
+                self.state = self.OPEN
+                self._opened = time.time()
+
+    def get_stats(self):
+        """
+        Returns a dict of circuit statistics.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = self.state
+        return stats
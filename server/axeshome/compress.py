@@ -0,0 +1,78 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Compression of API responses
+
+Responses larger than COMPRESS_MIN_SIZE bytes are compressed with brotli
+(if the optional brotli package is installed) or gzip, depending on the
+client's Accept-Encoding header. Streamed responses are sent as they are.
+"""
+import gzip
+
+from io import BytesIO
+from flask import request, current_app as app
+from axeshome.metrics import timer, STAGE_TIME
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def gzip_compress(data, level):
+    buf = BytesIO()
+    with gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=level) as f:
+        f.write(data)
+    return buf.getvalue()
+
+def brotli_compress(data, quality):
+    return brotli.compress(data, quality=quality)
+
+def get_encodings():
+    """
+    Returns the available encodings, most preferred first, as a list of
+    (name, compress function, level) tuples.
+    """
+    encodings = []
+    if brotli is not None:
+        encodings.append(('br', brotli_compress,
+            app.config['COMPRESS_BROTLI_QUALITY']))
+    encodings.append(('gzip', gzip_compress, app.config['COMPRESS_LEVEL']))
+    return encodings
+
+def choose_encoding():
+    """
+    Returns the most preferred encoding accepted by the client, or None.
+    """
+    accepted = request.accept_encodings
+    for encoding in get_encodings():
+        if accepted[encoding[0]]:
+            return encoding
+    return None
+
+def compress_response(response):
+    """
+    Compress a response if it is large enough and the client accepts a
+    supported encoding. Use as an after_request handler.
+    """
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in app.config['COMPRESS_MIMETYPES']):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    name, compress, level = encoding
+    with timer(STAGE_TIME, ('compress',), 'compress'):
+        response.set_data(compress(data, level))
+    response.headers['Content-Encoding'] = name
+    # The compressed body is not byte-for-byte the one the ETag was made for
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,33 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Support for running under gevent
+
+When the API is served by gevent workers (see gunicorn.conf.py), gevent 
+patches the socket, threading and time modules before the application is
+imported. Blocking LIMAS and MongoDB calls then yield to other requests, and
+the locks, queues and background threads used by the server become 
+greenlet based.
+"""
+
+def is_gevent_patched():
+    """
+    Returns true if gevent has monkey patched the standard library.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+def get_pool_size(name):
+    """
+    Returns the size setting of a per-worker pool. Under gevent, pools bound
+    the number of concurrent calls rather than the number of threads, so
+    the larger GEVENT_ setting is used instead.
+    """
+    from flask import current_app as app
+    if is_gevent_patched():
+        return app.config['GEVENT_' + name]
+    return app.config[name]
@@ -0,0 +1,116 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Concurrent execution of independent backend calls
+"""
+import os
+import time
+import logging
+import threading
+import multiprocessing
+
+from multiprocessing.pool import ThreadPool
+from flask import current_app as app
+from axeshome.concurrency import is_gevent_patched, get_pool_size
+from axeshome.metrics import get_request_state, use_request_state
+
+log = logging.getLogger('axeshome')
+
+class GreenletResult(object):
+    """
+    Result of a call run in a greenlet, with the interface of a thread pool
+    result.
+    """
+
+    def __init__(self, greenlet):
+        self.greenlet = greenlet
+
+    def get(self, timeout=None):
+        import gevent
+        try:
+            return self.greenlet.get(timeout=timeout)
+        except gevent.Timeout:
+            raise multiprocessing.TimeoutError()
+
+class GreenletPool(object):
+    """
+    Pool of greenlets with the apply_async interface of a thread pool, used
+    when running under gevent.
+    """
+
+    def __init__(self, size):
+        import gevent.pool
+        self.pool = gevent.pool.Pool(size)
+
+    def apply_async(self, func, args=()):
+        return GreenletResult(self.pool.spawn(func, *args))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_thread_pool():
+    """
+    Returns the thread pool for this process, creating it if necessary. The
+    pool size (FANOUT_POOL_SIZE) bounds the number of concurrent calls made
+    by all requests in the process. Under gevent the pool is a pool of 
+    greenlets of size GEVENT_FANOUT_POOL_SIZE.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if is_gevent_patched():
+                _pool = GreenletPool(get_pool_size('FANOUT_POOL_SIZE'))
+            else:
+                _pool = ThreadPool(get_pool_size('FANOUT_POOL_SIZE'))
+            _pool_pid = os.getpid()
+        return _pool
+
+def fan_out(calls, default_timeout=None):
+    """
+    Run independent calls concurrently on the thread pool.
+
+    Calls are given as a list of ``(name, func, args, timeout)`` tuples,
+    where timeout is the number of seconds to wait for that call, measured
+    from when all calls are started (None means the default timeout). Each
+    call runs in a copy of the current application context, so it must not
+    depend on the request context.
+
+    Returns a tuple ``(results, errors)`` of dicts keyed by call name. A call
+    that raises or times out has an error message in errors and no entry in
+    results. Times recorded by the calls count towards the request's 
+    Server-Timing header.
+    """
+    flask_app = app._get_current_object()
+    state = get_request_state()
+
+    def run(func, args):
+        with flask_app.app_context():
+            use_request_state(state)
+            return func(*args)
+
+    pool = get_thread_pool()
+    start = time.time()
+    pending = []
+    for name, func, args, timeout in calls:
+        if timeout is None:
+            timeout = default_timeout
+        pending.append((name, timeout, pool.apply_async(run, (func, args))))
+
+    results = {}
+    errors = {}
+    for name, timeout, result in pending:
+        if timeout is None:
+            remaining = None
+        else:
+            remaining = max(0, start + timeout - time.time())
+        try:
+            results[name] = result.get(remaining)
+        except multiprocessing.TimeoutError:
+            log.warn('Call %s timed out after %s seconds', name, timeout)
+            errors[name] = 'timed out after {} seconds'.format(timeout)
+        except Exception as e:
+            log.error('Call %s failed: %s', name, e)
+            errors[name] = str(e)
+    return results, errors
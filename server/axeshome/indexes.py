@@ -0,0 +1,98 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Database index definitions and management
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+log = logging.getLogger('axeshome')
+
+# Indexes for each collection, as (keys, options) pairs
+INDEXES = {
+    'users': [
+        ([('username', ASCENDING)], {}),
+        ([('token', ASCENDING)], {}),
+    ],
+    'history': [
+        ([('username', ASCENDING), ('uri', ASCENDING)], {'unique': True}),
+        ([('username', ASCENDING), ('timestamp', DESCENDING)], {}),
+    ],
+    'bookmarks': [
+        ([('username', ASCENDING), ('uri', ASCENDING)], {'unique': True}),
+        ([('username', ASCENDING), ('timestamp', DESCENDING)], {}),
+    ],
+    'queries': [
+        ([('text', ASCENDING)], {}),
+        ([('hits', DESCENDING)], {}),
+        ([('updated', ASCENDING)], {}),
+    ],
+    'videostats': [
+        ([('uri', ASCENDING)], {'unique': True}),
+        ([('likes', DESCENDING), ('views', DESCENDING)], {}),
+    ],
+    'popularity': [
+        ([('kind', ASCENDING), ('period', ASCENDING), ('start', ASCENDING),
+          ('key', ASCENDING)], {'unique': True}),
+        ([('kind', ASCENDING), ('period', ASCENDING), ('start', ASCENDING),
+          ('count', DESCENDING)], {}),
+        ([('expires', ASCENDING)], {'expireAfterSeconds': 0}),
+    ],
+}
+
+def get_indexes(config):
+    """
+    Returns the index definitions for the given app config.
+    """
+    indexes = dict(INDEXES)
+    if config.get('RESULT_CACHE_SHARED') == 'mongo':
+        indexes[config['RESULT_CACHE_MONGO_COLLECTION']] = [
+            ([('expires', ASCENDING)], {'expireAfterSeconds': 0}),
+        ]
+    return indexes
+
+def ensure_indexes(db, config):
+    """
+    Create any missing indexes. Returns a dict mapping collection names to
+    the names of their declared indexes.
+    """
+    created = {}
+    for collection, indexes in sorted(get_indexes(config).iteritems()):
+        names = created[collection] = []
+        for keys, options in indexes:
+            try:
+                names.append(db[collection].create_index(keys, **options))
+            except OperationFailure as e:
+                log.error('Failed to create index on %s: %s', collection, e)
+    log.info('Database indexes ready')
+    return created
+
+def get_index_usage(db, config):
+    """
+    Returns a list of dicts describing the size and usage of the indexes
+    of each managed collection. Usage counts require MongoDB 3.2 or later
+    and are None otherwise.
+    """
+    usage = []
+    for collection in sorted(get_indexes(config)):
+        stats = db.command('collstats', collection)
+        sizes = stats.get('indexSizes', {})
+        ops = {}
+        try:
+            result = db.command('aggregate', collection,
+                pipeline=[{'$indexStats': {}}], cursor={})
+            for item in result['cursor']['firstBatch']:
+                ops[item['name']] = item['accesses']['ops']
+        except OperationFailure:
+            pass
+        for name, size in sorted(sizes.iteritems()):
+            usage.append({
+                'collection': collection,
+                'name': name,
+                'size': size,
+                'ops': ops.get(name)
+            })
+    return usage
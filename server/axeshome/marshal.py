@@ -16,6 +16,12 @@ QueryLogEntry = {
     'hits': fields.Integer(),
 }
 
+PopularQuery = {
+    'text': fields.String(),
+    'hits': fields.Integer(),
+    'score': fields.Float(),
+}
+
 UserProfile = {
     'username': fields.String(),
     'email': fields.String(),
@@ -166,6 +172,16 @@ KeyframeSegment = extend(Segment, {
     'keyframe': fields.Nested(Keyframe),
 })
 
+AssetBundle = {
+    'asset': fields.Nested(Asset),
+    'relatedVideos': fields.List(fields.Nested(SearchResult)),
+    'relatedSegments': fields.List(fields.Nested(SearchResult)),
+    'keyframes': fields.List(fields.Nested(KeyframeSegment)),
+    'transcript': fields.List(fields.Nested(SpeechSegment)),
+    'faceTracks': fields.List(fields.Nested(FaceTrack)),
+    'errors': fields.Raw(),
+}
+
 HistoryItem = {
     'username': fields.String(),
     'timestamp': fields.DateTime(),
@@ -185,6 +201,66 @@ ServiceInfo = {
     'version': fields.Nested(VersionInfo),
 }
 
+CircuitStats = {
+    'state': fields.String(),
+    'calls': fields.Integer(),
+    'failures': fields.Integer(),
+    'rejected': fields.Integer(),
+    'opened': fields.Integer(),
+}
+
+SingleFlightStats = {
+    'calls': fields.Integer(),
+    'shared': fields.Integer(),
+    'inFlight': fields.Integer(),
+}
+
+ConnectionPoolStats = {
+    'pid': fields.Integer(),
+    'size': fields.Integer(),
+    'open': fields.Integer(),
+    'idle': fields.Integer(),
+    'inUse': fields.Integer(),
+    'hits': fields.Integer(),
+    'misses': fields.Integer(),
+    'waits': fields.Integer(),
+    'waitTime': fields.Float(),
+    'timeouts': fields.Integer(),
+    'discarded': fields.Integer(),
+    'healthChecks': fields.Integer(),
+    'healthCheckFailures': fields.Integer(),
+    'circuit': fields.Nested(CircuitStats),
+    'singleFlight': fields.Nested(SingleFlightStats),
+}
+
+WriteQueueStats = {
+    'queued': fields.Integer(),
+    'written': fields.Integer(),
+    'dropped': fields.Integer(),
+    'failed': fields.Integer(),
+    'pending': fields.Integer(),
+}
+
+ProfileCall = {
+    'stage': fields.String(),
+    'name': fields.String(),
+    'duration': fields.Float(),
+}
+
+ProfileInfo = {
+    'id': fields.String(),
+    'timestamp': fields.String(),
+    'reason': fields.String(),
+    'format': fields.String(),
+    'method': fields.String(),
+    'path': fields.String(),
+    'resource': fields.String(),
+    'args': fields.Raw(),
+    'status': fields.Integer(),
+    'duration': fields.Float(),
+    'calls': fields.List(fields.Nested(ProfileCall)),
+}
+
 DatasetInfo = {
     'id': fields.String(),
     'name': fields.String(),
@@ -0,0 +1,347 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Timing and size metrics, exposed in the Prometheus text format
+
+Metrics are kept per worker process. Times spent in each stage of handling a
+request are also collected per request, and sent in a Server-Timing header
+if SERVER_TIMING_ENABLED is set.
+"""
+import time
+import bisect
+import threading
+
+from functools import wraps
+from contextlib import contextmanager
+from flask import current_app as app, g, request, has_app_context
+from flask.ext.pymongo import PyMongo
+
+# Upper bounds of histogram buckets for times (seconds) and sizes (bytes)
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+    16777216)
+
+class Histogram(object):
+    """
+    Counts of observed values in buckets with the given upper bounds, and
+    their sum.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def get_stats(self):
+        """
+        Returns the cumulative bucket counts (the last is the total count)
+        and the sum of the values.
+        """
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+        return counts, total
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
+    return ','.join('{}="{}"'.format(name, escape(value))
+        for name, value in labels)
+
+class HistogramMetric(object):
+    """
+    A histogram for each combination of label values.
+    """
+
+    def __init__(self, name, description, labels, buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        histogram = self._histograms.get(label_values)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(label_values,
+                    Histogram(self.buckets))
+        histogram.observe(value)
+
+    def expose(self):
+        """
+        Returns the lines of the metric in the Prometheus text format.
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        bounds = [format_value(bound) for bound in self.buckets] + ['+Inf']
+        for label_values, histogram in histograms:
+            labels = list(zip(self.labels, label_values))
+            counts, total = histogram.get_stats()
+            for bound, count in zip(bounds, counts):
+                lines.append('{}_bucket{{{}}} {}'.format(self.name,
+                    format_labels(labels + [('le', bound)]), count))
+            suffix = '{{{}}}'.format(format_labels(labels)) if labels else ''
+            lines.append('{}_sum{} {}'.format(self.name, suffix,
+                format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, suffix,
+                counts[-1]))
+        return lines
+
+REQUEST_TIME = HistogramMetric('axeshome_request_seconds',
+    'Time taken to handle API requests', ['resource'])
+RESPONSE_SIZE = HistogramMetric('axeshome_response_bytes',
+    'Size of API response bodies as sent', ['resource'], SIZE_BUCKETS)
+LIMAS_TIME = HistogramMetric('axeshome_limas_call_seconds',
+    'Time taken by LIMAS calls, including waiting for a connection',
+    ['method'])
+STAGE_TIME = HistogramMetric('axeshome_stage_seconds',
+    'Time taken by stages of processing LIMAS results and responses',
+    ['stage'])
+MONGO_TIME = HistogramMetric('axeshome_mongo_seconds',
+    'Time taken by MongoDB operations', ['collection', 'operation'])
+
+METRICS = [REQUEST_TIME, RESPONSE_SIZE, LIMAS_TIME, STAGE_TIME, MONGO_TIME]
+
+def is_enabled():
+    return has_app_context() and app.config['METRICS_ENABLED']
+
+def record(metric, value, label_values, stage=None):
+    """
+    Record a value of a metric. Times are also added to the current
+    request's Server-Timing stage, if given, and to its trace if one was
+    started.
+    """
+    if not is_enabled():
+        return
+    metric.observe(value, *label_values)
+    if stage is not None:
+        timings = getattr(g, 'server_timings', None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + value
+        trace = getattr(g, 'metrics_trace', None)
+        if trace is not None:
+            trace.append((stage, ':'.join(label_values), value))
+
+@contextmanager
+def timer(metric, label_values, stage=None):
+    """
+    Context manager recording the time taken by its block.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(metric, time.time() - start, label_values, stage)
+
+def timed_stage(name):
+    """
+    Decorator recording the time taken by a function as a stage of
+    request handling.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(STAGE_TIME, (name,), name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def start_trace():
+    """
+    Start keeping a list of the times recorded for the current request.
+    """
+    g.metrics_trace = []
+
+def get_trace():
+    """
+    Returns the ``(stage, name, seconds)`` times recorded for the current
+    request since start_trace, or None.
+    """
+    return getattr(g, 'metrics_trace', None)
+
+def get_request_state():
+    """
+    Returns the stage times and trace of the current request, to share
+    with calls run for it in other threads (see use_request_state).
+    """
+    return getattr(g, 'server_timings', None), get_trace()
+
+def use_request_state(state):
+    """
+    Add times recorded in the current context to those of a request.
+    """
+    g.server_timings, g.metrics_trace = state
+
+def get_resource_name():
+    """
+    Returns the name of the resource class handling the current request.
+    """
+    view = app.view_functions.get(request.endpoint)
+    view_class = getattr(view, 'view_class', None)
+    if view_class is not None:
+        return view_class.__name__
+    return request.endpoint or 'none'
+
+def start_request():
+    """
+    Called before each request to start timing it.
+    """
+    if app.config['METRICS_ENABLED']:
+        g.request_start = time.time()
+        g.server_timings = {}
+
+def finish_request(response):
+    """
+    Called after each request to record its time and response size, and to
+    add the Server-Timing header.
+    """
+    start = getattr(g, 'request_start', None)
+    if start is None:
+        return response
+    elapsed = time.time() - start
+    resource = get_resource_name()
+    REQUEST_TIME.observe(elapsed, resource)
+    if not response.is_streamed and response.content_length is not None:
+        RESPONSE_SIZE.observe(response.content_length, resource)
+    if app.config['SERVER_TIMING_ENABLED']:
+        timings = sorted(g.server_timings.items())
+        timings.append(('total', elapsed))
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.1f}'.format(name, value * 1000)
+            for name, value in timings)
+    return response
+
+def expose():
+    """
+    Returns all metrics in the Prometheus text format.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+#
+# MongoDB operations
+#
+
+# Collection methods that are timed
+MONGO_OPERATIONS = frozenset(['find_one', 'insert', 'update', 'remove',
+    'save', 'find_and_modify', 'count', 'distinct', 'aggregate', 'group',
+    'map_reduce', 'inline_map_reduce'])
+
+class MeteredCursor(object):
+    """
+    Wraps a cursor to record the time spent fetching its results.
+    """
+
+    def __init__(self, cursor, collection):
+        self._cursor = cursor
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+        @wraps(attr)
+        def method(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # Keep wrapping chained calls, e.g. find().sort()
+            return self if result is self._cursor else result
+        return method
+
+    def __iter__(self):
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.time()
+                try:
+                    item = next(self._cursor)
+                finally:
+                    elapsed += time.time() - start
+                yield item
+        except StopIteration:
+            pass
+        finally:
+            record(MONGO_TIME, elapsed, (self._collection, 'find'), 'mongo')
+
+class MeteredCollection(object):
+    """
+    Wraps a collection to record the time taken by its operations.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not hasattr(type(self._collection), name):
+            # A sub-collection, e.g. fs.files
+            return MeteredCollection(attr)
+        if name == 'find':
+            @wraps(attr)
+            def find(*args, **kwargs):
+                return MeteredCursor(attr(*args, **kwargs),
+                    self._collection.name)
+            return find
+        if name in MONGO_OPERATIONS:
+            @wraps(attr)
+            def operation(*args, **kwargs):
+                with timer(MONGO_TIME, (self._collection.name, name),
+                           'mongo'):
+                    return attr(*args, **kwargs)
+            return operation
+        return attr
+
+    def __getitem__(self, name):
+        return MeteredCollection(self._collection[name])
+
+class MeteredDatabase(object):
+    """
+    Wraps a database so that its collections record their operation times.
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if not hasattr(type(self._db), name):
+            # Collections are looked up as attributes of the database
+            return MeteredCollection(attr)
+        return attr
+
+    def __getitem__(self, name):
+        return MeteredCollection(self._db[name])
+
+class MeteredPyMongo(PyMongo):
+    """
+    Flask-PyMongo extension whose database records operation times when
+    metrics are enabled.
+    """
+
+    @property
+    def db(self):
+        db = super(MeteredPyMongo, self).db
+        if app.config['METRICS_ENABLED']:
+            return MeteredDatabase(db)
+        return db
@@ -0,0 +1,254 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Popularity of queries and videos
+
+Interest in each query (searches) and video (views, bookmarks and likes,
+weighted by POPULARITY_VIDEO_WEIGHTS) is counted in the ``popularity``
+collection in hourly and daily buckets, and as a trending score that halves
+every POPULARITY_HALF_LIFE seconds.
+
+Trending scores use forward decay: an event of weight w at time t adds
+w * 2^((t - L) / h) to the score, for a landmark time L and half-life h, so
+scores never need updating as time passes and ranking them ranks the items
+by their decayed weights. To keep the scores finite, time is divided into
+epochs of EPOCH_HALF_LIVES half-lives. An event is added to the scores of
+the epoch it happened in and of the next one, with the landmark of each
+epoch at the start of the one before it, so the scores of the current epoch
+always cover at least a whole epoch of history.
+
+The most popular items of each kind and window are kept in the ``popular``
+collection, with the assets of videos, and rebuilt by one worker at most
+every POPULARITY_REFRESH_INTERVAL seconds, so listing them is a single read.
+"""
+import time
+import logging
+import threading
+
+from datetime import datetime
+
+import axeshome.backend as backend
+import axeshome.marshal as objects
+from axeshome.api import app, mongo
+from axeshome.serialize import marshal
+from axeshome.singleflight import SingleFlight
+from axeshome.writebehind import CoalescingCounter
+
+log = logging.getLogger('axeshome')
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Length of a trending score epoch, in half-lives
+EPOCH_HALF_LIVES = 32
+
+# Bucket periods (seconds)
+PERIODS = {
+    'hour': HOUR,
+    'day': DAY,
+}
+
+# Windows that sum bucket counts, as (period, length in seconds)
+WINDOWS = {
+    'day': ('hour', DAY),
+    'week': ('day', 7 * DAY),
+    'month': ('day', 30 * DAY),
+}
+
+# All windows. 'trending' ranks by decayed score, and 'all' by all time counts
+WINDOW_NAMES = ('trending', 'day', 'week', 'month', 'all')
+
+KINDS = ('queries', 'videos')
+
+def to_datetime(timestamp):
+    return datetime.utcfromtimestamp(timestamp)
+
+def get_epoch(timestamp, half_life):
+    return int(timestamp // (half_life * EPOCH_HALF_LIVES))
+
+def get_landmark(epoch, half_life):
+    """
+    Returns the landmark time of the trending scores of an epoch.
+    """
+    return (epoch - 1) * half_life * EPOCH_HALF_LIVES
+
+def get_retention(period):
+    """
+    Returns how long (seconds) buckets of a period are needed.
+    """
+    return max(length for name, length in WINDOWS.values()
+        if name == period) + PERIODS[period]
+
+def get_counter_updates(kind, key, amount, now):
+    """
+    Returns (query, update) pairs adding amount to the bucket counts and
+    trending scores of an item at time now.
+    """
+    updates = []
+    def add(period, start, expires, count):
+        query = {'kind': kind, 'period': period, 'start': to_datetime(start),
+            'key': key}
+        update = {'$inc': {'count': count},
+            '$setOnInsert': {'expires': to_datetime(expires)}}
+        updates.append((query, update))
+    for period, length in sorted(PERIODS.items()):
+        start = now - now % length
+        add(period, start, start + get_retention(period), amount)
+    half_life = float(app.config['POPULARITY_HALF_LIFE'])
+    epoch = get_epoch(now, half_life)
+    for epoch in (epoch, epoch + 1):
+        landmark = get_landmark(epoch, half_life)
+        expires = landmark + 3 * half_life * EPOCH_HALF_LIVES
+        add('trend', landmark, expires,
+            amount * 2 ** ((now - landmark) / half_life))
+    return updates
+
+def write_counts(counts, now=None):
+    """
+    Write popularity increments, given as a dict mapping (kind, key) pairs
+    to a dict with the increment of their 'count'.
+    """
+    if now is None:
+        now = time.time()
+    with app.app_context():
+        bulk = mongo.db.popularity.initialize_unordered_bulk_op()
+        for (kind, key), increments in counts.iteritems():
+            for query, update in get_counter_updates(kind, key,
+                    increments['count'], now):
+                bulk.find(query).upsert().update_one(update)
+        bulk.execute()
+
+_counter = None
+_counter_lock = threading.Lock()
+
+def get_counter():
+    """
+    Returns the coalescing counter for popularity.
+    """
+    global _counter
+    with _counter_lock:
+        if _counter is None:
+            _counter = CoalescingCounter(write_counts,
+                app.config['POPULARITY_FLUSH_INTERVAL'], 'popularity')
+        return _counter
+
+def record(kind, key, amount=1):
+    """
+    Record interest in a query or video. If POPULARITY_FLUSH_INTERVAL is
+    set, counts are aggregated in memory and written in bulk at that
+    interval.
+    """
+    if kind not in KINDS:
+        raise ValueError('Unknown popularity kind: {}'.format(kind))
+    if not app.config['POPULARITY_FLUSH_INTERVAL']:
+        write_counts({(kind, key): {'count': amount}})
+    else:
+        get_counter().add((kind, key), 'count', amount)
+
+def find_all_time(kind, limit):
+    """
+    Returns the (key, count) pairs of the items with the highest all time
+    counts: query hits, or video likes and views.
+    """
+    if kind == 'queries':
+        from axeshome.querylog import PLAIN_QUERIES
+        items = mongo.db.queries.find(PLAIN_QUERIES, sort=[('hits', -1)],
+            limit=limit)
+        return [(item['text'], item.get('hits', 0)) for item in items]
+    items = mongo.db.videostats.find(
+        sort=[('likes', -1), ('views', -1)], limit=limit)
+    return [(item['uri'], item.get('likes', 0)) for item in items]
+
+def find_top(kind, window, limit, now):
+    """
+    Returns the (key, count) pairs of the most popular items of a kind in a
+    window. Counts of the trending window are decayed to time now.
+    """
+    if window == 'all':
+        return find_all_time(kind, limit)
+    if window == 'trending':
+        half_life = float(app.config['POPULARITY_HALF_LIFE'])
+        landmark = get_landmark(get_epoch(now, half_life), half_life)
+        decay = 2 ** (-(now - landmark) / half_life)
+        items = mongo.db.popularity.find({'kind': kind, 'period': 'trend',
+            'start': to_datetime(landmark)}, sort=[('count', -1)],
+            limit=limit)
+        return [(item['key'], item['count'] * decay) for item in items]
+    period, length = WINDOWS[window]
+    result = mongo.db.popularity.aggregate([
+        {'$match': {'kind': kind, 'period': period,
+            'start': {'$gt': to_datetime(now - length)}}},
+        {'$group': {'_id': '$key', 'count': {'$sum': '$count'}}},
+        {'$sort': {'count': -1}},
+        {'$limit': limit},
+    ])
+    return [(item['_id'], item['count']) for item in result['result']]
+
+def build_items(kind, counts, previous, now):
+    """
+    Returns the items of a popular list. Video assets are reused from the
+    previous list, unless older than POPULARITY_ASSET_MAX_AGE, and the
+    others are looked up in one batch.
+    """
+    if kind == 'queries':
+        texts = [key for key, count in counts]
+        hits = dict((doc['text'], doc.get('hits', 0)) for doc in 
+            mongo.db.queries.find({'text': {'$in': texts}}, ['text', 'hits']))
+        return [{'text': key, 'hits': hits.get(key, 0), 'score': count}
+            for key, count in counts]
+    max_age = app.config['POPULARITY_ASSET_MAX_AGE']
+    cached = dict((item['uri'], item) for item in previous
+        if item['fetched'] + max_age > now)
+    uris = [key for key, count in counts if key not in cached]
+    for uri, asset in zip(uris, backend.lookup_assets(uris)):
+        if asset is not None:
+            cached[uri] = {'uri': uri, 'fetched': now,
+                'asset': marshal(asset, objects.Asset)}
+    return [dict(cached[key], count=count) for key, count in counts
+        if key in cached]
+
+def refresh(kind, window, previous=None):
+    """
+    Rebuild a popular list. Windows without any counts yet list the items
+    with the highest all time counts.
+    """
+    now = time.time()
+    limit = app.config['POPULARITY_LIST_SIZES'][kind]
+    counts = find_top(kind, window, limit, now)
+    if not counts:
+        counts = find_all_time(kind, limit)
+    items = build_items(kind, counts, previous['items'] if previous else [],
+        now)
+    doc = {'_id': '{}:{}'.format(kind, window), 'items': items,
+        'refreshed': now, 'updated': to_datetime(now)}
+    mongo.db.popular.update({'_id': doc['_id']}, doc, upsert=True)
+    return doc
+
+_refreshes = SingleFlight()
+
+def get_popular(kind, window='trending'):
+    """
+    Returns the items of a popular list: dicts with the text, all time hits
+    and score in the window of queries, or the uri, count and (marshalled)
+    asset of videos. Scores of the trending window are decayed counts. A list
+    older than POPULARITY_REFRESH_INTERVAL is rebuilt by the first worker to
+    claim it, while the others return it as it is.
+    """
+    if window not in WINDOW_NAMES:
+        raise ValueError('Unknown popularity window: {}'.format(window))
+    list_id = '{}:{}'.format(kind, window)
+    doc = mongo.db.popular.find_one({'_id': list_id})
+    if doc is None:
+        doc = _refreshes.do(list_id, refresh, kind, window)
+    elif doc['refreshed'] + app.config['POPULARITY_REFRESH_INTERVAL'] \
+            < time.time():
+        claimed = mongo.db.popular.find_and_modify(
+            {'_id': list_id, 'refreshed': doc['refreshed']},
+            {'$set': {'refreshed': time.time()}})
+        if claimed is not None:
+            try:
+                doc = _refreshes.do(list_id, refresh, kind, window, doc)
+            except Exception as e:
+                log.error('Failed to refresh popular %s: %s', list_id, e)
+    return doc['items']
@@ -1,67 +1,125 @@
 #
-# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved. 
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
 #
 """
 Response post processors
 """
 import re
 
+from axeshome.serialize import Marshalled
+
+class RuleNode(object):
+    """
+    Node in a trie of rules keyed on field names, read from the last name in
+    the field path backwards.
+    """
+
+    def __init__(self):
+        self.rules = []
+        self.children = {}
+
 class RegexPostprocessor(object):
     """
     Limas response post processing using regular expression replacements
     on string fields.
-    
+
     Requires a set of rules in the form::
-    
+
     rules = {
         'fieldName': [
             ('pattern', 'replacement'),
             ('pattern', 'replacement'),
         ]
     }
+
+    A field name may be a dotted path (e.g. 'videoSources.url'), in which
+    case the rule applies to fields whose path ends with it. Items of a list
+    have the same name as the list.
+
+    The rules are compiled once when the post processor is created, so an
+    instance can be reused and shared between threads. Data that has already
+    been marshalled is skipped, since the rules refer to unmarshalled names.
     """
-    
+
     def __init__(self, rules):
         self.rules = rules
-        self._name_stack = []
-    
+        self._index = self.compile_rules(rules)
+
+    @staticmethod
+    def compile_rules(rules):
+        """
+        Compile the rules into a trie indexed by the last name in the path.
+        """
+        index = {}
+        for key, rule in rules.iteritems():
+            parts = key.split('.')
+            node = index.setdefault(parts[-1], RuleNode())
+            for part in reversed(parts[:-1]):
+                node = node.children.setdefault(part, RuleNode())
+            node.rules.append([(re.compile(pattern), repl)
+                for pattern, repl in rule])
+        return index
+
     def process(self, value, name=None):
-        if name is not None:
-            self._name_stack.append(name)
+        """
+        Apply the rules to value, modifying it in place. Returns the
+        processed value.
+        """
+        if not self._index:
+            return value
+        stack = [] if name is None else [name]
+        return self._process(value, name, stack)
+
+    def _process(self, value, name, stack):
+        if type(value) is Marshalled:
+            return value
+        index = self._index
         if isinstance(value, dict):
-            result = self.process_dict(value, name)
+            for k, v in value.iteritems():
+                if isinstance(v, (dict, list)):
+                    stack.append(k)
+                    value[k] = self._process(v, k, stack)
+                    stack.pop()
+                elif k in index and isinstance(v, basestring):
+                    stack.append(k)
+                    value[k] = self.process_entry(v, stack)
+                    stack.pop()
         elif isinstance(value, list):
-            result = self.process_list(value, name)
-        else:
-            result = self.process_entry(value, name)
-        if name is not None:
-            self._name_stack.pop()
-        return result
-    
-    def process_dict(self, d, name):
-        for k, v in d.iteritems():
-            d[k] = self.process(v, k)
-        return d
-        
-    def process_list(self, l, name):
-        for i, v in enumerate(l):
-            l[i] = self.process(v, name)
-        return l
-    
-    def process_entry(self, value, name):
-        for key, rule in self.rules.iteritems():
-            if self.name_stack_matches_rule(key):
-                value = self.apply_rule(rule, name, value)
+            if name is None:
+                for i, v in enumerate(value):
+                    value[i] = self._process(v, name, stack)
+                return value
+            for i, v in enumerate(value):
+                if isinstance(v, (dict, list)):
+                    stack.append(name)
+                    value[i] = self._process(v, name, stack)
+                    stack.pop()
+                elif name in index and isinstance(v, basestring):
+                    stack.append(name)
+                    value[i] = self.process_entry(v, stack)
+                    stack.pop()
+        elif name in index and isinstance(value, basestring):
+            value = self.process_entry(value, stack)
+        return value
+
+    def process_entry(self, value, stack):
+        """
+        Apply the rules matching the field path in stack to a string value.
+        """
+        node = self._index[stack[-1]]
+        i = len(stack) - 2
+        while True:
+            for rule in node.rules:
+                value = self.apply_rule(rule, value)
+            if i < 0 or not node.children:
+                break
+            node = node.children.get(stack[i])
+            if node is None:
+                break
+            i -= 1
         return value
-    
-    def name_stack_matches_rule(self, key):
-        parts = key.split('.')
-        stack = self._name_stack[-len(parts):]
-        return parts == stack
-    
-    def apply_rule(self, rule, name, value):
+
+    def apply_rule(self, rule, value):
         for pattern, repl in rule:
-            value = re.sub(pattern, repl, value)
+            value = pattern.sub(repl, value)
         return value
-        
-                
\ No newline at end of file
@@ -0,0 +1,325 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Profiling of sampled and slow requests
+
+When PROFILING_ENABLED is set, a fraction (PROFILING_SAMPLE_RATE) of requests
+are profiled with cProfile, and the stacks of all other requests are sampled
+every PROFILING_SAMPLE_INTERVAL seconds by a background thread, which costs
+little. Sampled stacks are kept only for requests that take longer than
+PROFILING_SLOW_REQUEST_TIME seconds.
+
+Each profile is saved in PROFILING_PATH with a JSON description of the
+request: its resource, arguments, status, duration, and the times recorded
+by axeshome.metrics (LIMAS calls, MongoDB operations and other stages). Only
+the newest PROFILING_MAX_PROFILES are kept. cProfile profiles are saved in
+the pstats format; stack samples are saved in the folded format used by
+flame graph tools.
+
+Stack sampling needs threaded workers: under gevent, slow requests are
+saved without a profile.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import cProfile
+import threading
+
+from datetime import datetime
+from flask import current_app as app, g, request
+
+from axeshome.concurrency import is_gevent_patched
+import axeshome.metrics as metrics
+
+log = logging.getLogger('axeshome')
+
+# Profile IDs are made of the time and process ID
+PROFILE_ID = re.compile(r'^\d{8}-\d{12}-\d+$')
+
+class CallProfile(object):
+    """
+    Deterministic profile of the current thread made with cProfile.
+    """
+    format = 'pstats'
+    extension = '.prof'
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def save(self, path):
+        self.profiler.dump_stats(path)
+
+class StackProfile(object):
+    """
+    Counts of the stacks of a thread, sampled by a StackSampler.
+    """
+    format = 'folded'
+    extension = '.txt'
+
+    def __init__(self, sampler, ident):
+        self.sampler = sampler
+        self.ident = ident
+        self.counts = {}
+
+    def stop(self):
+        self.sampler.remove(self.ident)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write('{} {}\n'.format(';'.join(stack), count))
+
+def describe_frame(frame):
+    code = frame.f_code
+    filename = '/'.join(code.co_filename.split(os.sep)[-2:])
+    return '{} ({}:{})'.format(code.co_name, filename, frame.f_lineno)
+
+class StackSampler(object):
+    """
+    Samples the stacks of a set of threads every ``interval`` seconds in a
+    background thread.
+    """
+
+    def __init__(self, interval=0.005, max_depth=100):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._profiles = {}
+        self._lock = threading.Condition(threading.Lock())
+        self._thread = None
+
+    def add(self, ident):
+        """
+        Start sampling the stack of a thread. Returns its StackProfile.
+        """
+        profile = StackProfile(self, ident)
+        with self._lock:
+            self._profiles[ident] = profile
+            self._lock.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                    name='stack-sampler')
+                self._thread.daemon = True
+                self._thread.start()
+        return profile
+
+    def remove(self, ident):
+        """
+        Stop sampling the stack of a thread.
+        """
+        with self._lock:
+            self._profiles.pop(ident, None)
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, profile in self._profiles.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(describe_frame(frame))
+                    frame = frame.f_back
+                if stack:
+                    stack = tuple(reversed(stack))
+                    profile.counts[stack] = profile.counts.get(stack, 0) + 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                # Sleep until there is a thread to sample
+                while not self._profiles:
+                    self._lock.wait()
+            time.sleep(self.interval)
+            self.sample()
+
+_sampler = None
+_sampler_pid = None
+_sampler_lock = threading.Lock()
+
+def get_sampler():
+    """
+    Returns the stack sampler for this process.
+    """
+    global _sampler, _sampler_pid
+    with _sampler_lock:
+        if _sampler is None or _sampler_pid != os.getpid():
+            _sampler = StackSampler(app.config['PROFILING_SAMPLE_INTERVAL'])
+            _sampler_pid = os.getpid()
+        return _sampler
+
+class ProfileStore(object):
+    """
+    A directory holding the newest ``max_profiles`` profiles. Each profile
+    is a JSON description named after its ID, and an optional data file
+    with the same name and an extension for its format.
+    """
+
+    def __init__(self, path, max_profiles=100):
+        self.path = path
+        self.max_profiles = max_profiles
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        with self._lock:
+            self._counter += 1
+            counter = self._counter
+        now = datetime.now()
+        return '{:%Y%m%d-%H%M%S}{:06d}-{}{:04d}'.format(now, now.microsecond,
+            os.getpid(), counter % 10000)
+
+    def save(self, info, profile=None):
+        """
+        Save a profile and its description, removing the oldest profiles if
+        there are too many. Returns the profile ID.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        profile_id = self.new_id()
+        info = dict(info, id=profile_id, format=None)
+        if profile is not None:
+            info['format'] = profile.format
+            path = os.path.join(self.path, profile_id + profile.extension)
+            profile.save(path + '.tmp')
+            os.rename(path + '.tmp', path)
+        path = os.path.join(self.path, profile_id + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(info, f)
+        os.rename(path + '.tmp', path)
+        self.prune()
+        return profile_id
+
+    def get_ids(self):
+        """
+        Returns the IDs of the saved profiles, newest first.
+        """
+        names = [name[:-5] for name in os.listdir(self.path)
+            if name.endswith('.json')] if os.path.isdir(self.path) else []
+        return sorted(names, reverse=True)
+
+    def prune(self):
+        for profile_id in self.get_ids()[self.max_profiles:]:
+            for extension in ('.json', CallProfile.extension, 
+                              StackProfile.extension):
+                try:
+                    os.remove(os.path.join(self.path, profile_id + extension))
+                except OSError:
+                    # No such file, or removed by another worker
+                    pass
+
+    def get_info(self, profile_id):
+        """
+        Returns the description of a profile, or None if there is no such
+        profile.
+        """
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.path, profile_id + '.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def list(self):
+        """
+        Returns the descriptions of the saved profiles, newest first.
+        """
+        profiles = [self.get_info(profile_id) for profile_id in self.get_ids()]
+        return [info for info in profiles if info is not None]
+
+    def get_data_path(self, info):
+        """
+        Returns the path of the data file of a profile, or None.
+        """
+        for profile in (CallProfile, StackProfile):
+            if profile.format == info.get('format'):
+                return os.path.join(self.path, info['id'] + profile.extension)
+        return None
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """
+    Returns the profile store.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProfileStore(app.config['PROFILING_PATH'],
+                app.config['PROFILING_MAX_PROFILES'])
+        return _store
+
+def start_request():
+    """
+    Called before each request to start profiling it, if it is sampled, or
+    sampling its stack.
+    """
+    if not app.config['PROFILING_ENABLED']:
+        return
+    g.profile_start = time.time()
+    g.profile_reason = None
+    g.profile = None
+    if random.random() < app.config['PROFILING_SAMPLE_RATE']:
+        g.profile_reason = 'sampled'
+        g.profile = CallProfile()
+    elif app.config['PROFILING_SLOW_REQUEST_TIME'] is not None:
+        g.profile_reason = 'slow'
+        if not is_gevent_patched():
+            g.profile = get_sampler().add(threading.current_thread().ident)
+    if g.profile_reason is not None:
+        metrics.start_trace()
+
+def stop_profile():
+    profile = getattr(g, 'profile', None)
+    if profile is not None:
+        profile.stop()
+        g.profile = None
+    return profile
+
+def finish_request(response):
+    """
+    Called after each request to save its profile if it was sampled or
+    slow.
+    """
+    reason = getattr(g, 'profile_reason', None)
+    if reason is None:
+        return response
+    profile = stop_profile()
+    elapsed = time.time() - g.profile_start
+    if reason == 'slow' and elapsed < app.config['PROFILING_SLOW_REQUEST_TIME']:
+        return response
+    info = {
+        'timestamp': datetime.now().isoformat(),
+        'reason': reason,
+        'method': request.method,
+        'path': request.path,
+        'resource': metrics.get_resource_name(),
+        'args': dict(request.view_args or {}),
+        'status': response.status_code,
+        'duration': elapsed,
+        'calls': [{'stage': stage, 'name': name, 'duration': duration}
+            for stage, name, duration in metrics.get_trace() or []],
+    }
+    if app.config['PROFILING_RECORD_ARGS']:
+        info['args'].update(request.args.items())
+    try:
+        get_store().save(info, profile)
+    except (IOError, OSError) as e:
+        log.error('Failed to save profile: %s', e)
+    return response
+
+def teardown_request(exception=None):
+    """
+    Called at the end of each request to stop any profile left running by a
+    request that failed.
+    """
+    stop_profile()
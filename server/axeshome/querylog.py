@@ -4,24 +4,53 @@
 """
 Simple database query logging functions
 """
+from datetime import datetime
+
+import axeshome.popularity as popularity
+import axeshome.suggest as suggest
 from axeshome.api import mongo
+from axeshome.util import normalize_text, canonical_query
+
+# Queries with clauses are logged with the advanced flag set. Suggestions 
+# and popular queries only list plain queries, which can be typed in the 
+# search box.
+PLAIN_QUERIES = {'advanced': {'$ne': True}}
 
 def normalize_query(text):
-    text = text.strip().lower()
-    return text
+    return normalize_text(text)
+    
+def normalize_prefix(text):
+    """
+    Normalize the start of a query text, keeping a space after its last 
+    word.
+    """
+    prefix = normalize_query(text)
+    if prefix and text[-1:].isspace():
+        prefix += ' '
+    return prefix
     
 def find(query_text):
     query_text = normalize_query(query_text)
-    mongo.db.queries.ensure_index('text')
     return mongo.db.queries.find_one({'text': query_text})
     
-def insert(query_text):
-    query_text = normalize_query(query_text)
-    mongo.db.queries.ensure_index('text')
-    mongo.db.queries.update({'text': query_text}, {'$inc': {'hits': 1}}, True)
+def insert(query_text, clauses=None):
+    """
+    Log a query, under the canonical form of its text and any clauses. Only
+    plain queries are counted for suggestions and popular queries.
+    """
+    text = canonical_query(query_text, clauses)
+    if not text:
+        return
+    advanced = text != normalize_query(query_text)
+    mongo.db.queries.update({'text': text}, {'$inc': {'hits': 1}, 
+        '$set': {'updated': datetime.utcnow(), 'advanced': advanced}}, True)
+    if not advanced:
+        popularity.record('queries', text)
+        suggest.record(text)
     
 def find_popular(n=100):
-    return list(mongo.db.queries.find(sort=[('hits', -1)], limit=n))
+    return list(mongo.db.queries.find(PLAIN_QUERIES, sort=[('hits', -1)], 
+        limit=n))
     
 
 
@@ -0,0 +1,89 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+JSON encoding of API responses
+
+The encoder is chosen by the JSON_ENCODER setting: 'json' (the standard
+library), or 'ujson' or 'simplejson' if installed. Data a faster encoder
+cannot handle is encoded with the standard library instead.
+"""
+import json
+import logging
+
+from flask import make_response, current_app as app
+from axeshome.metrics import timer, STAGE_TIME
+
+log = logging.getLogger('axeshome')
+
+def compact_dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+def load_encoder(name):
+    """
+    Returns a function that encodes data as compact JSON using the named
+    encoder, or the standard library if it is not available.
+    """
+    if name == 'ujson':
+        try:
+            import ujson
+            return lambda data: ujson.dumps(data, ensure_ascii=False)
+        except ImportError:
+            log.warn('ujson is not installed; using json')
+    elif name == 'simplejson':
+        try:
+            import simplejson
+            return lambda data: simplejson.dumps(data, separators=(',', ':'))
+        except ImportError:
+            log.warn('simplejson is not installed; using json')
+    elif name != 'json':
+        log.warn('Unknown JSON encoder %s; using json', name)
+    return compact_dumps
+
+def fall_back(encode):
+    """
+    Wrap an encoder so that data it cannot handle is encoded with the 
+    standard library.
+    """
+    def dumps(data):
+        try:
+            return encode(data)
+        except (TypeError, ValueError, OverflowError):
+            return compact_dumps(data)
+    return dumps
+
+_encoders = {}
+
+def get_encoder():
+    """
+    Returns a function that encodes data as compact JSON with the configured
+    encoder.
+    """
+    name = app.config['JSON_ENCODER']
+    encode = _encoders.get(name)
+    if encode is None:
+        encode = load_encoder(name)
+        if encode is not compact_dumps:
+            encode = fall_back(encode)
+        _encoders[name] = encode
+    return encode
+
+def dumps(data):
+    """
+    Encode data as compact JSON with the configured encoder.
+    """
+    return get_encoder()(data)
+
+def output_json(data, code, headers=None):
+    """
+    Makes a Flask response with a JSON encoded body. Replaces flask-restful's
+    representation, which is indented in debug mode and spaced otherwise.
+    """
+    with timer(STAGE_TIME, ('encode',), 'encode'):
+        if app.debug:
+            dumped = json.dumps(data, indent=4, sort_keys=True) + '\n'
+        else:
+            dumped = dumps(data)
+    resp = make_response(dumped, code)
+    resp.headers.extend(headers or {})
+    return resp
@@ -4,60 +4,258 @@
 """
 Flask-Restful resources
 """
+import os
+import hashlib
+
+from functools import wraps
 from flask.ext.restful import reqparse, abort, Resource
-from flask.ext.restful import fields, marshal, marshal_with
+from flask.ext.restful import fields
+from flask.ext.restful.types import natural, boolean
 from bson.objectid import ObjectId
-from flask import request
+from flask import request, Response, send_file
+from werkzeug.http import http_date
+from datetime import datetime
 from flask.ext.login import login_required
 
 import axeshome.marshal as objects
 import axeshome.backend as backend
 import axeshome.social as social
 import axeshome.querylog as querylog
+import axeshome.popularity as popularity
+import axeshome.suggest as suggest
 import axeshome.user as user
 import axeshome.storage as storage
 import axeshome.userlog as userlog
+import axeshome.fanout as fanout
+import axeshome.snapshot as snapshot
+import axeshome.metrics as metrics
+import axeshome.profiling as profiling
 
+from axeshome.serialize import marshal, marshal_with, get_marshaller
+from axeshome.representations import get_encoder
 from axeshome.util import find_or_404, clause_type
 from axeshome.util import get_image_data_and_extension_from_data_url
 
+def add_paging_arguments(parser):
+    """
+    Add arguments for paging, streaming and the format of ranked lists to a
+    request parser.
+    """
+    parser.add_argument('offset', type=natural, dest='offset', default=0)
+    parser.add_argument('limit', type=natural, dest='limit', default=None)
+    parser.add_argument('stream', type=boolean, dest='stream', default=False)
+    parser.add_argument('format', type=str, dest='format', default='full',
+        choices=('full', 'normalized'))
+    return parser
+
+def stream_json_lines(items, marshaller, headers=None):
+    """
+    Stream a list as newline delimited JSON, marshalling each item as it is
+    written.
+    """
+    dumps = get_encoder()
+    def generate():
+        for item in items:
+            yield dumps(marshaller(item)) + '\n'
+    return Response(generate(), mimetype='application/x-ndjson', 
+        headers=headers)
+
+def annotate_results(results):
+    """
+    Mark the assets in a list of search results that the current user has
+    bookmarked. Results may be shared with the result cache, so marked 
+    results are copied rather than changed.
+    """
+    uris = user.get_bookmarked_uris()
+    if not uris or not results:
+        return results
+    annotated = []
+    for result in results:
+        asset = result.get('asset')
+        if asset is not None and user.is_bookmarked(asset, uris):
+            result = type(result)(result)
+            result['asset'] = type(asset)(asset, bookmarked=True)
+        annotated.append(result)
+    return annotated
+
+def annotate_topics(topics):
+    """
+    Mark the bookmarked assets in the example results of a list of topics.
+    """
+    if not user.get_bookmarked_uris() or not topics:
+        return topics
+    examples = 'collectionExamples'
+    return [dict(topic, **{examples: annotate_results(topic[examples])})
+        for topic in topics]
+
+def validator_headers(etag, last_modified=None, headers=None):
+    """
+    Returns a copy of headers with ETag and, if given, Last-Modified added.
+    The last modified time is given in seconds since the epoch.
+    """
+    headers = dict(headers or {})
+    headers['ETag'] = '"{}"'.format(etag)
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def is_not_modified(etag, last_modified=None):
+    """
+    Returns true if the request's If-None-Match or If-Modified-Since headers
+    show that the client has the current representation.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        modified = datetime.utcfromtimestamp(int(last_modified))
+        return modified <= request.if_modified_since
+    return False
+
+def conditional_response(data, etag, last_modified=None, headers=None):
+    """
+    Respond with data, or with 304 Not Modified if the request's
+    If-None-Match or If-Modified-Since headers show the client has it. 
+    """
+    headers = validator_headers(etag, last_modified, headers)
+    if is_not_modified(etag, last_modified):
+        return Response(status=304, headers=headers)
+    return data, 200, headers
+
+def collection_versioned(method):
+    """
+    Decorator for resource methods whose output depends only on the request
+    URL and the collection. The ETag is derived from the collection version
+    and the URL, so requests for data the client has are answered with 304
+    Not Modified without calling LIMAS. Responses are sent with the
+    Cache-Control header in COLLECTION_CACHE_CONTROL.
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        from flask import current_app as app
+        try:
+            version = backend.get_collection_version()
+        except backend.LimasError:
+            return method(*args, **kwargs)
+        key = u'{}:{}'.format(version, request.full_path)
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        headers = validator_headers(etag, version)
+        if app.config['COLLECTION_CACHE_CONTROL']:
+            headers['Cache-Control'] = app.config['COLLECTION_CACHE_CONTROL']
+        if is_not_modified(etag, version):
+            return Response(status=304, headers=headers)
+        return method(*args, **kwargs), 200, headers
+    return wrapper
+
+def bookmarks_etag(etag):
+    """
+    Returns an ETag for data with the given ETag annotated with the current
+    user's bookmarks.
+    """
+    uris = user.get_bookmarked_uris()
+    if not uris:
+        return etag
+    digest = hashlib.sha1(etag)
+    for uri in sorted(uris):
+        digest.update('\n' + uri.encode('utf-8'))
+    return digest.hexdigest()
+
+def snapshot_response(name, args=(), annotate=None):
+    """
+    Respond with a part of the landing page snapshot, annotated for the
+    current user if annotate is given. Returns None if the part is not 
+    available.
+    """
+    part = snapshot.get_part(name, args)
+    if part is None:
+        return None
+    data, etag = part.data, part.etag
+    if annotate is not None:
+        data, etag = annotate(data), bookmarks_etag(etag)
+    return conditional_response(data, etag, part.last_modified)
+
+def normalize_results(results):
+    """
+    Returns a marshalled list of search results in normalized form: the 
+    video fields of each asset (metadata, duration, sources and keyframe) 
+    are sent once per video in ``videos``, keyed by video URI, and left out
+    of the assets in ``results``.
+    """
+    videos = {}
+    normalized = []
+    for result in marshal(results, objects.SearchResult):
+        asset = result['asset']
+        video_uri = asset['videoUri']
+        if video_uri not in videos:
+            videos[video_uri] = dict((key, asset[key]) 
+                for key in backend.VideoAssetFields)
+        asset = dict((key, value) for key, value in asset.iteritems() 
+            if key not in backend.VideoAssetFields)
+        normalized.append(dict(result, asset=asset))
+    return {'videos': videos, 'results': normalized}
+
+def ranked_list_response(results, args):
+    """
+    Respond with the page of a ranked list of search results selected by 
+    the paging arguments. The total number of results is sent in the 
+    X-Total-Count header. The page is streamed as newline delimited JSON if
+    requested, or sent in normalized form if the format is 'normalized'.
+    """
+    end = None if args.limit is None else args.offset + args.limit
+    page = annotate_results(results[args.offset:end])
+    headers = {'X-Total-Count': str(len(results))}
+    if args.format == 'normalized':
+        return normalize_results(page), 200, headers
+    if args.stream:
+        marshaller = get_marshaller(objects.SearchResult)
+        return stream_json_lines(page, marshaller, headers)
+    return marshal(page, objects.SearchResult), 200, headers
+
 class AvailableServices(Resource):
     def get(self):
         return [{'value': x} for x in backend.get_available_services()]
 
 class SimpleSearch(Resource):
-    parser = reqparse.RequestParser()
+    parser = add_paging_arguments(reqparse.RequestParser())
     parser.add_argument('q', type=str, required=True)
     
-    @marshal_with(objects.SearchResult)
     def get(self):
         args = self.parser.parse_args()
         querylog.insert(args.q)
         userlog.log_action('simple-search', args.q)
-        return backend.simple_search(args.q)
+        return ranked_list_response(backend.simple_search(args.q), args)
         
 class ImageSearch(Resource):
-    parser = reqparse.RequestParser()
+    parser = add_paging_arguments(reqparse.RequestParser())
     parser.add_argument('q', type=str, required=True)
     
-    @marshal_with(objects.SearchResult)
     def get(self):
         args = self.parser.parse_args()
         userlog.log_action('image-search', args.q)
         clauses = [{ 'type': '#instance-i', 'text': args.q }]
-        return backend.advanced_search('', clauses)
+        return ranked_list_response(backend.advanced_search('', clauses), 
+            args)
 
 class AdvancedSearch(Resource):
-    parser = reqparse.RequestParser()
+    parser = add_paging_arguments(reqparse.RequestParser())
     parser.add_argument('text', type=str, required=True, dest='text')
     parser.add_argument('clauses', type=clause_type, action='append', 
         dest='clauses')
     
-    @marshal_with(objects.SearchResult)
     def get(self):
         args = self.parser.parse_args()
+        querylog.insert(args.text, args.clauses)
         userlog.log_action('advanced-search', args)
-        return backend.advanced_search(args.text, args.clauses)
+        results = backend.advanced_search(args.text, args.clauses)
+        return ranked_list_response(results, args)
+
+def visit_asset(asset):
+    """
+    Record a view of an asset and mark whether the user bookmarked it.
+    """
+    video_uri = asset['videoUri']
+    social.record_stats(video_uri, 'views')
+    user.add_to_history(asset)
+    asset['bookmarked'] = user.is_bookmarked(asset, user.get_bookmarked_uris())
 
 class Asset(Resource):
     @marshal_with(objects.Asset)
@@ -67,11 +265,42 @@ class Asset(Resource):
         if asset is None:
             abort(404, message='No such asset')
         else:
-            video_uri = asset['videoUri']
-            social.increment_stats(video_uri, 'views')
-            user.add_to_history(asset)
-            asset['bookmarked'] = user.has_bookmark(video_uri)
+            visit_asset(asset)
         return asset
+
+class AssetBundle(Resource):
+    """
+    Everything the asset page needs in one request. The backend calls are
+    made concurrently; calls that fail or time out are listed in errors.
+    """
+    parts = [
+        ('asset', backend.lookup_asset),
+        ('relatedVideos', backend.find_related_videos),
+        ('relatedSegments', backend.find_related_segments),
+        ('keyframes', backend.get_keyframes),
+        ('transcript', backend.get_transcript),
+        ('faceTracks', backend.get_face_tracks),
+    ]
+    
+    @marshal_with(objects.AssetBundle)
+    def get(self, uri):
+        from flask import current_app as app
+        userlog.log_action('fetch-asset-bundle', uri)
+        timeouts = app.config['ASSET_BUNDLE_TIMEOUTS']
+        calls = [(name, func, (uri,), timeouts.get(name)) 
+            for name, func in self.parts]
+        bundle, errors = fanout.fan_out(calls, 
+            app.config['ASSET_BUNDLE_TIMEOUT'])
+        asset = bundle.get('asset')
+        if asset is None and 'asset' not in errors:
+            abort(404, message='No such asset')
+        if asset is not None:
+            visit_asset(asset)
+        for name in ('relatedVideos', 'relatedSegments'):
+            if name in bundle:
+                bundle[name] = annotate_results(bundle[name])
+        bundle['errors'] = errors
+        return bundle
         
 class VideoStats(Resource):
     parser = reqparse.RequestParser()
@@ -84,12 +313,17 @@ class VideoStats(Resource):
     @marshal_with(objects.VideoStats)
     def put(self, uri):
         args = self.parser.parse_args()
+        if args.increment not in social.STATS_FIELDS:
+            abort(400, message='Unknown stats field')
         return social.increment_stats(uri, args.increment)
 
 class NewsSources(Resource):    
     @marshal_with(objects.NewsSource)
     def get(self):
         userlog.log_action('fetch-news-sources')
+        response = snapshot_response('news-sources')
+        if response is not None:
+            return response
         return backend.get_news_sources()
 
 class NewsItems(Resource):
@@ -107,22 +341,30 @@ class NewsItem(Resource):
         return backend.get_news_item(uri)
 
 class NewsItemSearch(Resource):
-    @marshal_with(objects.SearchResult)
+    parser = add_paging_arguments(reqparse.RequestParser())
+    
     def get(self, uri):
+        args = self.parser.parse_args()
         userlog.log_action('news-item-search', uri)
-        return backend.search_news_item(uri)
+        return ranked_list_response(backend.search_news_item(uri), args)
 
 class NewsSourceSearch(Resource):
-    @marshal_with(objects.SearchResult)
+    parser = add_paging_arguments(reqparse.RequestParser())
+    
     def get(self, uri):
+        args = self.parser.parse_args()
         userlog.log_action('news-source-search', uri)
-        return backend.search_news_source(uri)
+        return ranked_list_response(backend.search_news_source(uri), args)
 
 class InterestingItems(Resource):
     @marshal_with(objects.SearchResult)
     def get(self):
         userlog.log_action('fetch-interesting-items')
-        return backend.get_interesting_items()
+        response = snapshot_response('interesting-items', (), 
+            annotate_results)
+        if response is not None:
+            return response
+        return annotate_results(backend.get_interesting_items())
 
 class TopicTypes(Resource):
     def get(self):
@@ -137,7 +379,12 @@ class InterestingTopics(Resource):
     def get(self):
         args = self.parser.parse_args()
         userlog.log_action('fetch-interesting-topics', (args.limit, args.type))
-        return backend.get_interesting_topics(args.limit, args.type)
+        response = snapshot_response('interesting-topics', 
+            (args.limit, args.type), annotate_topics)
+        if response is not None:
+            return response
+        topics = backend.get_interesting_topics(args.limit, args.type)
+        return annotate_topics(topics)
 
 class HomeTopics(Resource):
     parser = reqparse.RequestParser()
@@ -147,49 +394,81 @@ class HomeTopics(Resource):
     def get(self):
         args = self.parser.parse_args()
         userlog.log_action('fetch-home-topics', args.limit)
-        return backend.get_home_topics(args.limit)
+        response = snapshot_response('home-topics', (args.limit,), 
+            annotate_topics)
+        if response is not None:
+            return response
+        return annotate_topics(backend.get_home_topics(args.limit))
 
 class FaceTracks(Resource):
     @marshal_with(objects.FaceTrack)
+    @collection_versioned
     def get(self, uri):
         return backend.get_face_tracks(uri)
         
 class RelatedVideos(Resource):
     @marshal_with(objects.SearchResult)
     def get(self, uri):
-        return backend.find_related_videos(uri)
+        return annotate_results(backend.find_related_videos(uri))
         
 class RelatedSegments(Resource):
     @marshal_with(objects.SearchResult)
     def get(self, uri):
-        return backend.find_related_segments(uri) 
+        return annotate_results(backend.find_related_segments(uri))
         
 class Keyframes(Resource):
     @marshal_with(objects.KeyframeSegment)
+    @collection_versioned
     def get(self, uri):
         return backend.get_keyframes(uri) 
 
 class Transcript(Resource):
     @marshal_with(objects.SpeechSegment)
+    @collection_versioned
     def get(self, uri):
         return backend.get_transcript(uri)
         
-class PopularQueries(Resource):
+class Suggest(Resource):
+    """
+    Logged queries starting with the given text, most searched first.
+    """
+    parser = reqparse.RequestParser()
+    parser.add_argument('q', type=str, required=True)
+    parser.add_argument('limit', type=natural, default=10)
+    
     @marshal_with(objects.QueryLogEntry)
     def get(self):
+        args = self.parser.parse_args()
+        prefix = querylog.normalize_prefix(args.q)
+        return [{'text': text, 'hits': hits} 
+            for text, hits in suggest.suggest(prefix, args.limit)]
+
+def add_window_argument(parser):
+    parser.add_argument('window', type=str, default='trending',
+        choices=popularity.WINDOW_NAMES)
+    return parser
+
+class PopularQueries(Resource):
+    parser = add_window_argument(reqparse.RequestParser())
+    
+    @marshal_with(objects.PopularQuery)
+    def get(self):
+        args = self.parser.parse_args()
         userlog.log_action('find-popular-queries')
-        return querylog.find_popular()
+        return popularity.get_popular('queries', args.window)
         
 class PopularVideos(Resource):
-    @marshal_with(objects.Asset)
+    """
+    The most popular videos. Assets are stored marshalled with the popular
+    list, so they are returned as they are.
+    """
+    parser = add_window_argument(reqparse.RequestParser())
+    
     def get(self):
+        args = self.parser.parse_args()
         userlog.log_action('find-popular-videos')
-        items = social.find_popular_videos(20)
-        results = []
-        for item in items:
-            asset = backend.lookup_asset(item['uri'])
-            results.append(asset)
-        return results
+        return [item['asset'] 
+            for item in popularity.get_popular('videos', args.window)]
         
 class ImageStore(Resource):
     def post(self):
@@ -244,7 +523,7 @@ class UserBookmarks(Resource):
         asset = request.json
         userlog.log_action('save-bookmark', asset['videoUri'])
         user.add_bookmark(asset)
-        social.increment_stats(asset['videoUri'], 'bookmarks')
+        social.record_stats(asset['videoUri'], 'bookmarks')
 
 class UserBookmark(Resource):
     method_decorators = [login_required] 
@@ -257,14 +536,16 @@ class UserBookmark(Resource):
     
     def put(self, uri):
         userlog.log_action('save-bookmark', uri)
-        asset = backend.lookup_asset(uri)
+        asset, = backend.lookup_assets([uri])
+        if asset is None:
+            abort(404, message='No such asset')
         user.add_bookmark(asset)
-        social.increment_stats(uri, 'bookmarks')
+        social.record_stats(uri, 'bookmarks')
         
     def delete(self, uri):
         userlog.log_action('delete-bookmark', uri)
         user.remove_bookmark(uri)
-        social.decrement_stats(uri, 'bookmarks')
+        social.record_stats(uri, 'bookmarks', -1)
 
 class UserRegistration(Resource):
     parser = reqparse.RequestParser()
@@ -299,6 +580,78 @@ class VersionInfo(Resource):
     def get(self):
         return backend.get_version_info()
 
+def admin_endpoint(method):
+    """
+    Restrict a resource method to the users named in ADMIN_USERS. Responds 
+    with 404 unless ADMIN_ENDPOINTS_ENABLED is set, and with 403 to other 
+    logged in users.
+    """
+    @wraps(method)
+    @login_required
+    def admin_only(*args, **kwargs):
+        if not user.is_admin():
+            abort(403, message='Not an administrator')
+        return method(*args, **kwargs)
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        from flask import current_app as app
+        if not app.config['ADMIN_ENDPOINTS_ENABLED']:
+            abort(404)
+        return admin_only(*args, **kwargs)
+    return wrapper
+
+class ConnectionPoolStats(Resource):
+    method_decorators = [admin_endpoint]
+    
+    @marshal_with(objects.ConnectionPoolStats)
+    def get(self):
+        return backend.get_connection_pool_stats()
+
+class UserLogStats(Resource):
+    method_decorators = [admin_endpoint]
+    
+    @marshal_with(objects.WriteQueueStats)
+    def get(self):
+        return userlog.get_queue_stats()
+
+class Metrics(Resource):
+    method_decorators = [admin_endpoint]
+    
+    def get(self):
+        return Response(metrics.expose(), 
+            mimetype='text/plain; version=0.0.4')
+
+class Profiles(Resource):
+    method_decorators = [admin_endpoint]
+    
+    @marshal_with(objects.ProfileInfo)
+    def get(self):
+        return profiling.get_store().list()
+
+def find_profile_or_404(profile_id):
+    info = profiling.get_store().get_info(profile_id)
+    if info is None:
+        abort(404, message='No such profile')
+    return info
+
+class Profile(Resource):
+    method_decorators = [admin_endpoint]
+    
+    @marshal_with(objects.ProfileInfo)
+    def get(self, profile_id):
+        return find_profile_or_404(profile_id)
+
+class ProfileData(Resource):
+    method_decorators = [admin_endpoint]
+    
+    def get(self, profile_id):
+        store = profiling.get_store()
+        path = store.get_data_path(find_profile_or_404(profile_id))
+        if path is None or not os.path.isfile(path):
+            abort(404, message='No profile data')
+        return send_file(os.path.abspath(path), as_attachment=True,
+            mimetype='application/octet-stream')
+
 class DatasetInfo(Resource):
     @marshal_with(objects.DatasetInfo)
     def get(self):
@@ -0,0 +1,220 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Pool of persistent JSON RPC connections to LIMAS
+"""
+import os
+import time
+import threading
+import logging
+import jsonrpclib
+
+from contextlib import contextmanager
+from jsonrpclib.jsonrpc import Transport, SafeTransport
+
+log = logging.getLogger('axeshome')
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+    pass
+
+class TimeoutMixIn(object):
+    """
+    Applies the transport's ``timeout`` (seconds, or None to wait forever)
+    to its connection before each request.
+    """
+    timeout = None
+
+    def make_connection(self, host):
+        conn = super(TimeoutMixIn, self).make_connection(host)
+        conn.timeout = self.timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(self.timeout)
+        return conn
+
+class TimeoutTransport(TimeoutMixIn, Transport):
+    pass
+
+class SafeTimeoutTransport(TimeoutMixIn, SafeTransport):
+    pass
+
+class PooledConnection(object):
+    """
+    A JSON RPC server proxy with its own transport. The transport keeps its
+    HTTP/1.1 connection open between calls, so reusing the proxy avoids a
+    new TCP connect for every request.
+    """
+
+    def __init__(self, url):
+        if url.startswith('https'):
+            self.transport = SafeTimeoutTransport()
+        else:
+            self.transport = TimeoutTransport()
+        self.proxy = jsonrpclib.Server(url, transport=self.transport)
+        self.created = time.time()
+        self.last_used = self.created
+        self.last_checked = self.created
+
+    def close(self):
+        try:
+            self.transport.close()
+        except Exception as e:
+            log.debug('Error closing LIMAS connection: %s', e)
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of keep-alive connections to a JSON RPC service.
+
+    At most ``size`` connections are open at once. Callers wait up to
+    ``timeout`` seconds for a free connection before a PoolTimeout is raised.
+    Connections idle for longer than ``idle_timeout`` seconds are closed
+    instead of being reused. If ``health_check`` names a service method, it
+    is called on connections that have not been checked for
+    ``health_check_interval`` seconds before they are handed out.
+
+    A pool belongs to the process that created it. Use it in a forked
+    worker only after checking ``pid``.
+    """
+
+    def __init__(self, url, size=8, timeout=10.0, idle_timeout=60.0,
+                 health_check=None, health_check_interval=30.0):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'waitTime': 0.0,
+            'timeouts': 0,
+            'discarded': 0,
+            'healthChecks': 0,
+            'healthCheckFailures': 0,
+        }
+
+    def _count(self, name, value=1):
+        with self._cond:
+            self._stats[name] += value
+
+    def _is_usable(self, conn):
+        now = time.time()
+        if now - conn.last_used > self.idle_timeout:
+            return False
+        if self.health_check and \
+           now - conn.last_checked > self.health_check_interval:
+            self._count('healthChecks')
+            try:
+                getattr(conn.proxy, self.health_check)()
+            except Exception as e:
+                log.warn('LIMAS connection failed health check: %s', e)
+                self._count('healthCheckFailures')
+                return False
+            conn.last_checked = time.time()
+        return True
+
+    def acquire(self):
+        """
+        Get a connection from the pool, opening a new one if necessary.
+        """
+        start = time.time()
+        waited = False
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                remaining = start + self.timeout - time.time()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout('no LIMAS connection available after '
+                        '{} seconds'.format(self.timeout))
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                self._cond.wait(remaining)
+            if waited:
+                self._stats['waitTime'] += time.time() - start
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = None
+                self._open += 1
+
+        if conn is not None:
+            if self._is_usable(conn):
+                self._count('hits')
+                return conn
+            conn.close()
+            self._count('discarded')
+
+        # Open a new connection (reusing the slot of any discarded one)
+        self._count('misses')
+        try:
+            return PooledConnection(self.url)
+        except Exception:
+            self._close_slot()
+            raise
+
+    def _close_slot(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def release(self, conn, discard=False):
+        """
+        Return a connection to the pool. Connections that saw an error
+        should be discarded since their state is unknown.
+        """
+        if discard:
+            conn.close()
+            self._count('discarded')
+            self._close_slot()
+            return
+        conn.last_used = time.time()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager yielding a server proxy from the pool. Calls made
+        with the proxy time out after ``timeout`` seconds.
+        """
+        conn = self.acquire()
+        conn.transport.timeout = timeout
+        try:
+            yield conn.proxy
+        except:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def get_stats(self):
+        """
+        Returns a dict of pool usage statistics.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['inUse'] = self._open - len(self._idle)
+        return stats
@@ -0,0 +1,182 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Compiled data marshaling
+
+Compiles the flask-restful field definitions in axeshome.marshal into plain
+functions, so marshaling an object does not go through the generic
+per-field output machinery. Output is the same as flask-restful's marshal.
+"""
+from functools import wraps
+from flask.ext.restful import fields
+from flask.ext.restful.utils import unpack
+from werkzeug.wrappers import BaseResponse
+from axeshome.metrics import timed_stage
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+class Marshalled(dict):
+    """
+    A dict that has already been marshaled. Marshaling it again returns it
+    unchanged, so marshaled data can be embedded in unmarshaled objects.
+    """
+    pass
+
+def _function(method):
+    return getattr(method, '__func__', method)
+
+def _has_custom_output(field_type):
+    """
+    Returns true if a field type overrides Raw.output.
+    """
+    return _function(field_type.output) is not _function(fields.Raw.output)
+
+def _getter(attribute):
+    """
+    Returns a function that gets an attribute from an object.
+    """
+    if '.' in attribute:
+        return lambda obj: fields.get_value(attribute, obj)
+    def get(obj):
+        if type(obj) is dict or type(obj) is Marshalled:
+            return obj.get(attribute)
+        return fields.get_value(attribute, obj)
+    return get
+
+def _compile_nested(nested_fields, allow_null):
+    marshal_nested = compile_fields(nested_fields)
+    def output(value):
+        if value is None:
+            return None if allow_null else marshal_nested(None)
+        if type(value) is Marshalled:
+            return value
+        return marshal_nested(value)
+    return output
+
+def _compile_field(key, field):
+    """
+    Compile a field into a function of the object being marshaled.
+    """
+    field_type = type(field)
+    get = _getter(field.attribute or key)
+    default = field.default
+
+    if field_type is fields.Nested:
+        nested = _compile_nested(field.nested,
+            getattr(field, 'allow_null', False))
+        return lambda obj: nested(get(obj))
+
+    if field_type is fields.List:
+        container = field.container
+        if type(container) is fields.Nested:
+            item = _compile_nested(container.nested,
+                getattr(container, 'allow_null', False))
+            def output_list(obj):
+                value = get(obj)
+                if value is None:
+                    return default
+                if isinstance(value, dict):
+                    return [item(value)]
+                return [item(v) for v in value]
+            return output_list
+        if _has_custom_output(type(container)):
+            return lambda obj: field.output(key, obj)
+        item_format = container.format
+        item_default = container.default
+        def output_list(obj):
+            value = get(obj)
+            if value is None:
+                return default
+            return [item_default if v is None else item_format(v)
+                for v in value]
+        return output_list
+
+    if field_type is fields.Raw:
+        def output_raw(obj):
+            value = get(obj)
+            return default if value is None else value
+        return output_raw
+
+    if _has_custom_output(field_type):
+        # Field with custom output: use it directly
+        return lambda obj: field.output(key, obj)
+
+    format = text_type if field_type is fields.String else field.format
+    def output(obj):
+        value = get(obj)
+        return default if value is None else format(value)
+    return output
+
+def compile_fields(schema):
+    """
+    Compile a dict of fields into a function that marshals an object.
+    """
+    compiled = [(key, _compile_field(key, field))
+        for key, field in schema.iteritems()]
+    def marshal_object(obj):
+        result = Marshalled()
+        for key, output in compiled:
+            result[key] = output(obj)
+        return result
+    return marshal_object
+
+_marshallers = {}
+
+def get_marshaller(schema):
+    """
+    Returns the compiled marshaling function for a schema.
+    """
+    marshaller = _marshallers.get(id(schema))
+    if marshaller is None:
+        marshaller = _marshallers[id(schema)] = compile_fields(schema)
+    return marshaller
+
+@timed_stage('marshal')
+def marshal(data, schema):
+    """
+    Marshal an object or list of objects. Equivalent to flask-restful's
+    marshal function.
+    """
+    marshaller = get_marshaller(schema)
+    if isinstance(data, (list, tuple)):
+        return [d if type(d) is Marshalled else marshaller(d) for d in data]
+    if type(data) is Marshalled:
+        return data
+    return marshaller(data)
+
+def premarshalled(data):
+    """
+    Mark an object or list of objects as already marshaled.
+    """
+    if isinstance(data, (list, tuple)):
+        return [premarshalled(d) for d in data]
+    if isinstance(data, dict) and type(data) is not Marshalled:
+        return Marshalled(data)
+    return data
+
+class marshal_with(object):
+    """
+    Decorator that marshals the return value of a resource method using a
+    compiled schema. Drop-in replacement for flask-restful's marshal_with,
+    except that response objects are returned unchanged.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        get_marshaller(schema)
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            if isinstance(resp, BaseResponse):
+                return resp
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return marshal(data, self.schema), code, headers
+            return marshal(resp, self.schema)
+        return wrapper
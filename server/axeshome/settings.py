@@ -19,6 +19,15 @@ MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
 MONGO_DBNAME = 'axeshome'
 
+# Don't pin a MongoDB connection to each thread for consistent reads. The
+# server doesn't need it, and under gevent every request greenlet would hold
+# a connection of its own.
+MONGO_AUTO_START_REQUEST = False
+
+# Create any missing indexes (see axeshome/indexes.py) when a worker starts.
+# Disable this to manage indexes with manage.py instead.
+MONGO_ENSURE_INDEXES = True
+
 # Location for user media
 MEDIA_URL = '/axes/home/media/'
 MEDIA_PATH = '../client/media/'
@@ -27,6 +36,194 @@ MEDIA_PATH = '../client/media/'
 SERVICE_URL = 'http://localhost:8091/json-rpc'
 LIMAS_PREPEND_URI_SLASH = True
 
+# LIMAS connection pool (per worker process). Connections idle for longer
+# than the idle timeout are reopened. Set LIMAS_POOL_HEALTH_CHECK to the name
+# of a cheap service method (e.g. 'getLastChange') to ping connections that 
+# have not been checked in LIMAS_POOL_HEALTH_CHECK_INTERVAL seconds. With
+# gevent workers, the pool size bounds the number of concurrent LIMAS calls 
+# per worker, so GEVENT_LIMAS_POOL_SIZE is used instead.
+LIMAS_POOL_SIZE = 8
+GEVENT_LIMAS_POOL_SIZE = 100
+LIMAS_POOL_TIMEOUT = 10.0
+LIMAS_POOL_IDLE_TIMEOUT = 60.0
+LIMAS_POOL_HEALTH_CHECK = None
+LIMAS_POOL_HEALTH_CHECK_INTERVAL = 30.0
+
+# Timeouts (seconds) for LIMAS calls. LIMAS_TIMEOUTS maps names of functions
+# in axeshome.backend (e.g. 'simple_search') to their own timeouts.
+LIMAS_TIMEOUT = 20.0
+LIMAS_TIMEOUTS = {
+    'get_last_update_time': 5.0,
+}
+
+# LIMAS circuit breaker (per worker process). After LIMAS_BREAKER_FAILURES
+# consecutive failed calls, or calls slower than LIMAS_BREAKER_SLOW_CALL_TIME
+# seconds, calls fail immediately with 503 for LIMAS_BREAKER_RESET_TIMEOUT 
+# seconds, after which a single trial call is let through. 
+LIMAS_BREAKER_FAILURES = 5
+LIMAS_BREAKER_RESET_TIMEOUT = 30.0
+LIMAS_BREAKER_SLOW_CALL_TIME = 15.0
+
+# Search result cache. Results are kept in an in-process LRU cache and, 
+# optionally, a cache shared between workers ('mongo' or 'redis', which needs
+# the redis package). Cached 
+# results are dropped when the LIMAS collection changes; the last change time
+# is checked at most every RESULT_CACHE_VERSION_CHECK_INTERVAL seconds.
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 3600
+RESULT_CACHE_SHARED = None
+RESULT_CACHE_MONGO_COLLECTION = 'resultcache'
+RESULT_CACHE_REDIS_URL = 'redis://localhost:6379/0'
+RESULT_CACHE_VERSION_CHECK_INTERVAL = 30.0
+
+# The last results of recent queries are kept (per worker process) to serve
+# when LIMAS is unavailable. Such responses have a Warning header. Set
+# RESULT_CACHE_STALE_SIZE to 0 to disable.
+RESULT_CACHE_STALE_SIZE = 256
+RESULT_CACHE_STALE_TTL = 86400
+
+# Identical concurrent searches in a worker share one LIMAS call. With 
+# SINGLE_FLIGHT_SHARED, workers also wait (up to SINGLE_FLIGHT_LOCK_TIMEOUT 
+# seconds) for the same search running in another worker. This needs a 
+# shared result cache (RESULT_CACHE_SHARED).
+SINGLE_FLIGHT_SHARED = False
+SINGLE_FLIGHT_LOCK_TIMEOUT = 30.0
+
+# Threads per worker for making independent backend calls concurrently, or
+# greenlets with gevent workers
+FANOUT_POOL_SIZE = 12
+GEVENT_FANOUT_POOL_SIZE = 100
+
+# Timeouts (seconds) for the calls made by the asset bundle resource. 
+# ASSET_BUNDLE_TIMEOUTS overrides the default for individual parts, e.g.
+# {'faceTracks': 5.0}
+ASSET_BUNDLE_TIMEOUT = 15.0
+ASSET_BUNDLE_TIMEOUTS = {}
+
+# User action logging. With write-behind enabled, actions are queued and 
+# written in batches by a background thread. When the queue is full, actions
+# are dropped ('drop') or the request waits briefly for space ('block').
+USERLOG_WRITE_BEHIND = True
+USERLOG_QUEUE_SIZE = 10000
+USERLOG_BATCH_SIZE = 100
+USERLOG_FLUSH_INTERVAL = 1.0
+USERLOG_QUEUE_FULL_POLICY = 'drop'
+
+# Video view and bookmark counts are aggregated in memory and written in bulk
+# at this interval (seconds). Set to 0 to write each increment immediately.
+SOCIAL_STATS_FLUSH_INTERVAL = 0.5
+
+# Popularity of queries and videos (see axeshome/popularity.py). Searches,
+# and video views, bookmarks and likes weighted by POPULARITY_VIDEO_WEIGHTS,
+# are counted in hourly and daily buckets and in trending scores that halve
+# every POPULARITY_HALF_LIFE seconds. Counts are aggregated in memory and
+# written every POPULARITY_FLUSH_INTERVAL seconds (0 to write immediately).
+# Popular lists are rebuilt at most every POPULARITY_REFRESH_INTERVAL seconds
+# and keep the assets of videos for up to POPULARITY_ASSET_MAX_AGE seconds.
+POPULARITY_HALF_LIFE = 86400
+POPULARITY_VIDEO_WEIGHTS = {'views': 1, 'bookmarks': 3, 'likes': 5}
+POPULARITY_FLUSH_INTERVAL = 1.0
+POPULARITY_REFRESH_INTERVAL = 60
+POPULARITY_ASSET_MAX_AGE = 3600
+POPULARITY_LIST_SIZES = {'queries': 100, 'videos': 20}
+
+# Query suggestions (/suggest) are served from an in-memory index of the
+# query log in each worker, updated with the worker's searches and synced
+# with the database every SUGGEST_SYNC_INTERVAL seconds. Queries searched
+# fewer than SUGGEST_MIN_HITS times are not suggested.
+SUGGEST_ENABLED = True
+SUGGEST_SYNC_INTERVAL = 30.0
+SUGGEST_MIN_HITS = 1
+SUGGEST_MAX_LIMIT = 50
+
+# Cache of logged in users, looked up by username and token on every 
+# authenticated request. Set USER_CACHE_SIZE to 0 to disable. Set the Redis
+# URL to broadcast invalidations to other workers (requires redis package).
+USER_CACHE_SIZE = 1000
+USER_CACHE_TTL = 300
+USER_CACHE_INVALIDATION_REDIS_URL = None
+
+# Cache of the URIs bookmarked by each user, used to mark bookmarked assets 
+# in result lists. Invalidations are broadcast using the user cache Redis 
+# URL. Set BOOKMARK_CACHE_SIZE to 0 to disable.
+BOOKMARK_CACHE_SIZE = 1000
+BOOKMARK_CACHE_TTL = 300
+
+# Snapshot of the landing page data (home and interesting topics, interesting
+# items and news sources), rebuilt in the background when the collection
+# changes or every SNAPSHOT_MAX_AGE seconds. With SNAPSHOT_STORE = 'mongo' 
+# one worker builds it and stores it for the others; with 'memory' each
+# worker builds its own.
+SNAPSHOT_ENABLED = True
+SNAPSHOT_STORE = 'memory'
+SNAPSHOT_MONGO_COLLECTION = 'snapshots'
+SNAPSHOT_CHECK_INTERVAL = 30.0
+SNAPSHOT_MAX_AGE = 600.0
+SNAPSHOT_TIMEOUT = 60.0
+
+# Cache-Control header sent with keyframes, transcripts and face tracks. 
+# These only change when the collection does, and are sent with ETags 
+# derived from the collection version, so clients can revalidate cheaply. 
+# Set to None to send no Cache-Control header.
+COLLECTION_CACHE_CONTROL = 'public, max-age=3600'
+
+# Compression of API responses larger than COMPRESS_MIN_SIZE bytes, with
+# brotli if the brotli package is installed or otherwise gzip. Disable this
+# if the reverse proxy compresses responses.
+COMPRESS_ENABLED = True
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 4
+COMPRESS_MIMETYPES = ['application/json']
+
+# JSON encoder for API responses: 'json', or 'ujson' or 'simplejson' if
+# installed (falls back to 'json' if not)
+JSON_ENCODER = 'json'
+
+# Timing and size metrics, kept per worker process and served at /metrics
+# in the Prometheus text format: request times and response sizes by 
+# resource, LIMAS call times by backend function, MongoDB operation times by
+# collection, and the times of processing stages (postprocessing, collecting
+# results, marshalling, JSON encoding and compression). With 
+# SERVER_TIMING_ENABLED, each response has a Server-Timing header with the 
+# time the request spent in each stage.
+METRICS_ENABLED = True
+SERVER_TIMING_ENABLED = False
+
+# Operational endpoints (/metrics, /service-pool-stats, 
+# /service-userlog-stats and /profiles) expose server internals and request
+# details. They are only served if ADMIN_ENDPOINTS_ENABLED is set, and only
+# to the logged in users named in ADMIN_USERS.
+ADMIN_ENDPOINTS_ENABLED = False
+ADMIN_USERS = []
+
+# Profiling of requests (see axeshome/profiling.py). A fraction of requests
+# (PROFILING_SAMPLE_RATE) are profiled with cProfile. With threaded workers,
+# the stacks of other requests are sampled every PROFILING_SAMPLE_INTERVAL 
+# seconds and kept for those slower than PROFILING_SLOW_REQUEST_TIME seconds
+# (None to disable). The newest PROFILING_MAX_PROFILES profiles are kept in 
+# PROFILING_PATH and listed at /profiles. Profiles include the times of LIMAS 
+# calls and other stages if METRICS_ENABLED is set, and the request's query 
+# arguments (such as users' searches) only if PROFILING_RECORD_ARGS is set.
+PROFILING_ENABLED = False
+PROFILING_RECORD_ARGS = False
+PROFILING_SAMPLE_RATE = 0.001
+PROFILING_SLOW_REQUEST_TIME = 2.0
+PROFILING_SAMPLE_INTERVAL = 0.005
+PROFILING_PATH = 'profiles'
+PROFILING_MAX_PROFILES = 100
+
+# Number of items kept in each user's history. A user's history is trimmed
+# once it holds HISTORY_TRIM_INTERVAL more items.
+HISTORY_LENGTH = 100
+HISTORY_TRIM_INTERVAL = 10
+
+# Compact history and bookmark items saved by older versions in the 
+# background when the first worker starts, and make them unique per user
+# and asset. Disable this to run manage.py compact-history instead.
+COMPACT_ASSET_ITEMS = True
+
 # Dataset info
 DATASET_INFO = {
     'id': 'cAXES',
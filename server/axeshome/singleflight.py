@@ -0,0 +1,64 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Coalescing of identical concurrent calls
+"""
+import threading
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time in a process. Callers that ask
+    for a key while a call for it is in flight wait for that call and share
+    its result, or its exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call func with the given arguments, unless a call for key is already
+        in flight, in which case wait for it and return its result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['calls'] += 1
+            else:
+                self._stats['shared'] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self):
+        """
+        Returns the number of calls made and the number of callers that
+        shared the result of another's call.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['inFlight'] = len(self._calls)
+        return stats
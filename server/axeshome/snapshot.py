@@ -0,0 +1,277 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Precomputed snapshot of the data shown on the landing page
+
+The home topics, interesting topics, interesting items and news sources are
+rebuilt by a background thread whenever the collection changes (according
+to LIMAS's last change time) or the snapshot is older than
+SNAPSHOT_MAX_AGE. Resources serve them from the snapshot without calling
+LIMAS. With SNAPSHOT_STORE set to 'mongo', one worker rebuilds the
+snapshot and stores it for the others.
+"""
+import os
+import json
+import time
+import hashlib
+import socket
+import logging
+import threading
+
+from datetime import datetime, timedelta
+from flask import current_app as app
+
+import axeshome.marshal as objects
+import axeshome.backend as backend
+import axeshome.fanout as fanout
+from axeshome.serialize import marshal, premarshalled
+
+log = logging.getLogger('axeshome')
+
+# Snapshot parts as (name, function, arguments, schema). The arguments are
+# the defaults of the resources that serve each part.
+SNAPSHOT_PARTS = [
+    ('home-topics', backend.get_home_topics, (10,), objects.Topic),
+    ('interesting-topics', backend.get_interesting_topics, (10, None),
+        objects.Topic),
+    ('interesting-items', backend.get_interesting_items, (),
+        objects.SearchResult),
+    ('news-sources', backend.get_news_sources, (), objects.NewsSource),
+]
+
+class SnapshotPart(object):
+    """
+    Marshaled data for one resource, with its ETag and last modified time.
+    """
+
+    def __init__(self, args, text, last_modified, etag=None):
+        self.args = tuple(args)
+        self.text = text
+        self.data = premarshalled(json.loads(text))
+        self.etag = etag or hashlib.sha1(text).hexdigest()
+        self.last_modified = last_modified
+
+class Snapshot(object):
+    """
+    A set of snapshot parts built for a version of the collection.
+    """
+
+    def __init__(self, version, created, parts):
+        self.version = version
+        self.created = created
+        self.parts = parts
+
+    def is_fresh(self, version, max_age):
+        age = time.time() - self.created
+        return self.version == version and age < max_age
+
+def build_snapshot(version, previous=None):
+    """
+    Call LIMAS for each snapshot part and marshal the results. Parts that
+    fail are taken from the previous snapshot, and the snapshot is built 
+    with no version so that it is rebuilt at the next check. Parts that did
+    not change keep the last modified time of the previous snapshot.
+    """
+    calls = [(name, func, args, None) 
+        for name, func, args, schema in SNAPSHOT_PARTS]
+    results, errors = fanout.fan_out(calls, app.config['SNAPSHOT_TIMEOUT'])
+    for name, error in errors.iteritems():
+        log.error('Failed to build snapshot of %s: %s', name, error)
+    created = time.time()
+    parts = {}
+    for name, func, args, schema in SNAPSHOT_PARTS:
+        old = previous.parts.get(name) if previous is not None else None
+        if name not in results:
+            if old is not None:
+                parts[name] = old
+            continue
+        text = json.dumps(marshal(results[name], schema), sort_keys=True)
+        part = SnapshotPart(args, text, created)
+        if old is not None and old.etag == part.etag:
+            part.last_modified = old.last_modified
+        parts[name] = part
+    if errors:
+        version = None
+    return Snapshot(version, created, parts)
+
+class MemorySnapshotStore(object):
+    """
+    Keeps no shared snapshot: every process builds its own.
+    """
+
+    def load(self):
+        return None
+
+    def acquire(self, lease):
+        return True
+
+    def save(self, snapshot):
+        pass
+
+class MongoSnapshotStore(object):
+    """
+    Stores the snapshot in a MongoDB collection shared by all workers. A
+    lease document makes sure only one worker rebuilds it at a time.
+    """
+
+    def __init__(self, collection='snapshots'):
+        self.collection_name = collection
+
+    @property
+    def owner(self):
+        return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    @property
+    def collection(self):
+        from axeshome.api import mongo
+        return mongo.db[self.collection_name]
+
+    def load(self):
+        doc = self.collection.find_one({'_id': 'snapshot'})
+        if doc is None:
+            return None
+        parts = {}
+        for name, part in doc['parts'].iteritems():
+            parts[name] = SnapshotPart(part['args'], part['text'],
+                part['lastModified'], part['etag'])
+        return Snapshot(doc['version'], doc['created'], parts)
+
+    def acquire(self, lease):
+        """
+        Try to take the rebuild lease for the given number of seconds.
+        """
+        from pymongo.errors import DuplicateKeyError
+        now = datetime.utcnow()
+        try:
+            self.collection.find_and_modify(
+                {'_id': 'lease', '$or': [
+                    {'expires': {'$lt': now}},
+                    {'owner': self.owner}
+                ]},
+                {'$set': {
+                    'owner': self.owner,
+                    'expires': now + timedelta(seconds=lease)
+                }}, upsert=True)
+        except DuplicateKeyError:
+            # Another worker holds the lease
+            return False
+        return True
+
+    def save(self, snapshot):
+        parts = {}
+        for name, part in snapshot.parts.iteritems():
+            parts[name] = {
+                'args': list(part.args),
+                'text': part.text,
+                'etag': part.etag,
+                'lastModified': part.last_modified
+            }
+        self.collection.save({
+            '_id': 'snapshot',
+            'version': snapshot.version,
+            'created': snapshot.created,
+            'parts': parts
+        })
+        self.collection.remove({'_id': 'lease', 'owner': self.owner})
+
+class SnapshotRefresher(object):
+    """
+    Keeps a snapshot up to date from a background thread, started on first
+    use in each process. The collection version is checked every
+    ``check_interval`` seconds.
+    """
+
+    def __init__(self, store, check_interval=30.0, max_age=600.0):
+        self.store = store
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.snapshot = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                flask_app = app._get_current_object()
+                thread = threading.Thread(target=self._run,
+                    args=(flask_app,), name='snapshot')
+                thread.daemon = True
+                thread.start()
+                self._pid = os.getpid()
+
+    def _run(self, flask_app):
+        while True:
+            with flask_app.app_context():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    log.error('Failed to refresh snapshot: %s', e)
+            time.sleep(self.check_interval)
+
+    def refresh(self):
+        """
+        Adopt the shared snapshot or rebuild it if it is out of date.
+        """
+        version = backend.get_last_update_time()
+        current = self.snapshot
+        if current is not None and current.is_fresh(version, self.max_age):
+            return
+        shared = self.store.load()
+        if shared is not None and shared.is_fresh(version, self.max_age):
+            self.snapshot = shared
+            return
+        if not self.store.acquire(self.check_interval * 2):
+            # Another worker is rebuilding; use what it last stored
+            if shared is not None:
+                self.snapshot = shared
+            return
+        snapshot = build_snapshot(version, shared or current)
+        self.store.save(snapshot)
+        self.snapshot = snapshot
+        log.info('Rebuilt snapshot of %s', ', '.join(sorted(snapshot.parts)))
+
+    def get_part(self, name, args=()):
+        """
+        Returns the snapshot part with the given name if it was built with
+        the given arguments, otherwise None.
+        """
+        self._ensure_started()
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        part = snapshot.parts.get(name)
+        if part is None or part.args != tuple(args):
+            return None
+        return part
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def get_refresher():
+    """
+    Returns the snapshot refresher, creating it if necessary.
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            if app.config['SNAPSHOT_STORE'] == 'mongo':
+                store = MongoSnapshotStore(
+                    app.config['SNAPSHOT_MONGO_COLLECTION'])
+            else:
+                store = MemorySnapshotStore()
+            _refresher = SnapshotRefresher(store,
+                app.config['SNAPSHOT_CHECK_INTERVAL'],
+                app.config['SNAPSHOT_MAX_AGE'])
+        return _refresher
+
+def get_part(name, args=()):
+    """
+    Returns the named snapshot part built with the given arguments, or None
+    if snapshots are disabled or it is not available.
+    """
+    if not app.config['SNAPSHOT_ENABLED']:
+        return None
+    return get_refresher().get_part(name, args)
@@ -4,31 +4,89 @@
 """
 Social features
 """
+import threading
+
 import axeshome.backend as backend
-from axeshome.api import mongo
+import axeshome.popularity as popularity
+from axeshome.api import app, mongo
+from axeshome.writebehind import CoalescingCounter
+
+# Counters kept for each video
+STATS_FIELDS = ('views', 'bookmarks', 'likes')
 
 def get_video_stats(uri):
     uri = backend.fix_uri(uri)
-    mongo.db.videostats.ensure_index('uri')
     stats = mongo.db.videostats.find_one({'uri': uri})
     if stats is None:
         stats = {'uri': uri, 'views': 0, 'bookmarks': 0, 'likes': 0}
-        ident = mongo.db.videostats.insert(stats)
-        stats = mongo.db.videostats.find_one({'_id': ident})
     return stats
     
-def increment_stats(uri, field):
-    stats = get_video_stats(uri)
-    stats[field] += 1
-    mongo.db.videostats.save(stats)
-    return stats
+def increment_stats(uri, field, amount=1):
+    """
+    Atomically add amount to a video counter, creating the stats document
+    if necessary. Returns the updated stats.
+    """
+    if field not in STATS_FIELDS:
+        raise ValueError('Unknown stats field: {}'.format(field))
+    uri = backend.fix_uri(uri)
+    record_interest(uri, field, amount)
+    return mongo.db.videostats.find_and_modify({'uri': uri}, 
+        {'$inc': {field: amount}}, upsert=True, new=True)
+
+def record_interest(uri, field, amount):
+    """
+    Add an increment of a video counter to the video's popularity. Removed
+    likes and bookmarks are not subtracted.
+    """
+    if amount > 0:
+        weight = app.config['POPULARITY_VIDEO_WEIGHTS'].get(field, 0)
+        if weight:
+            popularity.record('videos', uri, weight * amount)
 
 def decrement_stats(uri, field):
-    stats = get_video_stats(uri)
-    stats[field] -= 1
-    mongo.db.videostats.save(stats)
-    return stats
+    return increment_stats(uri, field, -1)
+
+def write_stats(counts):
+    """
+    Write coalesced counter increments, given as a dict mapping video URIs
+    to a dict of field increments.
+    """
+    with app.app_context():
+        bulk = mongo.db.videostats.initialize_unordered_bulk_op()
+        for uri, increments in counts.iteritems():
+            bulk.find({'uri': uri}).upsert().update_one(
+                {'$inc': increments})
+        bulk.execute()
+
+_counter = None
+_counter_lock = threading.Lock()
+
+def get_stats_counter():
+    """
+    Returns the coalescing counter for video stats.
+    """
+    global _counter
+    with _counter_lock:
+        if _counter is None:
+            _counter = CoalescingCounter(write_stats, 
+                app.config['SOCIAL_STATS_FLUSH_INTERVAL'], 'videostats')
+        return _counter
+
+def record_stats(uri, field, amount=1):
+    """
+    Add amount to a video counter without waiting for the database. If
+    SOCIAL_STATS_FLUSH_INTERVAL is set, increments are aggregated in memory 
+    and written in bulk at that interval.
+    """
+    if not app.config['SOCIAL_STATS_FLUSH_INTERVAL']:
+        increment_stats(uri, field, amount)
+        return
+    if field not in STATS_FIELDS:
+        raise ValueError('Unknown stats field: {}'.format(field))
+    uri = backend.fix_uri(uri)
+    record_interest(uri, field, amount)
+    get_stats_counter().add(uri, field, amount)
 
 def find_popular_videos(n=100):
     return mongo.db.videostats.find(
-        sort=[('likes', -1), ('views', -1)], limit=n)
\ No newline at end of file
+        sort=[('likes', -1), ('views', -1)], limit=n)
@@ -0,0 +1,208 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Query suggestions from an in-memory prefix index of the query log
+
+Each worker keeps the normalized texts of logged queries in a sorted list,
+so the queries starting with a prefix are found with two binary searches
+and ranked by their hits. The index is loaded by a background thread on
+first use, updated with the worker's own searches as they are logged, and
+synced with queries updated by other workers every SUGGEST_SYNC_INTERVAL
+seconds.
+"""
+import os
+import time
+import heapq
+import bisect
+import logging
+import threading
+
+from datetime import datetime, timedelta
+from flask import current_app as app
+
+log = logging.getLogger('axeshome')
+
+# Queries updated this many seconds before the last sync are synced again,
+# in case their writes were in flight
+SYNC_OVERLAP = 5.0
+
+def to_text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+class PrefixIndex(object):
+    """
+    Weighted texts in a sorted list. The top ``memo_size`` matches of
+    prefixes that match more than ``memo_threshold`` texts are remembered
+    until a text they match changes, so short prefixes are as fast as long
+    ones.
+    """
+
+    def __init__(self, weights=(), memo_threshold=256, memo_size=50):
+        self.memo_threshold = memo_threshold
+        self.memo_size = memo_size
+        self._weights = dict((to_text(text), weight)
+            for text, weight in weights)
+        self._texts = sorted(self._weights)
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _update(self, text, weight, increment):
+        text = to_text(text)
+        with self._lock:
+            if text not in self._weights:
+                bisect.insort(self._texts, text)
+                self._weights[text] = 0
+            if increment:
+                weight += self._weights[text]
+            self._weights[text] = weight
+            if self._memo:
+                for k in range(len(text) + 1):
+                    self._memo.pop(text[:k], None)
+
+    def set(self, text, weight):
+        """
+        Set the weight of a text, adding it if necessary.
+        """
+        self._update(text, weight, False)
+
+    def add(self, text, amount=1):
+        """
+        Add amount to the weight of a text, adding it if necessary.
+        """
+        self._update(text, amount, True)
+
+    def search(self, prefix, limit=10):
+        """
+        Returns the (text, weight) pairs of up to limit texts starting with
+        prefix, highest weight first.
+        """
+        prefix = to_text(prefix)
+        with self._lock:
+            texts = self._memo.get(prefix)
+            if texts is None or limit > len(texts):
+                start = bisect.bisect_left(self._texts, prefix)
+                end = bisect.bisect_left(self._texts, prefix + u'\uffff',
+                    start)
+                if end - start <= self.memo_threshold:
+                    texts = heapq.nlargest(limit, self._texts[start:end],
+                        key=self._weights.get)
+                else:
+                    texts = self._memo[prefix] = heapq.nlargest(
+                        max(limit, self.memo_size), self._texts[start:end],
+                        key=self._weights.get)
+            return [(text, self._weights[text]) for text in texts[:limit]]
+
+class QuerySuggester(object):
+    """
+    Keeps a prefix index of the query log up to date from a background
+    thread, started on first use in each process.
+    """
+
+    def __init__(self, sync_interval=30.0, max_limit=50):
+        self.sync_interval = sync_interval
+        self.max_limit = max_limit
+        self.index = None
+        self._last_sync = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                flask_app = app._get_current_object()
+                thread = threading.Thread(target=self._run,
+                    args=(flask_app,), name='suggest')
+                thread.daemon = True
+                thread.start()
+                self._pid = os.getpid()
+
+    def _run(self, flask_app):
+        while True:
+            with flask_app.app_context():
+                try:
+                    self.sync()
+                except Exception as e:
+                    log.error('Failed to sync query suggestions: %s', e)
+            time.sleep(self.sync_interval)
+
+    def sync(self):
+        """
+        Load the query log, or the queries updated since the last sync.
+        """
+        from axeshome.api import mongo
+        from axeshome.querylog import PLAIN_QUERIES
+        now = datetime.utcnow()
+        fields = ['text', 'hits']
+        if self.index is None:
+            docs = mongo.db.queries.find(PLAIN_QUERIES, fields)
+            self.index = PrefixIndex(
+                ((doc['text'], doc.get('hits', 0)) for doc in docs),
+                memo_size=self.max_limit)
+            log.info('Loaded %d queries for suggestions', len(self.index))
+        else:
+            since = self._last_sync - timedelta(seconds=SYNC_OVERLAP)
+            spec = dict(PLAIN_QUERIES, updated={'$gte': since})
+            for doc in mongo.db.queries.find(spec, fields):
+                self.index.set(doc['text'], doc.get('hits', 0))
+        self._last_sync = now
+
+    def record(self, text):
+        """
+        Count a search for a normalized query text.
+        """
+        index = self.index
+        if index is not None:
+            index.add(text)
+
+    def suggest(self, prefix, limit=10, min_hits=1):
+        """
+        Returns up to limit (text, hits) pairs of queries starting with a
+        normalized prefix, most searched first. Returns an empty list until
+        the index is loaded.
+        """
+        self._ensure_started()
+        index = self.index
+        if index is None:
+            return []
+        limit = min(limit, self.max_limit)
+        return [(text, hits) for text, hits in index.search(prefix, limit)
+            if hits >= min_hits]
+
+_suggester = None
+_suggester_lock = threading.Lock()
+
+def get_suggester():
+    """
+    Returns the query suggester, creating it if necessary.
+    """
+    global _suggester
+    with _suggester_lock:
+        if _suggester is None:
+            _suggester = QuerySuggester(app.config['SUGGEST_SYNC_INTERVAL'],
+                app.config['SUGGEST_MAX_LIMIT'])
+        return _suggester
+
+def record(text):
+    """
+    Add a search for a normalized query text to this worker's index.
+    """
+    if app.config['SUGGEST_ENABLED']:
+        get_suggester().record(text)
+
+def suggest(prefix, limit=10):
+    """
+    Returns up to limit (text, hits) pairs of logged queries starting with a
+    normalized prefix.
+    """
+    if not app.config['SUGGEST_ENABLED']:
+        return []
+    return get_suggester().suggest(prefix, limit,
+        app.config['SUGGEST_MIN_HITS'])
@@ -4,16 +4,22 @@
 """
 User and user registration management.
 """
+import os
 import string
 import random
 import hashlib
 import uuid
+import logging
+import threading
 
-from axeshome.api import mongo
+from axeshome.api import app, mongo
+from axeshome.cache import ProcessCache
 from flask.ext.login import UserMixin
 from flask.ext.login import current_user
 from flask.ext.restful import abort
 
+log = logging.getLogger('axeshome')
+
 class RegistrationError(Exception):
     """Raised when user registration fails"""
     pass
@@ -79,21 +85,69 @@ def password_is_insecure(password):
     # TODO: include any additional checks here
     return password is None or len(password) < 6
     
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+def get_user_cache():
+    """
+    Returns the user cache for this process, or None if disabled. Users are
+    cached by username, with the username of each token.
+    """
+    global _user_cache
+    if not app.config['USER_CACHE_SIZE']:
+        return None
+    with _user_cache_lock:
+        if _user_cache is None or _user_cache.pid != os.getpid():
+            _user_cache = ProcessCache(app.config['USER_CACHE_SIZE'],
+                app.config['USER_CACHE_TTL'],
+                app.config['USER_CACHE_INVALIDATION_REDIS_URL'],
+                'axeshome:users')
+        return _user_cache
+    
+def invalidate(username):
+    """
+    Drop any cached copy of a user. Call this whenever a user profile 
+    changes.
+    """
+    cache = get_user_cache()
+    if cache is not None:
+        cache.invalidate('username:' + username)
+
+def load(query):
+    """
+    Returns the user with the profile matching query, adding it to the 
+    cache. Returns None if not found.
+    """
+    profile = mongo.db.users.find_one(query)
+    if profile is None:
+        return None
+    user = User(profile)
+    cache = get_user_cache()
+    if cache is not None:
+        cache.set('username:' + user.username, user)
+        if user.get_auth_token():
+            cache.set('token:' + user.get_auth_token(), user.username)
+    return user
+    
 def find(username):
     """Returns the user object given the username, or None if not found"""
-    mongo.db.users.ensure_index('username')
-    profile = mongo.db.users.find_one({'username': username}) 
-    if profile is not None:
-        return User(profile)
-    return None
+    cache = get_user_cache()
+    if cache is not None:
+        user = cache.get('username:' + username)
+        if user is not None:
+            return user
+    return load({'username': username})
     
 def find_for_token(token):
     """Returns the user object given the token, or None if not found"""
-    mongo.db.users.ensure_index('token')
-    profile = mongo.db.users.find_one({'token': token}) 
-    if profile is not None:
-        return User(profile)
-    return None
+    cache = get_user_cache()
+    if cache is not None:
+        username = cache.get('token:' + token)
+        if username is not None:
+            user = cache.get('username:' + username)
+            if user is not None and user.get_auth_token() == token:
+                return user
+    return load({'token': token})
     
 def exists(username):
     """Returns true if there is a user with the given name"""
@@ -126,6 +180,7 @@ def register(username, password, email=None, first_name=None, last_name=None):
     }
     
     mongo.db.users.insert(new_profile)
+    invalidate(username)
     return User(new_profile)
 
 def authenticate(username, password):
@@ -156,76 +211,163 @@ def login(username, password, remember=True):
 def logout():
     """Log out the current user"""
     from flask.ext.login import logout_user
+    if is_logged_in():
+        invalidate(current_user.username)
     logout_user()
     
 def is_logged_in():
     return current_user and current_user.is_authenticated()
 
+def is_admin():
+    """Returns true if the current user is named in ADMIN_USERS"""
+    return is_logged_in() and \
+        current_user.username in app.config['ADMIN_USERS']
+
+# Asset fields kept in history and bookmark items. The history and
+# bookmark views show the video keyframe, title and summary.
+ASSET_SUMMARY_FIELDS = ('uri', 'videoUri', 'segmentUri', 'type', 'keyframe',
+    'videoKeyframe', 'startTime', 'endTime', 'segmentDuration',
+    'videoDuration')
+
+def summarize_asset(asset):
+    """
+    Returns a compact copy of an asset with the fields needed to list it.
+    """
+    summary = dict((key, asset.get(key)) for key in ASSET_SUMMARY_FIELDS)
+    metadata = asset.get('metadata') or {}
+    summary['metadata'] = {
+        'title': metadata.get('title'),
+        'summary': metadata.get('summary')
+    }
+    return summary
+
+def save_asset_item(collection, asset):
+    """
+    Add or update the item for an asset in a per-user collection of assets.
+    Returns true if a new item was added.
+    """
+    from datetime import datetime
+    from pymongo.errors import DuplicateKeyError
+    query = {'username': current_user.username, 'uri': asset['uri']}
+    update = {'$set': {
+        'timestamp': datetime.now(), 
+        'asset': summarize_asset(asset)
+    }}
+    try:
+        result = collection.update(query, update, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent request added the item first
+        collection.update(query, update)
+        return False
+    return bool(result and result.get('upserted'))
+
 def add_to_history(asset):
     """Add an asset to user history"""
-    from datetime import datetime
     if is_logged_in():
+        added = save_asset_item(mongo.db.history, asset)
         
-        # Remove old history item, if exists
-        mongo.db.history.ensure_index('username')
-        mongo.db.history.ensure_index('asset.uri')
-        mongo.db.history.remove({
-            'username': current_user.username,
-            'asset.uri': asset['uri']
-        })
-        
-        # Insert new history item
-        mongo.db.history.insert({
-            'username': current_user.username,
-            'timestamp': datetime.now(),
-            'asset': asset
-        })
+        # Trim history once it is a few items too long
+        username = current_user.username
+        if added and mongo.db.history.find({'username': username}).count() \
+                >= app.config['HISTORY_LENGTH'] + \
+                app.config['HISTORY_TRIM_INTERVAL']:
+            trim_history(username)
         
         return True
     return False
 
+def trim_history(username, length=None):
+    """
+    Remove all but the newest items in a users history. Returns the number
+    of items removed.
+    """
+    if length is None:
+        length = app.config['HISTORY_LENGTH']
+    oldest = list(mongo.db.history.find({'username': username}, 
+        {'timestamp': True}, sort=[('timestamp', -1)], skip=length, limit=1))
+    if not oldest:
+        return 0
+    result = mongo.db.history.remove({
+        'username': username,
+        'timestamp': {'$lte': oldest[0]['timestamp']}
+    })
+    return result.get('n', 0) if isinstance(result, dict) else 0
+
 def get_history(limit=100):
     """Get user history of assets visited by user"""
     if is_logged_in():
-        mongo.db.history.ensure_index('username')
         history = mongo.db.history.find(
             {'username': current_user.username},
             sort=[('timestamp', -1)], limit=limit)
         return list(history)
     return None
     
+_bookmark_cache = None
+_bookmark_cache_lock = threading.Lock()
+
+def get_bookmark_cache():
+    """Returns the bookmark cache for this process, or None if disabled"""
+    global _bookmark_cache
+    if not app.config['BOOKMARK_CACHE_SIZE']:
+        return None
+    with _bookmark_cache_lock:
+        if _bookmark_cache is None or _bookmark_cache.pid != os.getpid():
+            _bookmark_cache = ProcessCache(app.config['BOOKMARK_CACHE_SIZE'],
+                app.config['BOOKMARK_CACHE_TTL'],
+                app.config['USER_CACHE_INVALIDATION_REDIS_URL'],
+                'axeshome:bookmarks')
+        return _bookmark_cache
+
+def invalidate_bookmarks(username):
+    """Drop any cached copy of a user's bookmarked URIs"""
+    cache = get_bookmark_cache()
+    if cache is not None:
+        cache.invalidate(username)
+
+def get_bookmarked_uris():
+    """
+    Returns the set of asset URIs bookmarked by the currently logged in user.
+    The set is empty if there is no currently logged in user.
+    """
+    if not is_logged_in():
+        return frozenset()
+    username = current_user.username
+    cache = get_bookmark_cache()
+    if cache is not None:
+        uris = cache.get(username)
+        if uris is not None:
+            return uris
+    items = mongo.db.bookmarks.find({'username': username}, 
+        {'uri': True, 'asset.uri': True, '_id': False})
+    uris = frozenset(item.get('uri') or item['asset']['uri'] 
+        for item in items)
+    if cache is not None:
+        cache.set(username, uris)
+    return uris
+
+def is_bookmarked(asset, uris):
+    """
+    Returns true if the asset or its video is in the given set of bookmarked
+    URIs.
+    """
+    return asset.get('uri') in uris or asset.get('videoUri') in uris
+
 def add_bookmark(asset):
     """Add a bookmark to an asset for the currently logged in user"""
-    from datetime import datetime
     if is_logged_in():
-        
-        # Remove old bookmark, if exists
-        mongo.db.bookmarks.ensure_index('username')
-        mongo.db.bookmarks.ensure_index('asset.uri')
-        mongo.db.bookmarks.remove({
-            'username': current_user.username,
-            'asset.uri': asset['uri']
-        })
-        
-        # Insert new bookmark
-        mongo.db.bookmarks.insert({
-            'username': current_user.username,
-            'timestamp': datetime.now(),
-            'asset': asset
-        })
-        
+        save_asset_item(mongo.db.bookmarks, asset)
+        invalidate_bookmarks(current_user.username)
         return True
     return False
     
 def remove_bookmark(uri):
     """Remove a bookmark to an asset for the currently logged in user"""
     if is_logged_in():
-        mongo.db.bookmarks.ensure_index('username')
-        mongo.db.bookmarks.ensure_index('asset.uri')
         mongo.db.bookmarks.remove({
             'username': current_user.username,
-            'asset.uri': uri
+            'uri': uri
         })
+        invalidate_bookmarks(current_user.username)
         return True
     return False
     
@@ -236,22 +378,147 @@ def has_bookmark(uri):
        in user.
     """
     if is_logged_in():
-        mongo.db.bookmarks.ensure_index('username')
-        mongo.db.bookmarks.ensure_index('asset.uri')
         return mongo.db.bookmarks.find_one({
             'username': current_user.username,
-            'asset.uri': uri
-        }) is not None
+            'uri': uri
+        }, {'_id': True}) is not None
     return False
 
 def get_bookmarks(limit=0):
     """Get a list of the current users bookmarks"""
     if is_logged_in():
-        mongo.db.bookmarks.ensure_index('username')
         bookmarks = mongo.db.bookmarks.find(
             {'username': current_user.username},
             sort=[('timestamp', -1)], limit=limit)
         return list(bookmarks)
     return None
+
+def compact_asset_items(collection, length=None):
+    """
+    Compact a history or bookmark collection written by older versions: 
+    replace stored assets by summaries, add the top level uri field, remove 
+    duplicate items for an asset and, if length is given, trim each user's
+    items to the newest length. Returns a dict of counts of changed items.
+    """
+    counts = {'summarized': 0, 'duplicates': 0, 'trimmed': 0}
     
+    # Summarize full assets
+    stale = collection.find({'$or': [
+        {'uri': {'$exists': False}}, 
+        {'asset.videoSources': {'$exists': True}}
+    ]}, {'asset': True})
+    for item in stale:
+        collection.update({'_id': item['_id']}, {'$set': {
+            'uri': item['asset']['uri'],
+            'asset': summarize_asset(item['asset'])
+        }})
+        counts['summarized'] += 1
+    
+    # Remove duplicate and excess items, newest first
+    for username in collection.distinct('username'):
+        seen = set()
+        duplicates = []
+        excess = []
+        items = collection.find({'username': username}, {'uri': True}, 
+            sort=[('timestamp', -1)])
+        for item in items:
+            if item['uri'] in seen:
+                duplicates.append(item['_id'])
+            elif length is not None and len(seen) >= length:
+                excess.append(item['_id'])
+            else:
+                seen.add(item['uri'])
+        if duplicates or excess:
+            collection.remove({'_id': {'$in': duplicates + excess}})
+        counts['duplicates'] += len(duplicates)
+        counts['trimmed'] += len(excess)
+    
+    return counts
+
+def compact_history():
+    """Compact the history collection. See compact_asset_items."""
+    return compact_asset_items(mongo.db.history, app.config['HISTORY_LENGTH'])
+
+def compact_bookmarks():
+    """Compact the bookmarks collection. See compact_asset_items."""
+    return compact_asset_items(mongo.db.bookmarks)
+
+# Migration marker for compacting history and bookmarks
+COMPACTION_ID = 'compact-asset-items'
+
+# A compaction not finished after this long is assumed to have died 
+COMPACTION_TIMEOUT = 3600
+
+def make_asset_items_unique(collection):
+    """
+    Replace the (username, uri) index of a history or bookmark collection 
+    with a unique index, so there is one item per user and asset.
+    """
+    from pymongo import ASCENDING
+    keys = [('username', ASCENDING), ('uri', ASCENDING)]
+    for name, info in collection.index_information().iteritems():
+        if info['key'] == keys and not info.get('unique'):
+            collection.drop_index(name)
+    collection.create_index(keys, unique=True)
+
+def compact_asset_collections(attempts=3):
+    """
+    Compact the history and bookmark collections and make their items 
+    unique, marking the migration as done. Items duplicated while compacting
+    make the unique index fail, so it is retried. Returns a dict of counts 
+    for each collection (see compact_asset_items).
+    """
+    from datetime import datetime
+    from pymongo.errors import OperationFailure
+    for attempt in range(attempts):
+        counts = {'history': compact_history(), 
+            'bookmarks': compact_bookmarks()}
+        try:
+            make_asset_items_unique(mongo.db.history)
+            make_asset_items_unique(mongo.db.bookmarks)
+        except OperationFailure:
+            if attempt == attempts - 1:
+                raise
+            continue
+        mongo.db.migrations.update({'_id': COMPACTION_ID}, {'$set': {
+            'done': True, 'finished': datetime.utcnow()}}, upsert=True)
+        return counts
+
+def claim_compaction():
+    """
+    Returns true if this process should compact the history and bookmark 
+    collections: they haven't been compacted, and no other process is 
+    compacting them.
+    """
+    from datetime import datetime, timedelta
+    from pymongo.errors import DuplicateKeyError
+    now = datetime.utcnow()
+    try:
+        mongo.db.migrations.insert({'_id': COMPACTION_ID, 'done': False,
+            'started': now})
+        return True
+    except DuplicateKeyError:
+        stale = now - timedelta(seconds=COMPACTION_TIMEOUT)
+        return mongo.db.migrations.find_and_modify(
+            {'_id': COMPACTION_ID, 'done': False, 'started': {'$lt': stale}},
+            {'$set': {'started': now}}) is not None
+
+def start_compactor():
+    """
+    Compact history and bookmark items written by older versions in a 
+    background thread, unless already done or in progress elsewhere.
+    """
+    if not claim_compaction():
+        return
+    def run():
+        with app.app_context():
+            try:
+                counts = compact_asset_collections()
+                log.info('Compacted history and bookmarks: %s', counts)
+            except Exception as e:
+                log.error('Failed to compact history and bookmarks: %s', e)
+    thread = threading.Thread(target=run, name='compact-asset-items')
+    thread.daemon = True
+    thread.start()
+    return thread
         
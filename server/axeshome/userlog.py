@@ -1,12 +1,14 @@
 #
-# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved. 
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
 #
 """
 Logging of user actions.
 """
 import logging
+import threading
 
-from axeshome.api import mongo
+from axeshome.api import app, mongo
+from axeshome.writebehind import WriteBehindQueue
 import axeshome.user as user
 from datetime import datetime
 
@@ -15,15 +17,50 @@ log = logging.getLogger('axeshome.userlog')
 def get_current_username():
     if user.is_logged_in():
        return user.current_user.username
-    return 'anonymous' 
+    return 'anonymous'
 
-def log_action(action, info=None): 
-    user = get_current_username()
-    log.info('[%s] <%s> info: %s', user, action, info)
-    mongo.db.userlog.insert({
+def write_actions(actions):
+    """
+    Write a batch of user actions to the log file and database.
+    """
+    for action in actions:
+        log.info('[%s] <%s> info: %s', action['user'], action['action'],
+            action['info'])
+    with app.app_context():
+        mongo.db.userlog.insert(actions)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+    """
+    Returns the write-behind queue for user actions.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteBehindQueue(write_actions,
+                max_size=app.config['USERLOG_QUEUE_SIZE'],
+                batch_size=app.config['USERLOG_BATCH_SIZE'],
+                flush_interval=app.config['USERLOG_FLUSH_INTERVAL'],
+                policy=app.config['USERLOG_QUEUE_FULL_POLICY'],
+                name='userlog')
+        return _queue
+
+def get_queue_stats():
+    """
+    Returns statistics for the user action queue.
+    """
+    return get_queue().get_stats()
+
+def log_action(action, info=None):
+    entry = {
         'user': get_current_username(),
         'timestamp': datetime.now(),
         'action': action,
-        'info': info 
-    })
-    
\ No newline at end of file
+        'info': info
+    }
+    if app.config['USERLOG_WRITE_BEHIND']:
+        get_queue().put(entry)
+    else:
+        write_actions([entry])
@@ -4,6 +4,8 @@
 """
 Various utilities.
 """
+import hashlib
+
 from flask.ext.restful import abort
 from bson.objectid import ObjectId
 from base64 import b64decode
@@ -44,15 +46,80 @@ def find_or_404(collection, objectid):
         abort(404, message=error)
     return item
 
+def normalize_text(text):
+    """
+    Normalize query text: collapse whitespace and lowercase.
+    """
+    return ' '.join(text.split()).lower()
+
+def escape_clause_text(text):
+    return text.replace('(', '\\(').replace(')', '\\)')
+
+def unescape_clause_text(text):
+    return text.replace('\\(', '(').replace('\\)', ')')
+
+def normalize_clause(clause):
+    """
+    Normalize a query clause. Types are lowercase and start with a hash.
+    Clause text is unescaped and normalized, except for the literal text of 
+    image clauses (types ending in '-i'), which is only stripped.
+    """
+    type = clause['type'].strip().lower()
+    if not type.startswith('#'):
+        type = '#' + type
+    text = unescape_clause_text(clause['text'])
+    if type.endswith('-i'):
+        text = text.strip()
+    else:
+        text = normalize_text(text)
+    return {'type': type, 'text': text}
+
+def canonical_clauses(clauses):
+    """
+    Returns the normalized clauses of a query, sorted and without 
+    duplicates, so that equivalent queries have the same clauses.
+    """
+    unique = set()
+    for clause in clauses or []:
+        clause = normalize_clause(clause)
+        unique.add((clause['type'], clause['text']))
+    return [{'type': type, 'text': text} for type, text in sorted(unique)]
+
+def encode_clauses(clauses):
+    """
+    Encode clauses to a query string, e.g. '#speech(obama) #face-t(x)'.
+    """
+    return ' '.join('{}({})'.format(clause['type'], 
+        escape_clause_text(clause['text'])) for clause in clauses)
+
+def canonical_query(text, clauses=None):
+    """
+    Returns the canonical form of a query's text and clauses, e.g. 
+    'obama #speech(obama)', the same for all equivalent queries.
+    """
+    canonical = normalize_text(text)
+    if clauses:
+        canonical = ' '.join(filter(None, [canonical, 
+            encode_clauses(canonical_clauses(clauses))]))
+    return canonical
+
+def query_key(text, clauses=None):
+    """
+    Returns a stable key for a query, the same for all equivalent queries.
+    """
+    canonical = normalize_text(text)
+    if clauses:
+        canonical += '\n' + encode_clauses(canonical_clauses(clauses))
+    if not isinstance(canonical, bytes):
+        canonical = canonical.encode('utf-8')
+    return hashlib.sha1(canonical).hexdigest()
+
 def clause_type(text):
     try:
         type, value = text.split(':', 1)
     except:
         raise ValueError('Parse error')
-    # prepend hash if necessary
-    if not type.startswith('#'):
-        type = '#' + type
-    return { 'type': type, 'text': value }
+    return normalize_clause({ 'type': type, 'text': value })
 
 def parse_data_url(data_url):
     """
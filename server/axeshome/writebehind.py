@@ -0,0 +1,232 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Write-behind queues for database writes made off the request path
+"""
+import os
+import time
+import Queue
+import atexit
+import logging
+import threading
+
+log = logging.getLogger('axeshome')
+
+class WriteBehindQueue(object):
+    """
+    Buffers items and passes them in batches to a write function called
+    from a background thread. A batch is written when it holds
+    ``batch_size`` items or ``flush_interval`` seconds after its first item
+    arrived, whichever comes first.
+
+    When the queue holds ``max_size`` items, new items are dropped
+    (policy 'drop') or the caller waits up to ``block_timeout`` seconds for
+    space before dropping them (policy 'block'). Dropped items are counted.
+
+    The background thread is started on first use in each process, and the
+    queue is flushed when the process exits.
+    """
+
+    def __init__(self, write, max_size=10000, batch_size=100,
+                 flush_interval=1.0, policy='drop', block_timeout=0.05,
+                 name='write-behind'):
+        if policy not in ('drop', 'block'):
+            raise ValueError('Unknown queue full policy: {}'.format(policy))
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.name = name
+        self._queue = Queue.Queue(max_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._stats = {'queued': 0, 'written': 0, 'dropped': 0, 'failed': 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Items queued in a parent process belong to the parent
+                self._queue = Queue.Queue(self._queue.maxsize)
+                self._thread = threading.Thread(target=self._run,
+                    name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+                atexit.register(self.close)
+
+    def put(self, item):
+        """
+        Queue an item for writing. Returns False if it was dropped.
+        """
+        self._ensure_started()
+        try:
+            if self.policy == 'block':
+                self._queue.put(item, True, self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except Queue.Full:
+            self._count('dropped')
+            return False
+        self._count('queued')
+        return True
+
+    def _take_batch(self, wait=True):
+        batch = []
+        try:
+            batch.append(self._queue.get(wait, self.flush_interval))
+        except Queue.Empty:
+            return batch
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                if wait and remaining > 0:
+                    batch.append(self._queue.get(True, remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        try:
+            self.write(batch)
+        except Exception as e:
+            log.error('%s: failed to write %d items: %s', self.name,
+                len(batch), e)
+            self._count('failed', len(batch))
+        else:
+            self._count('written', len(batch))
+
+    def _run(self):
+        while not self._closed:
+            batch = self._take_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def flush(self):
+        """
+        Write all queued items from the calling thread.
+        """
+        while True:
+            batch = self._take_batch(wait=False)
+            if not batch:
+                break
+            self._write_batch(batch)
+
+    def close(self):
+        """
+        Stop the background thread and write any remaining items.
+        """
+        self._closed = True
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(self.flush_interval * 2)
+        self.flush()
+
+    def get_stats(self):
+        """
+        Returns a dict of queue statistics.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+class CoalescingCounter(object):
+    """
+    Aggregates counter increments in memory and passes the totals to a write
+    function from a background thread every ``flush_interval`` seconds.
+    The totals are passed as a dict mapping each key to a dict of field
+    increments.
+
+    The background thread is started on first use in each process, and the
+    counts are flushed when the process exits.
+    """
+
+    def __init__(self, write, flush_interval=0.5, name='counter'):
+        self.write = write
+        self.flush_interval = flush_interval
+        self.name = name
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._stats = {'increments': 0, 'writes': 0, 'failed': 0}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._counts = {}
+                self._thread = threading.Thread(target=self._run,
+                    name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+                atexit.register(self.close)
+
+    def add(self, key, field, amount=1):
+        """
+        Add amount to a field of the counter for key.
+        """
+        self._ensure_started()
+        with self._lock:
+            fields = self._counts.get(key)
+            if fields is None:
+                fields = self._counts[key] = {}
+            fields[field] = fields.get(field, 0) + amount
+            self._stats['increments'] += 1
+
+    def _run(self):
+        while not self._closed:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Write the accumulated counts from the calling thread.
+        """
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+            if not counts:
+                return
+            try:
+                self.write(counts)
+            except Exception as e:
+                log.error('%s: failed to write %d counters: %s', self.name,
+                    len(counts), e)
+                with self._lock:
+                    self._stats['failed'] += len(counts)
+            else:
+                with self._lock:
+                    self._stats['writes'] += len(counts)
+
+    def close(self):
+        """
+        Stop the background thread and write any remaining counts.
+        """
+        self._closed = True
+        self.flush()
+
+    def get_stats(self):
+        """
+        Returns a dict of counter statistics.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._counts)
+        return stats
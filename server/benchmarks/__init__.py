@@ -0,0 +1,6 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Load tests and benchmarks for the AXES home server.
+"""
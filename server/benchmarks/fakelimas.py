@@ -0,0 +1,306 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Stand-in for the LIMAS JSON RPC service, for load testing
+
+Returns generated search results, assets, topics, keyframes and transcripts
+after a configurable delay. The number of hits, the number of keyframe and
+transcript segments, and the length of text fields can be set to match the
+payload sizes of a real collection. Connections are kept alive between
+requests, as the server's connection pool expects. Run it with::
+
+  $ python -m benchmarks.fakelimas --port 8091 --latency 0.2
+
+and point SERVICE_URL at http://localhost:8091/json-rpc.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+WORDS = ('news', 'report', 'interview', 'minister', 'election', 'weather',
+    'football', 'match', 'city', 'council', 'police', 'court', 'market',
+    'music', 'festival', 'history', 'science', 'health', 'school', 'film')
+
+def text(seed, words):
+    """Returns a deterministic string of the given number of words"""
+    rnd = random.Random(seed)
+    return ' '.join(rnd.choice(WORDS) for k in range(words))
+
+def keyframe(uri):
+    return {
+        'imageUrl': 'http://limas.example.com/keyframes{}.jpg'.format(uri),
+        'thumbnailUrl': 'http://limas.example.com/thumbs{}.jpg'.format(uri),
+    }
+
+def video_uri(i):
+    return '/cAXES/v{:06d}'.format(i)
+
+def video(i, words=20):
+    uri = video_uri(i)
+    return {
+        'uri': uri,
+        'videoUri': uri,
+        'keyframe': keyframe(uri),
+        'startTimeMillis': 0,
+        'endTimeMillis': 1800000,
+        'durationMillis': 1800000,
+        'speech': None,
+        'metadata': {
+            'title': 'Video {}'.format(i),
+            'summary': text(i, max(1, words // 4)),
+            'description': text(i + 1, words),
+            'genres': ['news'],
+            'keywords': ['keyword{}'.format(i % 10), 'keyword'],
+            'entities': [],
+            'language': 'en',
+            'license': None,
+            'publicationDate': '2010-01-01',
+            'contributors': [],
+            'persons': ['Person {}'.format(i % 7)],
+            'objects': [],
+            'places': ['Place {}'.format(i % 5)],
+        },
+        'sources': [
+            {'format': 'mp4', 'url': 'http://limas.example.com{}.mp4'.format(uri)},
+            {'format': 'webm', 'url': 'http://limas.example.com{}.webm'.format(uri)},
+        ],
+    }
+
+def segment(i, j, words=20):
+    uri = '{}/s{:06d}'.format(video_uri(i), j)
+    return {
+        'uri': uri,
+        'videoUri': video_uri(i),
+        'keyframe': keyframe(uri),
+        'startTimeMillis': j * 10000,
+        'endTimeMillis': j * 10000 + 10000,
+        'durationMillis': 10000,
+        'speech': {'speaker': 'speaker', 'spokenWords': text(i * 1000 + j,
+            words)},
+    }
+
+def search_result(seed, hits=50, videos=None, words=20):
+    """
+    Generate a LIMAS search result with the given number of hits, spread
+    over the given number of videos (default: a fifth of the hits). Text 
+    fields have the given number of words.
+    """
+    rnd = random.Random(seed)
+    videos = videos or max(1, hits // 5)
+    result = {'ranking': [], 'videos': {}, 'segments': {}, 'evidence': []}
+    for rank in range(hits):
+        i = rnd.randrange(videos) + seed * 1000
+        result['videos'][video_uri(i)] = video(i, words)
+        if rank % 4 == 0:
+            uri, type = video_uri(i), 'Video'
+        else:
+            item = segment(i, rnd.randrange(180), words)
+            result['segments'][item['uri']] = item
+            uri, type = item['uri'], 'Segment'
+        result['ranking'].append({'uri': uri, 'type': type, 'rank': rank,
+            'score': 1.0 / (rank + 1), 'scores': [0.5, 0.25]})
+    for k in range(2):
+        result['evidence'].append({'queryString': 'evidence{}'.format(k),
+            'displayName': 'Evidence {}'.format(k),
+            'examples': [keyframe('/evidence/{}'.format(k))]})
+    return result
+
+def parse_uri(uri):
+    """
+    Returns the video and segment numbers in a URI (segment may be None).
+    URIs not generated here, e.g. from a replayed log, are mapped to numbers
+    by hashing their parts.
+    """
+    parts = uri.strip('/').split('/')
+    if len(parts) < 2:
+        return None, None
+    def number(part):
+        try:
+            return int(part[1:])
+        except ValueError:
+            return hash(part) % 1000000
+    i = number(parts[1])
+    j = number(parts[2]) if len(parts) > 2 else None
+    return i, j
+
+class FakeLimas(object):
+    """
+    Implementation of the LIMAS methods used by the server. Search results
+    have ``hits`` hits, keyframe and transcript lists have ``segments`` 
+    items, and text fields have ``words`` words.
+    """
+
+    def __init__(self, hits=50, segments=30, words=20):
+        self.hits = hits
+        self.segments = segments
+        self.words = words
+
+    def search_result(self, seed, hits):
+        return search_result(seed, hits, words=self.words)
+
+    def search(self, query):
+        return self.search_result(hash(json.dumps(query)) % 1000, self.hits)
+
+    def searchWithParsedQuery(self, query):
+        return self.search_result(hash(json.dumps(query)) % 1000, self.hits)
+
+    def getQueryForItem(self, uri):
+        return {'queryText': uri, 'clauses': []}
+
+    def getQueryForSource(self, uri):
+        return {'queryText': uri, 'clauses': []}
+
+    def lookup(self, uris, options=None):
+        items = []
+        for uri in uris:
+            i, j = parse_uri(uri)
+            if i is None:
+                items.append(None)
+            elif j is None:
+                items.append(video(i, self.words))
+            else:
+                items.append(segment(i, j, self.words))
+        return items
+
+    def findRelatedVideos(self, uri, options=None):
+        return self.search_result(hash(uri) % 1000, 10)
+
+    def findRelatedSegments(self, uri, options=None):
+        return self.search_result(hash(uri) % 1000 + 1, 10)
+
+    def getKeyframes(self, uri):
+        i, j = parse_uri(uri)
+        return [dict(segment(i or 0, k, self.words), keyframe=keyframe(uri))
+            for k in range(self.segments)]
+
+    def getSpeechSegments(self, uri):
+        i, j = parse_uri(uri)
+        return [segment(i or 0, k, self.words) 
+            for k in range(self.segments)]
+
+    def getFaceTracks(self, uri):
+        return [{'uri': '{}/f{}'.format(uri, k), 'startTimeMillis': k * 1000,
+            'endTimeMillis': k * 1000 + 500, 'keyframe': keyframe(uri),
+            'keyframePos': 0, 'positions': [
+                {'frame': f, 'time': f * 40, 'roi': [10, 10, 50, 50]}
+                for f in range(10)]} for k in range(5)]
+
+    def getLastChange(self):
+        return 1420070400000
+
+    def getInterestingItems(self):
+        return self.search_result(1, 20)
+
+    def getHomeTopics(self, count):
+        return [{'name': 'Topic {}'.format(k), 'exampleImages': [],
+            'collectionExamples': self.search_result(k, 10)} 
+            for k in range(count)]
+
+    def getInterestingTopics(self, count, *args):
+        return self.getHomeTopics(count)
+
+    def getTopicTypes(self):
+        return ['person', 'place']
+
+    def getNewsSources(self):
+        return [{'uri': '/news/{}'.format(k), 'name': 'News {}'.format(k),
+            'description': 'News source {}'.format(k), 'homeURL': 
+            'http://news.example.com/{}'.format(k), 'pictureURL': 
+            'http://news.example.com/{}.png'.format(k)} for k in range(5)]
+
+    def getAvailableServices(self):
+        return ['search', 'lookup']
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length))
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        method = getattr(self.server.limas, request['method'], None)
+        if method is None or request['method'].startswith('_'):
+            response['error'] = {'code': -32601, 'message': 'No such method'}
+        else:
+            delay = self.server.get_latency(request['method'])
+            if delay > 0:
+                time.sleep(delay)
+            response['result'] = method(*request.get('params', []))
+        body = json.dumps(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json-rpc')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeLimasServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server for FakeLimas. Each call is delayed by ``latency``
+    seconds, or the latency given for its method in ``method_latency``, plus
+    or minus up to ``jitter`` seconds.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, limas=None, latency=0.0, jitter=0.0,
+                 method_latency=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.limas = limas or FakeLimas()
+        self.latency = latency
+        self.jitter = jitter
+        self.method_latency = method_latency or {}
+
+    def get_latency(self, method):
+        latency = self.method_latency.get(method, self.latency)
+        return latency + random.uniform(-self.jitter, self.jitter)
+
+def start(port=8091, **kwargs):
+    """
+    Start a fake LIMAS server in a background thread. Returns the server.
+    """
+    server = FakeLimasServer(('localhost', port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def method_latency_type(text):
+    method, seconds = text.split('=', 1)
+    return method, float(seconds)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake LIMAS server')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--latency', type=float, default=0.0,
+        help='seconds to wait before answering each call')
+    parser.add_argument('--jitter', type=float, default=0.0,
+        help='maximum random variation of the latency (seconds)')
+    parser.add_argument('--method-latency', type=method_latency_type,
+        action='append', default=[], metavar='METHOD=SECONDS',
+        help='latency for a single method, e.g. search=0.5')
+    parser.add_argument('--hits', type=int, default=50,
+        help='number of hits in search results')
+    parser.add_argument('--segments', type=int, default=30,
+        help='number of keyframe and transcript segments per video')
+    parser.add_argument('--words', type=int, default=20,
+        help='number of words in text fields')
+    args = parser.parse_args(argv)
+    limas = FakeLimas(args.hits, args.segments, args.words)
+    server = FakeLimasServer(('', args.port), limas, args.latency, 
+        args.jitter, dict(args.method_latency))
+    print('Fake LIMAS listening on http://localhost:{}/json-rpc'.format(
+        args.port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
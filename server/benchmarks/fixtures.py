@@ -0,0 +1,106 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Database fixtures for benchmarks
+
+EphemeralMongo runs a throwaway mongod with its data in a temporary
+directory. use_mongomock replaces the MongoDB client used by the server with
+an in-memory mongomock client, which needs no mongod but behaves nothing like
+MongoDB under load, so use it for profiling the server itself rather than for
+numbers to compare with production.
+"""
+import os
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+
+def free_port():
+    """Returns a TCP port that is free on localhost"""
+    sock = socket.socket()
+    try:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+class EphemeralMongo(object):
+    """
+    A mongod process listening on localhost, with its data in a temporary
+    directory that is removed when it is stopped. Use it as a context
+    manager::
+
+      with EphemeralMongo() as mongo:
+          settings = mongo.settings()
+    """
+
+    def __init__(self, mongod='mongod', port=None):
+        self.mongod = mongod
+        self.port = port
+        self.path = None
+        self.process = None
+
+    def start(self, timeout=30.0):
+        """
+        Start mongod and wait up to timeout seconds for it to accept
+        connections.
+        """
+        from pymongo import MongoClient
+        from pymongo.errors import ConnectionFailure
+        self.port = self.port or free_port()
+        self.path = tempfile.mkdtemp(prefix='axeshome-mongo-')
+        self.process = subprocess.Popen([self.mongod, '--dbpath', self.path,
+            '--port', str(self.port), '--bind_ip', '127.0.0.1', '--quiet'],
+            stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while True:
+            if self.process.poll() is not None:
+                self.stop()
+                raise RuntimeError('mongod exited with status {}'.format(
+                    self.process.returncode))
+            try:
+                MongoClient('localhost', self.port).close()
+                return self
+            except ConnectionFailure:
+                if time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError('mongod did not start')
+                time.sleep(0.1)
+
+    def stop(self):
+        """Stop mongod and remove its data"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+    def settings(self):
+        """Returns the server settings needed to use this database"""
+        return {'MONGO_HOST': 'localhost', 'MONGO_PORT': self.port}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def use_mongomock():
+    """
+    Make Flask-PyMongo connect to an in-memory mongomock database. Must be
+    called before axeshome is imported. Needs the mongomock package.
+    """
+    import mongomock
+    import flask_pymongo
+
+    class MockClient(mongomock.MongoClient):
+        # Flask-PyMongo passes pymongo options that mongomock doesn't know
+        def __init__(self, host=None, port=None, **kwargs):
+            mongomock.MongoClient.__init__(self)
+
+    flask_pymongo.MongoClient = MockClient
+    flask_pymongo.MongoReplicaSetClient = MockClient
+    return {}
@@ -0,0 +1,228 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+HTTP load generator for the AXES home API
+
+Runs a number of concurrent clients, each making requests over a keep-alive
+connection for a fixed duration, and reports throughput and latency
+percentiles, overall and for each kind of request. If the server sends
+``Server-Timing`` headers, the time spent in each stage is reported too.
+Paths may contain ``{n}``, replaced by a request counter, to make every
+request distinct (e.g. to defeat the result cache)::
+
+  $ python -m benchmarks.loadtest --url http://localhost:5002 \\
+      --concurrency 200 --duration 30 '/search?q=query{n}'
+
+To compare worker types, run the fake LIMAS service with some latency and
+start the server with gunicorn.conf.py, once with AXESHOME_WORKER_CLASS=sync
+and once with the default gevent workers.
+"""
+import sys
+import time
+import argparse
+import httplib
+import itertools
+import threading
+
+from urlparse import urlparse
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of a sorted list of values.
+    """
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+def summarize(latencies, errors, elapsed):
+    """
+    Returns a dict of statistics for a list of request latencies (seconds).
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'elapsed': elapsed,
+        'rps': count / elapsed if elapsed else 0.0,
+        'mean': sum(latencies) / count if count else None,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else None,
+    }
+
+def request_name(path):
+    """
+    Returns the name used to group statistics for a request path: its first
+    path component, e.g. 'search' for /search?q=text.
+    """
+    path = path.split('?', 1)[0].strip('/')
+    return path.split('/', 1)[0] or '/'
+
+def parse_server_timing(value):
+    """
+    Parse a Server-Timing header value into a list of (name, seconds)
+    pairs. Metrics without a duration are ignored.
+    """
+    timings = []
+    for metric in value.split(','):
+        params = [param.strip() for param in metric.split(';')]
+        for param in params[1:]:
+            if param.startswith('dur='):
+                try:
+                    timings.append((params[0], float(param[4:]) / 1000.0))
+                except ValueError:
+                    pass
+    return timings
+
+def format_table(title, groups):
+    """
+    Format a dict of statistics from summarize as a table, one row per key.
+    """
+    def ms(value):
+        return '-' if value is None else '{:.1f}'.format(value * 1000)
+    lines = [title, '  {:<28} {:>7} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+        'name', 'count', 'errors', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms')]
+    for name in sorted(groups):
+        stats = groups[name]
+        lines.append('  {:<28} {:>7} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+            name[:28], stats['requests'], stats['errors'], ms(stats['mean']),
+            ms(stats['p50']), ms(stats['p95']), ms(stats['p99'])))
+    return '\n'.join(lines)
+
+def format_summary(stats, title=None):
+    """
+    Format statistics from summarize or LoadTest.run as text.
+    """
+    def ms(value):
+        return '-' if value is None else '{:.1f} ms'.format(value * 1000)
+    lines = []
+    if title:
+        lines.append(title)
+    lines.append('  requests: {} ({} errors) in {:.1f} s'.format(
+        stats['requests'], stats['errors'], stats['elapsed']))
+    lines.append('  throughput: {:.1f} requests/s'.format(stats['rps']))
+    lines.append('  latency: mean {}, p50 {}, p95 {}, p99 {}, max {}'.format(
+        ms(stats['mean']), ms(stats['p50']), ms(stats['p95']),
+        ms(stats['p99']), ms(stats['max'])))
+    if stats.get('requestTypes'):
+        lines.append(format_table('Requests', stats['requestTypes']))
+    if stats.get('stages'):
+        lines.append(format_table('Server stages', stats['stages']))
+    return '\n'.join(lines)
+
+class LoadTest(object):
+    """
+    Makes requests for the given paths from ``concurrency`` threads for
+    ``duration`` seconds. Paths are requested in order, starting again from
+    the first when they run out. A path may be given as a ``(name, path)``
+    pair to name the group it's reported in.
+    """
+
+    def __init__(self, url, paths, concurrency=10, duration=10.0,
+                 timeout=60.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.paths = paths
+        self.concurrency = concurrency
+        self.duration = duration
+        self.timeout = timeout
+        self.latencies = []
+        self.errors = 0
+        self.requests = {}
+        self.stages = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _next_request(self):
+        n = next(self._counter)
+        path = self.paths[n % len(self.paths)]
+        if isinstance(path, tuple):
+            name, path = path
+        else:
+            name = request_name(path)
+        return name, self.prefix + path.replace('{n}', str(n))
+
+    def _client(self, deadline):
+        conn = None
+        requests = []
+        while time.time() < deadline:
+            if conn is None:
+                conn = httplib.HTTPConnection(self.host, self.port,
+                    timeout=self.timeout)
+            name, path = self._next_request()
+            timings = []
+            start = time.time()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+                header = response.getheader('Server-Timing')
+                if header:
+                    timings = parse_server_timing(header)
+            except Exception:
+                conn.close()
+                conn = None
+                ok = False
+            requests.append((name, ok, time.time() - start, timings))
+        if conn is not None:
+            conn.close()
+        with self._lock:
+            for name, ok, latency, timings in requests:
+                group = self.requests.setdefault(name, 
+                    {'latencies': [], 'errors': 0})
+                if ok:
+                    self.latencies.append(latency)
+                    group['latencies'].append(latency)
+                else:
+                    self.errors += 1
+                    group['errors'] += 1
+                for stage, duration in timings:
+                    self.stages.setdefault(stage, []).append(duration)
+
+    def run(self):
+        """
+        Run the load test and return its statistics (see summarize).
+        """
+        start = time.time()
+        deadline = start + self.duration
+        threads = [threading.Thread(target=self._client, args=(deadline,))
+            for i in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        stats = summarize(self.latencies, self.errors, elapsed)
+        stats['requestTypes'] = dict((name, summarize(group['latencies'],
+            group['errors'], elapsed)) 
+            for name, group in self.requests.items())
+        stats['stages'] = dict((name, summarize(durations, 0, elapsed))
+            for name, durations in self.stages.items())
+        return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AXES home load test')
+    parser.add_argument('paths', nargs='+', help='request paths')
+    parser.add_argument('--url', default='http://localhost:5002',
+        help='base URL of the API')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args(argv)
+    test = LoadTest(args.url, args.paths, args.concurrency, args.duration)
+    stats = test.run()
+    print(format_summary(stats, '{} clients for {:.0f} s'.format(
+        args.concurrency, args.duration)))
+    return 1 if stats['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
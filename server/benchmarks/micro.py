@@ -0,0 +1,116 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Micro-benchmarks for the search result path
+
+Times each stage of turning a LIMAS search result into a response body:
+postprocessing, collect_results, normalization, JSON encoding with each
+available encoder, and compression. Search results are generated by the fake
+LIMAS service, so their size can be varied::
+
+  $ python -m benchmarks.micro --hits 200 --words 50 --repeat 100
+
+The server is imported with a mongomock database, so the mongomock package
+is needed, but no database is used.
+"""
+import sys
+import copy
+import time
+import argparse
+
+from benchmarks import fakelimas
+from benchmarks.fixtures import use_mongomock
+from benchmarks.loadtest import summarize, format_table
+
+# Rewrites the video source URLs of fake LIMAS results
+POSTPROCESSING_RULES = {
+    'sources.url': [
+        (r'^http://limas.example.com(.*)$', r'/collections\1'),
+    ],
+}
+
+def is_installed(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+def time_calls(func, inputs):
+    """
+    Call func on each input, returning a list of the times taken (seconds).
+    """
+    times = []
+    for value in inputs:
+        start = time.time()
+        func(value)
+        times.append(time.time() - start)
+    return times
+
+def run(hits=50, words=20, repeat=50):
+    """
+    Run the benchmarks, returning a dict of statistics (see summarize) keyed
+    by stage name and a dict of response sizes in bytes.
+    """
+    use_mongomock()
+    from axeshome.api import app
+    from axeshome import backend, compress, representations
+    from axeshome.postprocess import RegexPostprocessor
+    from axeshome.resources import normalize_results
+
+    search_results = fakelimas.search_result(1, hits, words=words)
+    def copies():
+        return [copy.deepcopy(search_results) for k in range(repeat)]
+
+    times = {}
+    sizes = {}
+    with app.test_request_context():
+        postprocessor = RegexPostprocessor(POSTPROCESSING_RULES)
+        times['postprocess'] = time_calls(postprocessor.process, copies())
+        times['collect_results'] = time_calls(backend.collect_results,
+            copies())
+
+        results = backend.collect_results(copy.deepcopy(search_results))
+        times['normalize_results'] = time_calls(normalize_results,
+            [results] * repeat)
+
+        for name in ('json', 'simplejson', 'ujson'):
+            if is_installed(name):
+                dumps = representations.load_encoder(name)
+                times['dumps ({})'.format(name)] = time_calls(dumps,
+                    [results] * repeat)
+        body = representations.dumps(results)
+        sizes['json'] = len(body)
+
+        level = app.config['COMPRESS_LEVEL']
+        times['gzip'] = time_calls(
+            lambda data: compress.gzip_compress(data, level), [body] * repeat)
+        sizes['gzip'] = len(compress.gzip_compress(body, level))
+        if compress.brotli is not None:
+            quality = app.config['COMPRESS_BROTLI_QUALITY']
+            times['brotli'] = time_calls(
+                lambda data: compress.brotli_compress(data, quality),
+                [body] * repeat)
+            sizes['brotli'] = len(compress.brotli_compress(body, quality))
+
+    stats = dict((name, summarize(values, 0, sum(values)))
+        for name, values in times.items())
+    return stats, sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AXES home micro-benchmarks')
+    parser.add_argument('--hits', type=int, default=50,
+        help='number of hits in the search result')
+    parser.add_argument('--words', type=int, default=20,
+        help='number of words in text fields')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+    stats, sizes = run(args.hits, args.words, args.repeat)
+    print(format_table('Search result with {} hits'.format(args.hits), stats))
+    print('Response size: ' + ', '.join('{} {} bytes'.format(name, size)
+        for name, size in sorted(sizes.items())))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,339 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Replay realistic traffic against the AXES home API
+
+Requests are generated from a traffic scenario:
+
+* ``userlog`` replays the actions in the user log (the ``userlog``
+  collection) in the order they happened.
+* ``querylog`` makes simple searches for logged queries (the ``queries``
+  collection), chosen in proportion to how often each was searched for.
+* ``mixed`` (the default) makes the requests of a typical session, in the
+  proportions given by DEFAULT_MIX, searching for logged queries if there
+  are any.
+
+Logs are read from a MongoDB database (--source mongodb://host/axeshome) or
+from files exported with mongoexport (--userlog, --querylog). Actions that
+need a logged in user or that change data are skipped.
+
+Without --url, the server is run in this process, with a fake LIMAS service
+and a throwaway database (mongomock or, with --mongo mongod, a temporary
+mongod), so that runs are reproducible::
+
+  $ python -m benchmarks.scenario --scenario userlog --userlog userlog.json \\
+      --latency 0.1 --concurrency 20 --duration 30
+
+With --url, requests are made to a running server. Results are reported for
+all requests, each kind of request and, if the server sends Server-Timing
+headers, each stage of request handling. Use --json to save them.
+"""
+import os
+import ast
+import sys
+import json
+import random
+import logging
+import urllib
+import argparse
+import tempfile
+import threading
+
+from benchmarks import fakelimas
+from benchmarks.fixtures import EphemeralMongo, use_mongomock, free_port
+from benchmarks.loadtest import LoadTest, format_summary
+
+# Proportions of actions in the mixed scenario
+DEFAULT_MIX = [
+    ('simple-search', 40),
+    ('fetch-asset-bundle', 20),
+    ('fetch-asset', 8),
+    ('fetch-home-topics', 8),
+    ('fetch-interesting-items', 5),
+    ('fetch-interesting-topics', 5),
+    ('fetch-news-sources', 4),
+    ('find-popular-queries', 5),
+    ('find-popular-videos', 5),
+]
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def query_string(**params):
+    params = [(key, encode(value)) for key, value in sorted(params.items())
+        if value is not None]
+    return '?' + urllib.urlencode(params) if params else ''
+
+def axes_uri(uri):
+    return 'axes:' + urllib.quote(encode(uri), safe='/')
+
+def advanced_search_path(info):
+    info = info or {}
+    params = [('text', encode(info.get('text') or ''))]
+    for clause in info.get('clauses') or []:
+        params.append(('clauses', '{}:{}'.format(
+            encode(clause['type']).lstrip('#'), encode(clause['text']))))
+    return '/advanced-search?' + urllib.urlencode(params)
+
+def topics_path(info):
+    limit, type = info if info else (10, None)
+    return '/interesting-topics' + query_string(limit=limit, type=type)
+
+# Functions returning the request path for each logged action, given the
+# logged info
+ACTION_PATHS = {
+    'simple-search': lambda q: '/search' + query_string(q=q),
+    'image-search': lambda q: '/image-search' + query_string(q=q),
+    'advanced-search': advanced_search_path,
+    'fetch-asset': lambda uri: '/assets/' + axes_uri(uri),
+    'fetch-asset-bundle': lambda uri: '/asset-bundle/' + axes_uri(uri),
+    'fetch-news-sources': lambda info: '/news-sources',
+    'news-item-search': lambda uri: '/news-item-search/' + axes_uri(uri),
+    'news-source-search': lambda uri: '/news-source-search/' + axes_uri(uri),
+    'fetch-interesting-items': lambda info: '/interesting-items',
+    'fetch-interesting-topics': topics_path,
+    'fetch-home-topics': lambda limit: '/home-topics' + query_string(
+        limit=limit),
+    'find-popular-queries': lambda info: '/popular-queries',
+    'find-popular-videos': lambda info: '/popular-videos',
+}
+
+def action_requests(actions):
+    """
+    Returns a list of (action, path) requests for logged user actions, and
+    the number of actions skipped.
+    """
+    requests = []
+    skipped = 0
+    for action in actions:
+        path_for = ACTION_PATHS.get(action.get('action'))
+        if path_for is None:
+            skipped += 1
+            continue
+        try:
+            requests.append((action['action'], path_for(action.get('info'))))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            skipped += 1
+    return requests, skipped
+
+def weighted_choices(rnd, items, count):
+    """
+    Returns count items chosen at random from a list of (item, weight) pairs.
+    """
+    total = sum(weight for item, weight in items)
+    choices = []
+    for k in range(count):
+        x = rnd.uniform(0, total)
+        for item, weight in items:
+            x -= weight
+            if x <= 0:
+                break
+        choices.append(item)
+    return choices
+
+def query_requests(queries, count, seed=0):
+    """
+    Returns count search requests for logged queries, given as a list of
+    query log entries, chosen in proportion to their hits.
+    """
+    rnd = random.Random(seed)
+    items = [(query['text'], query.get('hits', 1)) for query in queries]
+    return [('simple-search', '/search' + query_string(q=text))
+        for text in weighted_choices(rnd, items, count)]
+
+def mixed_actions(count, queries=None, videos=1000, seed=0):
+    """
+    Returns count user actions in the proportions of DEFAULT_MIX. Searches
+    are for the given query log entries or, if there are none, for one of
+    a few hundred generated queries, some more popular than others. Assets
+    are fake LIMAS videos and segments.
+    """
+    rnd = random.Random(seed)
+    if queries:
+        texts = [(query['text'], query.get('hits', 1)) for query in queries]
+    else:
+        texts = [('query {}'.format(k), 1.0 / (k + 1)) for k in range(500)]
+    actions = []
+    for action in weighted_choices(rnd, DEFAULT_MIX, count):
+        info = None
+        if action == 'simple-search':
+            info = weighted_choices(rnd, texts, 1)[0]
+        elif action in ('fetch-asset', 'fetch-asset-bundle'):
+            i = rnd.randrange(videos)
+            if rnd.random() < 0.5:
+                info = fakelimas.video_uri(i)
+            else:
+                info = fakelimas.segment(i, rnd.randrange(180))['uri']
+        elif action == 'fetch-home-topics':
+            info = 10
+        elif action == 'fetch-interesting-topics':
+            info = (10, None)
+        actions.append({'action': action, 'info': info})
+    return actions
+
+def read_export(path):
+    """Read documents exported with mongoexport (one per line)"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def read_source(uri, userlog_limit, querylog_limit):
+    """
+    Returns the most recent logged actions, oldest first, and the most
+    popular logged queries from the database at the given MongoDB URI.
+    """
+    from pymongo import MongoClient
+    client = MongoClient(uri)
+    try:
+        db = client.get_default_database()
+        actions = list(db.userlog.find(sort=[('timestamp', -1)],
+            limit=userlog_limit))
+        actions.reverse()
+        queries = list(db.queries.find(sort=[('hits', -1)],
+            limit=querylog_limit))
+    finally:
+        client.close()
+    return actions, queries
+
+def make_requests(args):
+    """
+    Returns the list of (name, path) requests for the scenario options.
+    """
+    actions, queries = [], []
+    if args.source:
+        actions, queries = read_source(args.source, args.count, args.count)
+    if args.userlog:
+        actions = read_export(args.userlog)[-args.count:]
+    if args.querylog:
+        queries = read_export(args.querylog)
+    if args.scenario == 'userlog':
+        if not actions:
+            raise SystemExit('No user log: use --source or --userlog')
+        requests, skipped = action_requests(actions)
+        if skipped:
+            print('Skipped {} of {} logged actions'.format(skipped,
+                len(actions)))
+    elif args.scenario == 'querylog':
+        if not queries:
+            raise SystemExit('No query log: use --source or --querylog')
+        requests = query_requests(queries, args.count, args.seed)
+    else:
+        actions = mixed_actions(args.count, queries, seed=args.seed)
+        requests, skipped = action_requests(actions)
+    if not requests:
+        raise SystemExit('No requests to make')
+    return requests
+
+def setting_type(text):
+    name, value = text.split('=', 1)
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return name, value
+
+def write_settings(settings):
+    """
+    Write server settings to a temporary file and return its name.
+    """
+    fd, path = tempfile.mkstemp(prefix='axeshome-bench-', suffix='.cfg')
+    with os.fdopen(fd, 'w') as f:
+        for name, value in sorted(settings.items()):
+            f.write('{} = {!r}\n'.format(name, value))
+    return path
+
+def start_server(settings):
+    """
+    Start the API server in a background thread with the given settings.
+    Returns its base URL.
+    """
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    os.environ['AXESHOME_SETTINGS'] = write_settings(settings)
+    from axeshome.api import app
+    port = free_port()
+    server = make_server('localhost', port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://localhost:{}'.format(port)
+
+def run(args, requests):
+    """
+    Run the load test for the scenario, starting the server first if no URL
+    was given. Returns the statistics.
+    """
+    mongo = None
+    try:
+        url = args.url
+        if url is None:
+            limas = fakelimas.start(free_port(), latency=args.latency,
+                jitter=args.jitter, limas=fakelimas.FakeLimas(args.hits,
+                args.segments, args.words))
+            settings = {
+                'DEBUG': False,
+                'SERVICE_URL': 'http://localhost:{}/json-rpc'.format(
+                    limas.server_address[1]),
+            }
+            if args.mongo == 'mongod':
+                mongo = EphemeralMongo().start()
+                settings.update(mongo.settings())
+            else:
+                settings.update(use_mongomock())
+            settings.update(args.setting)
+            url = start_server(settings)
+        if args.warmup:
+            LoadTest(url, requests, args.concurrency, args.warmup).run()
+        return LoadTest(url, requests, args.concurrency, args.duration).run()
+    finally:
+        if mongo is not None:
+            mongo.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AXES home traffic replay')
+    parser.add_argument('--scenario', default='mixed',
+        choices=['mixed', 'userlog', 'querylog'])
+    parser.add_argument('--source', help='MongoDB URI of a database to read'
+        ' the user and query logs from')
+    parser.add_argument('--userlog', help='user log exported with mongoexport')
+    parser.add_argument('--querylog', help='query log exported with '
+        'mongoexport')
+    parser.add_argument('--count', type=int, default=10000,
+        help='number of requests to generate or logged actions to replay')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='base URL of a running server')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=0.0,
+        help='seconds to run before measuring')
+    parser.add_argument('--json', help='file to write the statistics to')
+    group = parser.add_argument_group('local server')
+    group.add_argument('--mongo', default='mongomock',
+        choices=['mongomock', 'mongod'])
+    group.add_argument('--setting', type=setting_type, action='append',
+        default=[], metavar='NAME=VALUE', help='server setting, e.g. '
+        'RESULT_CACHE_ENABLED=False')
+    group.add_argument('--latency', type=float, default=0.05,
+        help='fake LIMAS latency (seconds)')
+    group.add_argument('--jitter', type=float, default=0.0)
+    group.add_argument('--hits', type=int, default=50)
+    group.add_argument('--segments', type=int, default=30)
+    group.add_argument('--words', type=int, default=20)
+    args = parser.parse_args(argv)
+    requests = make_requests(args)
+    stats = run(args, requests)
+    print(format_summary(stats, '{} scenario, {} clients for {:.0f} s'.format(
+        args.scenario, args.concurrency, args.duration)))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+    return 1 if stats['errors'] else 0
+
+if __name__ == '__main__':
+    status = main()
+    # Skip the interpreter's clean up: threads of the local servers may still
+    # be serving keep-alive connections
+    sys.stdout.flush()
+    os._exit(status)
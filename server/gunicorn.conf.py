@@ -0,0 +1,41 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Gunicorn configuration for the AXES home API::
+
+  $ cd server
+  $ gunicorn -c gunicorn.conf.py axeshome:app
+
+By default this runs gevent workers, each of which serves many requests
+concurrently while they wait on LIMAS and MongoDB. Settings can be 
+overridden with environment variables, e.g. AXESHOME_WORKER_CLASS=sync to 
+use synchronous workers.
+"""
+import os
+import multiprocessing
+
+bind = os.environ.get('AXESHOME_BIND', ':5002')
+
+# 'gevent' (needs the gevent package) or 'sync'
+worker_class = os.environ.get('AXESHOME_WORKER_CLASS', 'gevent')
+
+# Requests are I/O bound, so a few gevent workers are enough. Sync workers
+# serve one request at a time, so run more of them.
+if worker_class == 'sync':
+    default_workers = multiprocessing.cpu_count() * 2 + 1
+else:
+    default_workers = multiprocessing.cpu_count()
+workers = int(os.environ.get('AXESHOME_WORKERS', default_workers))
+
+# Maximum concurrent requests per gevent worker. Keep GEVENT_LIMAS_POOL_SIZE
+# and GEVENT_FANOUT_POOL_SIZE in the application settings in proportion, or
+# requests queue for connections.
+worker_connections = int(os.environ.get('AXESHOME_WORKER_CONNECTIONS', 500))
+
+timeout = int(os.environ.get('AXESHOME_TIMEOUT', 60))
+keepalive = 5
+
+# The application must be imported in each worker, after gevent has patched
+# the standard library
+preload_app = False
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Maintenance commands for the AXES home database.
+
+Usage::
+
+  $ python manage.py ensure-indexes
+  $ python manage.py index-usage
+  $ python manage.py compact-history
+"""
+import argparse
+
+from axeshome.api import app, mongo
+
+def create_indexes(args):
+    from axeshome.indexes import ensure_indexes
+    created = ensure_indexes(mongo.db, app.config)
+    for collection, names in sorted(created.iteritems()):
+        for name in names:
+            print('{}.{}'.format(collection, name))
+
+def show_index_usage(args):
+    from axeshome.indexes import get_index_usage
+    print('{:<40} {:>12} {:>12}'.format('index', 'size', 'ops'))
+    for index in get_index_usage(mongo.db, app.config):
+        name = '{}.{}'.format(index['collection'], index['name'])
+        ops = '-' if index['ops'] is None else index['ops']
+        print('{:<40} {:>12} {:>12}'.format(name, index['size'], ops))
+
+def compact_history(args):
+    import axeshome.user as user
+    for name, counts in sorted(user.compact_asset_collections().iteritems()):
+        print('{}: {} summarized, {} duplicates removed, {} trimmed'.format(
+            name, counts['summarized'], counts['duplicates'], 
+            counts['trimmed']))
+
+commands = {
+    'ensure-indexes': create_indexes,
+    'index-usage': show_index_usage,
+    'compact-history': compact_history,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('command', choices=sorted(commands))
+    args = parser.parse_args()
+    with app.app_context():
+        commands[args.command](args)
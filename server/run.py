@@ -2,14 +2,24 @@
 #
 # (c) Copyright 2015 Kevin McGuinness. All Rights Reserved. 
 #
-import sys
+"""
+Run the development server::
 
-from axeshome import start_server
+  $ python run.py [port] [--gevent]
+"""
+import sys
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        port = int(sys.argv[1])
+    args = sys.argv[1:]
+    use_gevent = '--gevent' in args
+    if use_gevent:
+        # Patch before anything imports socket or threading
+        from gevent import monkey
+        monkey.patch_all()
+        args.remove('--gevent')
+    if args:
+        port = int(args[0])
     else:
         port = 5002
-    start_server(True, port=port)
-    
\ No newline at end of file
+    from axeshome import start_server
+    start_server(True, port=port, use_gevent=use_gevent)
@@ -0,0 +1,43 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+"""
+Unit tests. Importing axeshome connects to MongoDB, so the tests use an
+in-memory mongomock database instead. Run them from the server directory
+with::
+
+  $ pip install mongomock
+  $ python -m unittest discover
+"""
+from benchmarks.fixtures import use_mongomock
+
+use_mongomock()
+
+class FakeClock(object):
+    """
+    Stands in for the time module of a module under test, so tests can
+    move time forward.
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+def patch_time(test, module):
+    """
+    Replace the time module of a module with a FakeClock for the duration of
+    a test. Returns the clock.
+    """
+    clock = FakeClock()
+    saved = module.time
+    module.time = clock
+    test.addCleanup(setattr, module, 'time', saved)
+    return clock
@@ -0,0 +1,105 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import json
+import threading
+import unittest
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from axeshome import backend
+from axeshome.api import app
+from axeshome.circuit import CircuitBreaker
+
+class FailingHandler(BaseHTTPRequestHandler):
+    """
+    Answers JSON-RPC calls with the server's status and body, and keeps 
+    the calls it was sent.
+    """
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        self.server.calls.append(json.loads(self.rfile.read(length)))
+        body = self.server.body
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class WithLimasTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('localhost', 0), FailingHandler)
+        self.server.status = 503
+        self.server.body = 'Service Unavailable'
+        self.server.calls = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        config = dict(app.config)
+        self.addCleanup(app.config.update, config)
+        app.config['SERVICE_URL'] = 'http://localhost:{}/json-rpc'.format(
+            self.server.server_port)
+        app.config['LIMAS_BREAKER_FAILURES'] = 3
+        self.reset_backend()
+        self.addCleanup(self.reset_backend)
+
+    def reset_backend(self):
+        backend._pool = None
+        backend._breaker = None
+
+    def call(self):
+        return backend.get_available_services()
+
+    def test_http_errors_are_failures(self):
+        for k in range(3):
+            self.assertRaises(backend.LimasError, self.call)
+        breaker = backend.get_circuit_breaker()
+        self.assertEqual(breaker.get_stats()['failures'], 3)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(backend.LimasUnavailable, self.call)
+
+    def test_invalid_responses_are_failures(self):
+        self.server.status = 200
+        self.server.body = '<html>Bad gateway</html>'
+        self.assertRaises(backend.LimasError, self.call)
+        stats = backend.get_circuit_breaker().get_stats()
+        self.assertEqual(stats['failures'], 1)
+
+    def test_faults_are_not_failures(self):
+        self.server.status = 200
+        self.server.body = json.dumps({'jsonrpc': '2.0', 'id': 1,
+            'error': {'code': -32601, 'message': 'Method not found'}})
+        self.assertRaises(backend.LimasError, self.call)
+        breaker = backend.get_circuit_breaker()
+        self.assertEqual(breaker.get_stats()['failures'], 0)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_queries_are_sent_as_typed(self):
+        app.config['RESULT_CACHE_ENABLED'] = False
+        self.server.status = 200
+        self.server.body = json.dumps({'jsonrpc': '2.0', 'id': 1,
+            'error': {'code': -32000, 'message': 'No results'}})
+        clauses = [{'type': 'speech', 'text': 'Obama'}]
+        self.assertRaises(backend.LimasError, backend.advanced_search,
+            'Barack  Obama', clauses)
+        self.assertRaises(backend.LimasError, backend.simple_search,
+            'Barack  Obama')
+        advanced, simple = [call['params'][0] for call in self.server.calls
+            if call['method'] in ('searchWithParsedQuery', 'search')]
+        self.assertEqual(advanced, {'queryText': 'Barack  Obama', 
+            'clauses': clauses})
+        self.assertEqual(simple['queryString'], 'Barack  Obama')
+
+if __name__ == '__main__':
+    unittest.main()
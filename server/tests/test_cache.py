@@ -0,0 +1,72 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from axeshome import cache
+from axeshome.cache import LRUCache, ProcessCache, MISSING
+from tests import patch_time
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = patch_time(self, cache)
+
+    def test_get_and_set(self):
+        lru = LRUCache(maxsize=2)
+        self.assertIs(lru.get('a'), MISSING)
+        self.assertEqual(lru.get('a', None), None)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('a', 2)
+        self.assertEqual(lru.get('a'), 2)
+        self.assertEqual(len(lru), 1)
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(maxsize=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(len(lru), 2)
+        self.assertIs(lru.get('b'), MISSING)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+
+    def test_entries_expire(self):
+        lru = LRUCache(ttl=10)
+        lru.set('a', 1)
+        lru.set('b', 2, ttl=30)
+        self.clock.advance(20)
+        self.assertIs(lru.get('a'), MISSING)
+        self.assertEqual(lru.get('b'), 2)
+        self.assertEqual(len(lru), 1)
+
+    def test_no_ttl_never_expires(self):
+        lru = LRUCache()
+        lru.set('a', 1)
+        self.clock.advance(1e9)
+        self.assertEqual(lru.get('a'), 1)
+
+    def test_delete_and_clear(self):
+        lru = LRUCache()
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.delete('a')
+        lru.delete('missing')
+        self.assertIs(lru.get('a'), MISSING)
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+class ProcessCacheTest(unittest.TestCase):
+
+    def test_get_set_and_invalidate(self):
+        process_cache = ProcessCache(10, 60)
+        self.assertIsNone(process_cache.get('a'))
+        process_cache.set('a', 1)
+        self.assertEqual(process_cache.get('a'), 1)
+        process_cache.invalidate('a')
+        self.assertIsNone(process_cache.get('a'))
+
+if __name__ == '__main__':
+    unittest.main()
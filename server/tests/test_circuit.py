@@ -0,0 +1,79 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from axeshome import circuit
+from axeshome.circuit import CircuitBreaker, CircuitOpen
+from tests import patch_time
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = patch_time(self, circuit)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30,
+            slow_call_time=2.0)
+
+    def fail(self, times=1):
+        for k in range(times):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpen, self.breaker.before_call)
+        self.assertEqual(self.breaker.get_stats()['rejected'], 1)
+
+    def test_success_resets_failures(self):
+        self.fail(2)
+        self.breaker.before_call()
+        self.breaker.record_success(0.1)
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_calls_count_as_failures(self):
+        for k in range(3):
+            self.breaker.before_call()
+            self.breaker.record_success(5.0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_allows_one_trial(self):
+        self.fail(3)
+        self.clock.advance(31)
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertRaises(CircuitOpen, self.breaker.before_call)
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_failed_trial_reopens(self):
+        self.fail(3)
+        self.clock.advance(31)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.advance(10)
+        self.assertRaises(CircuitOpen, self.breaker.before_call)
+
+    def test_cancelled_trial_allows_another(self):
+        self.fail(3)
+        self.clock.advance(31)
+        self.breaker.before_call()
+        self.breaker.cancel_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.before_call()
+
+    def test_cancelled_calls_are_not_failures(self):
+        for k in range(5):
+            self.breaker.before_call()
+            self.breaker.cancel_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        stats = self.breaker.get_stats()
+        self.assertEqual(stats['failures'], 0)
+        self.assertEqual(stats['calls'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
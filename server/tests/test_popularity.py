@@ -0,0 +1,86 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from datetime import datetime
+
+from axeshome import popularity
+from axeshome.api import app, mongo
+
+HALF_LIFE = 3600.0
+EPOCH = HALF_LIFE * popularity.EPOCH_HALF_LIVES
+
+class PopularityTest(unittest.TestCase):
+
+    def setUp(self):
+        context = app.test_request_context()
+        context.push()
+        self.addCleanup(context.pop)
+        self.config = dict(app.config)
+        self.addCleanup(app.config.update, self.config)
+        app.config['POPULARITY_HALF_LIFE'] = HALF_LIFE
+        mongo.db.popularity.remove()
+        mongo.db.queries.remove()
+
+    def get_updates(self, now, amount=1):
+        updates = popularity.get_counter_updates('queries', 'q', amount, now)
+        return dict(((query['period'], query['start']), update)
+            for query, update in updates)
+
+    def test_epochs_and_landmarks(self):
+        self.assertEqual(popularity.get_epoch(0, HALF_LIFE), 0)
+        self.assertEqual(popularity.get_epoch(EPOCH - 1, HALF_LIFE), 0)
+        self.assertEqual(popularity.get_epoch(EPOCH, HALF_LIFE), 1)
+        self.assertEqual(popularity.get_landmark(2, HALF_LIFE), EPOCH)
+
+    def test_counts_in_hour_and_day_buckets(self):
+        now = 3 * 86400 + 5 * 3600 + 125
+        updates = self.get_updates(now, 2)
+        hour = datetime.utcfromtimestamp(3 * 86400 + 5 * 3600)
+        day = datetime.utcfromtimestamp(3 * 86400)
+        self.assertEqual(updates[('hour', hour)]['$inc'], {'count': 2})
+        self.assertEqual(updates[('day', day)]['$inc'], {'count': 2})
+        self.assertEqual(updates[('hour', hour)]['$setOnInsert'],
+            {'expires': datetime.utcfromtimestamp(3 * 86400 + 6 * 3600 +
+                popularity.DAY)})
+
+    def test_scores_grow_with_time_since_landmark(self):
+        now = 10 * EPOCH + 3 * HALF_LIFE
+        updates = self.get_updates(now)
+        current = datetime.utcfromtimestamp(9 * EPOCH)
+        following = datetime.utcfromtimestamp(10 * EPOCH)
+        self.assertEqual(updates[('trend', current)]['$inc']['count'],
+            2 ** (popularity.EPOCH_HALF_LIVES + 3))
+        self.assertEqual(updates[('trend', following)]['$inc']['count'],
+            2 ** 3)
+
+    def test_trending_scores_decay(self):
+        now = 10 * EPOCH + 3 * HALF_LIFE
+        popularity.write_counts({('queries', 'old'): {'count': 4}},
+            now - 2 * HALF_LIFE)
+        popularity.write_counts({('queries', 'new'): {'count': 2}}, now)
+        top = popularity.find_top('queries', 'trending', 10, now)
+        self.assertEqual([key for key, score in top], ['new', 'old'])
+        self.assertAlmostEqual(top[0][1], 2)
+        self.assertAlmostEqual(top[1][1], 1)
+        later = popularity.find_top('queries', 'trending', 10,
+            now + HALF_LIFE)
+        self.assertAlmostEqual(later[0][1], 1)
+
+    def test_trending_scores_carry_over_epochs(self):
+        now = 10 * EPOCH - HALF_LIFE
+        popularity.write_counts({('queries', 'q'): {'count': 1}}, now)
+        top = popularity.find_top('queries', 'trending', 10, now + HALF_LIFE)
+        self.assertEqual(len(top), 1)
+        self.assertAlmostEqual(top[0][1], 0.5)
+
+    def test_query_items_have_hits_and_score(self):
+        mongo.db.queries.insert({'text': 'q', 'hits': 7})
+        items = popularity.build_items('queries', [('q', 2.5), ('r', 1)],
+            [], 0)
+        self.assertEqual(items, [{'text': 'q', 'hits': 7, 'score': 2.5},
+            {'text': 'r', 'hits': 0, 'score': 1}])
+
+if __name__ == '__main__':
+    unittest.main()
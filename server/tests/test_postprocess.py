@@ -0,0 +1,66 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from axeshome.postprocess import RegexPostprocessor
+from axeshome.serialize import Marshalled
+
+RULES = {
+    'videoSources.url': [(r'^http://limas(.*)$', r'/collections\1')],
+    'imageUrl': [(r'^http://limas(.*)$', r'/keyframes\1')],
+}
+
+class RegexPostprocessorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.postprocessor = RegexPostprocessor(RULES)
+
+    def test_rewrites_fields_with_path_suffix(self):
+        asset = {'videoSources': [{'url': 'http://limas/v1.mp4'}]}
+        self.postprocessor.process(asset, 'asset')
+        self.assertEqual(asset['videoSources'][0]['url'],
+            '/collections/v1.mp4')
+
+    def test_single_name_rule_applies_at_any_depth(self):
+        results = {
+            'imageUrl': 'http://limas/0.jpg',
+            'videos': {'/v1': {'keyframe': {'imageUrl': 'http://limas/1.jpg'}}},
+            'segments': [{'keyframes': [{'imageUrl': 'http://limas/2.jpg'}]}],
+        }
+        self.postprocessor.process(results)
+        self.assertEqual(results['imageUrl'], '/keyframes/0.jpg')
+        self.assertEqual(results['videos']['/v1']['keyframe']['imageUrl'],
+            '/keyframes/1.jpg')
+        self.assertEqual(results['segments'][0]['keyframes'][0]['imageUrl'],
+            '/keyframes/2.jpg')
+
+    def test_path_rules_match_under_any_prefix(self):
+        results = [{'asset': {'videoSources': {'url': 'http://limas/a'}}}]
+        self.postprocessor.process(results)
+        self.assertEqual(results[0]['asset']['videoSources']['url'],
+            '/collections/a')
+
+    def test_list_items_take_list_name(self):
+        asset = {'imageUrl': ['http://limas/a', 'http://b']}
+        self.postprocessor.process(asset)
+        self.assertEqual(asset['imageUrl'], ['/keyframes/a', 'http://b'])
+
+    def test_ignores_fields_off_path(self):
+        asset = {'url': 'http://limas/a',
+            'sources': {'url': 'http://limas/b'}}
+        self.postprocessor.process(asset, 'asset')
+        self.assertEqual(asset['url'], 'http://limas/a')
+        self.assertEqual(asset['sources']['url'], 'http://limas/b')
+
+    def test_skips_marshalled_values(self):
+        asset = {'keyframe': Marshalled(imageUrl='http://limas/a')}
+        self.postprocessor.process(asset, 'asset')
+        self.assertEqual(asset['keyframe']['imageUrl'], 'http://limas/a')
+
+    def test_no_rules(self):
+        value = {'url': 'http://limas/a'}
+        self.assertIs(RegexPostprocessor({}).process(value), value)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from axeshome import popularity, querylog, suggest
+from axeshome.api import app, mongo
+
+CLAUSES = [{'type': 'speech', 'text': 'Obama'}]
+
+class QueryLogTest(unittest.TestCase):
+
+    def setUp(self):
+        context = app.test_request_context()
+        context.push()
+        self.addCleanup(context.pop)
+        self.config = dict(app.config)
+        self.addCleanup(app.config.update, self.config)
+        app.config['POPULARITY_FLUSH_INTERVAL'] = 0
+        app.config['SUGGEST_ENABLED'] = False
+        mongo.db.popularity.remove()
+        mongo.db.queries.remove()
+        querylog.insert('Obama')
+        querylog.insert('obama ', CLAUSES)
+        querylog.insert('obama', [])
+
+    def test_queries_are_logged_in_canonical_form(self):
+        hits = dict((doc['text'], doc['hits'])
+            for doc in mongo.db.queries.find())
+        self.assertEqual(hits, {'obama': 2, 'obama #speech(obama)': 1})
+
+    def test_advanced_queries_are_not_popular(self):
+        keys = set(doc['key'] for doc in mongo.db.popularity.find())
+        self.assertEqual(keys, set(['obama']))
+        self.assertEqual(popularity.find_all_time('queries', 10), 
+            [('obama', 2)])
+        self.assertEqual([doc['text'] for doc in querylog.find_popular()],
+            ['obama'])
+
+    def test_advanced_queries_are_not_suggested(self):
+        suggester = suggest.QuerySuggester(60, 10)
+        suggester.sync()
+        self.assertEqual(suggester.index.search('ob', 10), [('obama', 2)])
+        querylog.insert('obama', CLAUSES)
+        suggester.sync()
+        self.assertEqual(suggester.index.search('ob', 10), [('obama', 2)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from axeshome import user
+from axeshome.api import app, mongo
+
+ADMIN_PATHS = ['/metrics', '/service-pool-stats', '/service-userlog-stats',
+    '/profiles']
+
+class AdminEndpointTest(unittest.TestCase):
+
+    def setUp(self):
+        config = dict(app.config)
+        self.addCleanup(app.config.update, config)
+        app.config['ADMIN_ENDPOINTS_ENABLED'] = True
+        app.config['ADMIN_USERS'] = ['admin']
+        app.config['USER_CACHE_SIZE'] = 0
+        with app.app_context():
+            mongo.db.users.remove()
+            user.register('admin', 'secret-admin')
+            user.register('someone', 'secret-someone')
+        self.client = app.test_client()
+
+    def login(self, username):
+        response = self.client.post('/user/login', data={
+            'username': username, 'password': 'secret-' + username})
+        self.assertEqual(response.status_code, 200)
+
+    def get_statuses(self):
+        return [self.client.get(path).status_code for path in ADMIN_PATHS]
+
+    def test_disabled(self):
+        app.config['ADMIN_ENDPOINTS_ENABLED'] = False
+        self.login('admin')
+        self.assertEqual(self.get_statuses(), [404] * len(ADMIN_PATHS))
+
+    def test_anonymous_users_are_refused(self):
+        self.assertEqual(self.get_statuses(), [401] * len(ADMIN_PATHS))
+
+    def test_ordinary_users_are_refused(self):
+        self.login('someone')
+        self.assertEqual(self.get_statuses(), [403] * len(ADMIN_PATHS))
+
+    def test_admin_users_are_allowed(self):
+        self.login('admin')
+        self.assertEqual(self.get_statuses(), [200] * len(ADMIN_PATHS))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import threading
+import unittest
+
+from axeshome.singleflight import SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow_call(self, value, error=None):
+        self.calls.append(value)
+        self.entered.set()
+        self.release.wait(5)
+        if error is not None:
+            raise error
+        return value
+
+    def run_followers(self, count, key='key', *args):
+        """
+        Start count threads calling do while a leader's call is in flight.
+        Returns the threads and a list their results are appended to.
+        """
+        results = []
+        def follow():
+            try:
+                results.append(self.flight.do(key, self.slow_call, *args))
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=follow) for k in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def wait_for_followers(self, count):
+        for k in range(500):
+            if self.flight.get_stats()['shared'] >= count:
+                return
+            threading.Event().wait(0.01)
+        self.fail('followers did not join the call')
+
+    def test_calls_without_concurrency(self):
+        self.release.set()
+        self.assertEqual(self.flight.do('a', self.slow_call, 1), 1)
+        self.assertEqual(self.flight.do('a', self.slow_call, 2), 2)
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(self.flight.get_stats(),
+            {'calls': 2, 'shared': 0, 'inFlight': 0})
+
+    def test_concurrent_callers_share_result(self):
+        threads, results = self.run_followers(1, 'key', 'value')
+        self.assertTrue(self.entered.wait(5))
+        more, more_results = self.run_followers(3, 'key', 'other')
+        self.wait_for_followers(3)
+        self.release.set()
+        for thread in threads + more:
+            thread.join(5)
+        self.assertEqual(self.calls, ['value'])
+        self.assertEqual(results + more_results, ['value'] * 4)
+        self.assertEqual(self.flight.get_stats()['inFlight'], 0)
+
+    def test_concurrent_callers_share_error(self):
+        error = ValueError('failed')
+        threads, results = self.run_followers(3, 'key', 'value', error)
+        self.wait_for_followers(2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results, [error] * 3)
+
+    def test_different_keys_are_not_shared(self):
+        threads, results = self.run_followers(1, 'a', 1)
+        self.assertTrue(self.entered.wait(5))
+        self.assertEqual(self.flight.do('b', lambda: 2), 2)
+        self.release.set()
+        threads[0].join(5)
+        self.assertEqual(results, [1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from axeshome.suggest import PrefixIndex
+
+class PrefixIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex([(u'cat', 3), (u'car', 5), (u'cart', 1),
+            (u'dog', 4)])
+
+    def test_finds_texts_with_prefix_by_weight(self):
+        self.assertEqual(self.index.search(u'ca'),
+            [(u'car', 5), (u'cat', 3), (u'cart', 1)])
+        self.assertEqual(self.index.search(u'car'),
+            [(u'car', 5), (u'cart', 1)])
+        self.assertEqual(self.index.search(u'x'), [])
+        self.assertEqual(len(self.index.search(u'')), 4)
+
+    def test_limit(self):
+        self.assertEqual(self.index.search(u'c', 2), [(u'car', 5), (u'cat', 3)])
+
+    def test_add_and_set(self):
+        self.index.add(u'cat', 3)
+        self.index.add(u'cab')
+        self.index.set(u'car', 1)
+        self.assertEqual(self.index.search(u'ca'),
+            [(u'cat', 6), (u'cab', 1), (u'car', 1), (u'cart', 1)])
+        self.assertEqual(len(self.index), 5)
+
+    def test_bytes_are_decoded(self):
+        self.index.add('caf\xc3\xa9', 2)
+        self.assertEqual(self.index.search('caf'), [(u'caf\xe9', 2)])
+
+    def test_memoized_prefixes_are_updated(self):
+        index = PrefixIndex([(u'a%d' % k, k) for k in range(10)],
+            memo_threshold=2, memo_size=3)
+        self.assertEqual(index.search(u'a', 2), [(u'a9', 9), (u'a8', 8)])
+        index.add(u'a1', 100)
+        self.assertEqual(index.search(u'a', 2), [(u'a1', 101), (u'a9', 9)])
+        index.add(u'b', 1000)
+        self.assertEqual(index.search(u'a', 5),
+            [(u'a1', 101), (u'a9', 9), (u'a8', 8), (u'a7', 7), (u'a6', 6)])
+
+if __name__ == '__main__':
+    unittest.main()
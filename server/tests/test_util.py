@@ -0,0 +1,60 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import unittest
+
+from axeshome.util import canonical_clauses, canonical_query, query_key
+
+class CanonicalQueryTest(unittest.TestCase):
+
+    def test_clauses_are_normalized(self):
+        clauses = canonical_clauses([
+            {'type': 'Speech', 'text': '  Barack   \\(Obama\\) '},
+            {'type': '#instance-i', 'text': ' http://example.com/A.jpg '},
+        ])
+        self.assertEqual(clauses, [
+            {'type': '#instance-i', 'text': 'http://example.com/A.jpg'},
+            {'type': '#speech', 'text': 'barack (obama)'},
+        ])
+
+    def test_clauses_are_sorted_without_duplicates(self):
+        clauses = canonical_clauses([
+            {'type': '#speech', 'text': 'b'},
+            {'type': '#face', 'text': 'a'},
+            {'type': 'SPEECH', 'text': 'B'},
+        ])
+        self.assertEqual(clauses, [{'type': '#face', 'text': 'a'},
+            {'type': '#speech', 'text': 'b'}])
+        self.assertEqual(canonical_clauses(None), [])
+
+    def test_equivalent_queries_have_same_key(self):
+        clauses = [{'type': '#speech', 'text': 'a'},
+            {'type': '#face', 'text': 'b'}]
+        equivalent = [{'type': 'face', 'text': ' B'},
+            {'type': '#speech', 'text': 'a'},
+            {'type': '#speech', 'text': 'A'}]
+        self.assertEqual(query_key('Obama  news', clauses),
+            query_key(' obama news ', equivalent))
+        self.assertEqual(query_key(u'Caf\xe9'), query_key(u'caf\xe9'))
+        self.assertEqual(query_key('obama'), query_key('obama', []))
+
+    def test_different_queries_have_different_keys(self):
+        clauses = [{'type': '#speech', 'text': 'a'}]
+        self.assertNotEqual(query_key('obama'), query_key('obama', clauses))
+        self.assertNotEqual(query_key('a b'), query_key('ab'))
+        self.assertNotEqual(
+            query_key('', [{'type': '#speech', 'text': 'a b'}]),
+            query_key('', [{'type': '#speech', 'text': 'a'},
+                {'type': '#speech', 'text': 'b'}]))
+
+    def test_canonical_query(self):
+        clauses = [{'type': 'Speech', 'text': 'Obama'},
+            {'type': '#face', 'text': 'x'}]
+        self.assertEqual(canonical_query(' Obama ', clauses),
+            'obama #face(x) #speech(obama)')
+        self.assertEqual(canonical_query('', clauses),
+            '#face(x) #speech(obama)')
+        self.assertEqual(canonical_query(' A  b '), 'a b')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#
+# (c) Copyright 2015 Kevin McGuinness. All Rights Reserved.
+#
+import threading
+import unittest
+
+from axeshome.writebehind import WriteBehindQueue, CoalescingCounter
+
+class Writer(object):
+    """
+    Records the batches written. Writes wait until released when blocking.
+    """
+
+    def __init__(self, blocking=False, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.started = threading.Event()
+        self.released = threading.Event()
+        if not blocking:
+            self.released.set()
+
+    def __call__(self, batch):
+        self.started.set()
+        self.released.wait(5)
+        if self.fail:
+            raise IOError('write failed')
+        self.batches.append(batch)
+
+class WriteBehindQueueTest(unittest.TestCase):
+
+    def test_writes_items_in_batches(self):
+        writer = Writer()
+        queue = WriteBehindQueue(writer, batch_size=3, flush_interval=0.01)
+        for item in range(7):
+            self.assertTrue(queue.put(item))
+        queue.close()
+        items = [item for batch in writer.batches for item in batch]
+        self.assertEqual(items, range(7))
+        self.assertTrue(all(len(batch) <= 3 for batch in writer.batches))
+        stats = queue.get_stats()
+        self.assertEqual(stats['queued'], 7)
+        self.assertEqual(stats['written'], 7)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_drops_items_when_full(self):
+        writer = Writer(blocking=True)
+        queue = WriteBehindQueue(writer, max_size=2, batch_size=1,
+            flush_interval=0.01)
+        queue.put('first')
+        self.assertTrue(writer.started.wait(5))
+        self.assertTrue(queue.put('a'))
+        self.assertTrue(queue.put('b'))
+        self.assertFalse(queue.put('c'))
+        writer.released.set()
+        queue.close()
+        self.assertEqual(sorted(item for batch in writer.batches
+            for item in batch), ['a', 'b', 'first'])
+        self.assertEqual(queue.get_stats()['dropped'], 1)
+
+    def test_block_policy_waits_then_drops(self):
+        writer = Writer(blocking=True)
+        queue = WriteBehindQueue(writer, max_size=1, batch_size=1,
+            flush_interval=0.01, policy='block', block_timeout=0.01)
+        queue.put('first')
+        self.assertTrue(writer.started.wait(5))
+        self.assertTrue(queue.put('a'))
+        self.assertFalse(queue.put('b'))
+        writer.released.set()
+        queue.close()
+        self.assertEqual(queue.get_stats()['dropped'], 1)
+
+    def test_counts_failed_writes(self):
+        queue = WriteBehindQueue(Writer(fail=True), flush_interval=0.01)
+        queue.put('a')
+        queue.put('b')
+        queue.close()
+        stats = queue.get_stats()
+        self.assertEqual(stats['failed'], 2)
+        self.assertEqual(stats['written'], 0)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, WriteBehindQueue, Writer(),
+            policy='wait')
+
+class CoalescingCounterTest(unittest.TestCase):
+
+    def test_coalesces_increments(self):
+        writes = []
+        counter = CoalescingCounter(writes.append, flush_interval=60)
+        counter.add('a', 'views')
+        counter.add('a', 'views', 2)
+        counter.add('a', 'likes')
+        counter.add('b', 'views')
+        counter.flush()
+        counter.flush()
+        self.assertEqual(writes, [{'a': {'views': 3, 'likes': 1},
+            'b': {'views': 1}}])
+        self.assertEqual(counter.get_stats()['writes'], 2)
+
+    def test_counts_failed_writes(self):
+        def write(counts):
+            raise IOError('write failed')
+        counter = CoalescingCounter(write, flush_interval=60)
+        counter.add('a', 'views')
+        counter.close()
+        self.assertEqual(counter.get_stats()['failed'], 1)
+
+if __name__ == '__main__':
+    unittest.main()